@@ -0,0 +1,110 @@
+"""
+Process vs thread worker pools for the polygon, mesh and export stages.
+
+    python benchmarks/bench_backends.py --quick
+    python benchmarks/bench_backends.py --sizes 512 2048 --workers 2 4 8
+
+Every stage runs on a fresh pool of each backend, so pool start-up and
+worker imports are part of the process numbers, as they are in the app. The
+summary prints the thread/process time ratio per stage (below 1 means
+threads win); pick per stage with DRUCKEN3D_BACKEND, e.g.
+"polygons=thread,meshes=process,export=thread".
+"""
+import argparse
+import itertools
+import multiprocessing as mp
+import sys
+
+from common import IMAGE_KINDS, PALETTE, make_image, measure, quiet, write_results
+
+from src.lib.mask_creation import generate_shades, segment_to_shades
+from src.lib.mesh_generator import BACKENDS, create_layered_polygons_parallel, polygons_to_meshes_parallel
+from src.lib.planner import plan_memory
+from src.lib.streaming import stream_export
+
+LAYER_HEIGHT = 0.12
+
+
+def bench_case(kind, size, n_filaments, workers, repeats):
+    image = make_image(kind, size)
+    colors = PALETTE[:n_filaments]
+    with quiet():
+        shades = generate_shades(colors, [1.0] + [0.25] * (n_filaments - 1))
+        segmented = segment_to_shades(image, shades)
+        polygons = create_layered_polygons_parallel(segmented, shades)
+
+    n_shades = sum(len(s) for s in shades)
+    stages = {
+        "polygons": lambda plan, backend: create_layered_polygons_parallel(
+            segmented, shades, plan=plan, backend=backend),
+        "meshes": lambda plan, backend: polygons_to_meshes_parallel(
+            segmented, polygons[1:], layer_height=LAYER_HEIGHT, plan=plan, backend=backend),
+        "export": lambda plan, backend: stream_export(
+            segmented, shades, lambda idx, mesh: mesh.export(file_type="stl"),
+            layer_height=LAYER_HEIGHT, plan=plan, backend=backend),
+    }
+
+    results = []
+    print(f"{kind} {size}px, {n_filaments} filaments, {workers} workers")
+    for stage, run in stages.items():
+        for backend in BACKENDS:
+            # a generous budget: only the worker count should differ between runs
+            plan = plan_memory(segmented.size, n_shades, budget=64 * 2**30,
+                               max_processes=workers, backend=backend)
+            _, stats = measure(lambda: run(plan, backend), repeats=repeats, memory=False)
+            case = {"image": kind, "size": size, "filaments": n_filaments,
+                    "workers": workers, "backend": backend}
+            results.append(dict(case=case, stage=stage, **stats))
+            print(f"  {stage:10s} {backend:8s} {stats['seconds']:8.4f}s")
+    return results
+
+
+def summarize(results):
+    by_case = {}
+    for entry in results:
+        case = dict(entry["case"])
+        backend = case.pop("backend")
+        key = (tuple(sorted(case.items())), entry["stage"])
+        by_case.setdefault(key, {})[backend] = entry["seconds"]
+
+    print(f"\n{'stage':10s} {'case':50s} {'process':>9s} {'thread':>9s} {'ratio':>7s}")
+    for (case, stage), times in by_case.items():
+        if len(times) < 2:
+            continue
+        label = ",".join(f"{k}={v}" for k, v in case)
+        ratio = times["thread"] / times["process"] if times["process"] else float("nan")
+        print(f"{stage:10s} {label[:50]:50s} {times['process']:9.4f} {times['thread']:9.4f} {ratio:7.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare process and thread worker pools per stage.")
+    parser.add_argument("--images", nargs="+", default=["logo", "testimg", "noise"], choices=IMAGE_KINDS)
+    parser.add_argument("--sizes", nargs="+", type=int, default=[256, 1024])
+    parser.add_argument("--filaments", nargs="+", type=int, default=[4])
+    parser.add_argument("--workers", nargs="+", type=int, default=[mp.cpu_count()])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--quick", action="store_true", help="one small case per image kind")
+    parser.add_argument("--output", default="bench_backends.json")
+    args = parser.parse_args()
+
+    if args.quick:
+        args.sizes, args.filaments, args.repeats = [256], [3], 1
+
+    # pay the lazy imports once, untimed
+    with quiet():
+        bench_case("logo", 32, 3, 1, repeats=1)
+
+    results = []
+    for kind, size, n, workers in itertools.product(args.images, args.sizes, args.filaments, args.workers):
+        if not 2 <= n <= len(PALETTE):
+            parser.error(f"filament count must be between 2 and {len(PALETTE)}")
+        results.extend(bench_case(kind, size, n, workers, args.repeats))
+
+    summarize(results)
+    write_results(args.output, results, args=vars(args))
+    print(f"\nWrote {len(results)} measurements to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
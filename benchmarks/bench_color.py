@@ -0,0 +1,96 @@
+"""
+sRGB → Lab conversion: colorspace.rgb8_to_lab against skimage's rgb2lab on
+a float64 copy, as segment_to_labels() used to call it.
+
+    python benchmarks/bench_color.py --quick
+    python benchmarks/bench_color.py --sizes 1024 4096 --output color.json
+
+Every case times both converters and the whole segment_to_labels() with
+peak traced memory, and reports the largest Lab difference and the share
+of pixels whose nearest shade changed against the float64 reference.
+"""
+import argparse
+import itertools
+import sys
+
+import numpy as np
+
+from common import IMAGE_KINDS, PALETTE, make_image, measure, quiet, write_results
+
+from src.lib.colorspace import rgb8_to_lab
+from src.lib.mask_creation import generate_shades, segment_to_labels
+
+
+def reference_labels(rgb8, shades):
+    """segment_to_labels() as it was: float64 rgb2lab for pixels and shades."""
+    from skimage.color import rgb2lab
+
+    flat = np.array([s for group in shades for s in group], dtype=float) / 255.0
+    shade_lab = rgb2lab(flat.reshape(1, -1, 3)).reshape(-1, 3)
+    lab = rgb2lab(rgb8 / 255.0).reshape(-1, 3)
+    dists = np.linalg.norm(lab[:, None, :] - shade_lab[None, :, :], axis=2)
+    return np.argmin(dists, axis=1).reshape(rgb8.shape[:2])
+
+
+def bench_case(kind, size, n_filaments, repeats, memory):
+    from skimage.color import rgb2lab
+
+    case = {"image": kind, "size": size, "filaments": n_filaments}
+    rgb8 = np.asarray(make_image(kind, size))
+    with quiet():
+        shades = generate_shades(PALETTE[:n_filaments], [1.0] + [0.25] * (n_filaments - 1))
+
+    print(f"{kind} {size}px, {n_filaments} filaments")
+    results = []
+
+    def run(stage, func, **extra):
+        result, stats = measure(func, repeats=repeats, memory=memory)
+        results.append(dict(case=case, stage=stage, **stats, **extra))
+        peak = f"{stats['peak_bytes'] / 2**20:8.1f} MiB" if stats["peak_bytes"] is not None else ""
+        print(f"  {stage:24s} {stats['seconds']:8.4f}s {peak}")
+        return result, stats
+
+    reference, base = run("rgb2lab", lambda: rgb2lab(rgb8 / 255.0))
+    lab, fast = run("rgb8_to_lab", lambda: rgb8_to_lab(rgb8))
+    error = float(np.abs(reference - lab).max())
+    labels, _ = run("segment_to_labels", lambda: segment_to_labels(rgb8, shades))
+    changed = float(np.mean(labels != reference_labels(rgb8, shades)))
+    results[-1].update(changed_pixels=changed)
+
+    ratio = base["seconds"] / fast["seconds"]
+    memory_note = ""
+    if fast["peak_bytes"]:
+        memory_note = f", {fast['peak_bytes'] / base['peak_bytes']:.2f}× the memory"
+    print(f"  → {ratio:.1f}× faster{memory_note}, max |ΔLab| {error:.2e}, "
+          f"{changed:.4%} of pixels changed shade")
+    results[1].update(speedup=ratio, max_error=error)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the float32 sRGB→Lab converter.")
+    parser.add_argument("--images", nargs="+", default=["gradient", "noise", "testimg"], choices=IMAGE_KINDS)
+    parser.add_argument("--sizes", nargs="+", type=int, default=[512, 2048])
+    parser.add_argument("--filaments", nargs="+", type=int, default=[4])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc runs")
+    parser.add_argument("--quick", action="store_true", help="one small case per image kind")
+    parser.add_argument("--output", default="bench_color.json")
+    args = parser.parse_args()
+
+    if args.quick:
+        args.sizes, args.repeats = [256], 1
+
+    results = []
+    for kind, size, n in itertools.product(args.images, args.sizes, args.filaments):
+        if not 2 <= n <= len(PALETTE):
+            parser.error(f"filament count must be between 2 and {len(PALETTE)}")
+        results.extend(bench_case(kind, size, n, args.repeats, not args.no_memory))
+
+    write_results(args.output, results, args=vars(args))
+    print(f"\nWrote {len(results)} measurements to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""
+Speed versus fidelity of pipeline configurations.
+
+Every configuration is timed like in bench_pipeline.py, and its polygons (and
+with --meshes its extruded slabs) are rasterized back onto the pixel grid and
+scored per layer against the counts map of the default segmentation:
+
+    python benchmarks/bench_fidelity.py --quick
+    python benchmarks/bench_fidelity.py --configs default simplify=1.0 --meshes
+
+The table lists time, vertex count, worst and mean IoU and the worst
+Hausdorff distance in pixels; per-layer scores go to the JSON output. A new
+fast path should add a configuration here so its accuracy cost is measured
+next to its speed-up.
+"""
+import argparse
+import itertools
+import sys
+
+import numpy as np
+import shapely
+
+from common import IMAGE_KINDS, PALETTE, make_image, measure, quiet, write_results
+
+from src.lib.fidelity import compare_meshes, compare_polygons, summarize
+from src.lib.mask_creation import generate_shades, segment_to_shades
+from src.lib.mesh_generator import (
+    build_counts_map,
+    create_layered_polygons_parallel,
+    outline_options,
+    polygons_to_meshes_parallel,
+)
+from src.lib.planner import plan_memory
+
+LAYER_HEIGHT = 0.12
+TARGET_MAX_CM = 10
+
+
+def polygons_config(chunk_rows=None, backend=None, workers=None, simplify_tol=None, min_area=None,
+                    contours=None, print_scale=False):
+    """
+    A run(image, shades) → (segmented, layered polygons, their filaments) for one set of options.
+    With `print_scale` the outlines are simplified for a TARGET_MAX_CM print
+    with the default nozzle, else at the pixel-scale defaults; `simplify_tol`
+    and `min_area` override either.
+    """
+    def run(image, shades):
+        segmented = segment_to_shades(image, shades, chunk_rows=chunk_rows)
+        n_shades = sum(len(s) for s in shades)
+        plan = workers and plan_memory(segmented.size, n_shades, budget=64 * 2**30,
+                                       max_processes=workers, backend=backend or "process")
+        outline = outline_options(segmented.size, print_scale and TARGET_MAX_CM, contours=contours)
+        if simplify_tol is not None:
+            outline["simplify_tol"] = simplify_tol
+        if min_area is not None:
+            outline["min_area"] = min_area
+        layered, filaments = create_layered_polygons_parallel(segmented, shades, plan=plan, backend=backend,
+                                                              outline=outline, return_filaments=True)
+        return segmented, layered, filaments
+    return run
+
+
+CONFIGS = {
+    "default": polygons_config(),
+    "chunked": polygons_config(chunk_rows=32),
+    "thread": polygons_config(backend="thread"),
+    "split": polygons_config(workers=4),
+    "simplify=1.0": polygons_config(simplify_tol=1.0),
+    "simplify=2.0": polygons_config(simplify_tol=2.0),
+    "min_area=4": polygons_config(min_area=4),
+    "pixel_edges": polygons_config(contours="pixel"),
+    "pixel_edges+simplify=0.5": polygons_config(contours="pixel", simplify_tol=0.5),
+    "print_scale": polygons_config(print_scale=True),
+    "print_scale+pixel_edges": polygons_config(contours="pixel", print_scale=True),
+}
+
+
+def bench_case(kind, size, n_filaments, configs, repeats, meshes):
+    case = {"image": kind, "size": size, "filaments": n_filaments}
+    image = make_image(kind, size)
+    with quiet():
+        shades = generate_shades(PALETTE[:n_filaments], [1.0] + [0.25] * (n_filaments - 1))
+        reference = build_counts_map(np.array(segment_to_shades(image, shades).convert("RGBA")), shades)
+
+    results = []
+    print(f"{kind} {size}px, {n_filaments} filaments")
+    for name in configs:
+        (segmented, layered, filaments), stats = measure(lambda: CONFIGS[name](image, shades), repeats=repeats, memory=False)
+        groups = [g for layer in layered[1:] for g in layer if g]
+        vertices = int(sum(shapely.get_num_coordinates(g).sum() for g in groups))
+        scores = compare_polygons(reference, layered, filaments)
+        results.append(dict(case=case, stage=f"{name}/polygons", **stats, vertices=vertices,
+                            **summarize(scores), scores=scores))
+        report(f"{name}/polygons", stats["seconds"], vertices, summarize(scores))
+
+        if meshes:
+            scale_xy = TARGET_MAX_CM * 10 / max(segmented.size)
+            placed, stats = measure(lambda: polygons_to_meshes_parallel(
+                segmented, layered[1:], layer_height=LAYER_HEIGHT, target_max_cm=TARGET_MAX_CM),
+                repeats=repeats, memory=False)
+            triangles = sum(len(m.faces) for m in placed)
+            scores = compare_meshes(reference, layered, filaments, placed, scale_xy)
+            results.append(dict(case=case, stage=f"{name}/meshes", **stats, triangles=triangles,
+                                **summarize(scores), scores=scores))
+            report(f"{name}/meshes", stats["seconds"], triangles, summarize(scores))
+    return results
+
+
+def report(stage, seconds, size, summary):
+    print(f"  {stage:24s} {seconds:8.4f}s {size:9d} {summary['min_iou']:8.4f} "
+          f"{summary['mean_iou']:8.4f} {summary['max_hausdorff']:8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time pipeline configurations and score their geometry.")
+    parser.add_argument("--images", nargs="+", default=["logo", "testimg", "noise"], choices=IMAGE_KINDS)
+    parser.add_argument("--sizes", nargs="+", type=int, default=[256, 512])
+    parser.add_argument("--filaments", nargs="+", type=int, default=[4])
+    parser.add_argument("--configs", nargs="+", default=list(CONFIGS), choices=list(CONFIGS))
+    parser.add_argument("--meshes", action="store_true", help="also extrude and score the slabs")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--quick", action="store_true", help="one small case per image kind")
+    parser.add_argument("--output", default="bench_fidelity.json")
+    args = parser.parse_args()
+
+    if args.quick:
+        args.sizes, args.filaments, args.repeats = [128], [3], 1
+
+    # pay the lazy imports once, untimed
+    with quiet():
+        bench_case("logo", 32, 3, ["default"], repeats=1, meshes=args.meshes)
+
+    print(f"  {'configuration':24s} {'time':>9s} {'verts/tri':>9s} {'min IoU':>8s} {'mean IoU':>8s} {'max HD':>8s}")
+    results = []
+    for kind, size, n in itertools.product(args.images, args.sizes, args.filaments):
+        if not 2 <= n <= len(PALETTE):
+            parser.error(f"filament count must be between 2 and {len(PALETTE)}")
+        results.extend(bench_case(kind, size, n, args.configs, args.repeats, args.meshes))
+
+    write_results(args.output, results, args=vars(args))
+    print(f"\nWrote {len(results)} measurements to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+"""
+NumPy against Numba kernels for the per-pixel hot paths: nearest-shade
+classification, the counts map, and thresholding the counts map into
+bit-packed masks and into labelled components.
+
+    python benchmarks/bench_kernels.py --quick
+    python benchmarks/bench_kernels.py --sizes 1024 4096 --output kernels.json
+    python benchmarks/bench_kernels.py --check
+
+Both implementations run on the same inputs and their results are checked
+for equality; the Numba kernels are compiled before anything is timed.
+--check only compares the results, untimed, and exits non-zero on a difference.
+Without numba installed only the NumPy path is measured. The other
+benchmarks follow $DRUCKEN3D_KERNELS too, so e.g.
+
+    DRUCKEN3D_KERNELS=numpy python benchmarks/bench_pipeline.py --output numpy.json
+    DRUCKEN3D_KERNELS=numba python benchmarks/bench_pipeline.py --compare numpy.json
+
+compares the whole pipeline on both paths.
+"""
+import argparse
+import contextlib
+import importlib.util
+import itertools
+import os
+import sys
+
+import numpy as np
+
+from common import IMAGE_KINDS, PALETTE, make_image, measure, quiet, write_results
+
+from src.lib.mask_creation import generate_shades, labels_to_image, segment_to_labels
+from src.lib.mesh_generator import build_counts_map, mask_levels, pack_level
+from src.lib.scheduling import label_level
+
+
+@contextlib.contextmanager
+def kernels(name):
+    saved = os.environ.get("DRUCKEN3D_KERNELS")
+    os.environ["DRUCKEN3D_KERNELS"] = name
+    try:
+        yield
+    finally:
+        if saved is None:
+            del os.environ["DRUCKEN3D_KERNELS"]
+        else:
+            os.environ["DRUCKEN3D_KERNELS"] = saved
+
+
+def stages(image, shades):
+    """name → func() of every hot path, on inputs prepared once with the NumPy path."""
+    rgb8 = np.asarray(image)
+    with kernels("numpy"), quiet():
+        seg_arr = np.array(labels_to_image(segment_to_labels(rgb8, shades), shades).convert("RGBA"))
+        counts = build_counts_map(seg_arr, shades)
+    levels = [(cnt, L) for cnt in counts.values() for L in mask_levels(cnt)]
+    return {
+        "classify": lambda: segment_to_labels(rgb8, shades),
+        "counts_map": lambda: build_counts_map(seg_arr, shades),
+        # the kernel at every size, not only from FUSED_PACK_MIN_PIXELS on as in the pipeline
+        "threshold_pack": lambda: [pack_level(cnt, L, min_pixels=0)[0] for cnt, L in levels],
+        "threshold_label": lambda: [label_level(cnt, L)[0] for cnt, L in levels],
+    }
+
+
+def same(a, b):
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(same(a[k], b[k]) for k in a)
+    if isinstance(a, list):
+        return len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+    return np.array_equal(a, b)
+
+
+def case_stages(kind, size, n_filaments):
+    with quiet():
+        shades = generate_shades(PALETTE[:n_filaments], [1.0] + [0.25] * (n_filaments - 1))
+    return stages(make_image(kind, size), shades)
+
+
+def check_case(kind, size, n_filaments):
+    """Run every stage once per implementation, untimed; returns the names of stages whose results differ."""
+    differ = []
+    for stage, func in case_stages(kind, size, n_filaments).items():
+        with kernels("numpy"), quiet():
+            expected = func()
+        with kernels("numba"), quiet():
+            actual = func()
+        equal = same(expected, actual)
+        print(f"  {kind} {size}px, {n_filaments} filaments, {stage}: {'equal' if equal else 'DIFFER'}")
+        if not equal:
+            differ.append(stage)
+    return differ
+
+
+def bench_case(kind, size, n_filaments, implementations, repeats, memory):
+    case = {"image": kind, "size": size, "filaments": n_filaments}
+    funcs = case_stages(kind, size, n_filaments)
+
+    print(f"{kind} {size}px, {n_filaments} filaments")
+    results = []
+    for stage, func in funcs.items():
+        outputs, seconds = {}, {}
+        for name in implementations:
+            with kernels(name):
+                outputs[name], stats = measure(func, repeats=repeats, memory=memory)
+            seconds[name] = stats["seconds"]
+            results.append(dict(case=case, stage=f"{stage}/{name}", **stats))
+            peak = f"{stats['peak_bytes'] / 2**20:8.1f} MiB" if stats["peak_bytes"] is not None else ""
+            print(f"  {stage + '/' + name:24s} {stats['seconds']:8.4f}s {peak}")
+        if len(implementations) > 1:
+            equal = same(outputs["numpy"], outputs["numba"])
+            ratio = seconds["numpy"] / seconds["numba"]
+            results[-1].update(speedup=ratio, equal=equal)
+            print(f"  → numba {ratio:.1f}× faster, results {'equal' if equal else 'DIFFER'}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the NumPy and Numba per-pixel kernels.")
+    parser.add_argument("--images", nargs="+", default=["logo", "testimg", "noise"], choices=IMAGE_KINDS)
+    parser.add_argument("--sizes", nargs="+", type=int, default=[512, 2048])
+    parser.add_argument("--filaments", nargs="+", type=int, default=[4])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc runs")
+    parser.add_argument("--quick", action="store_true", help="one small case per image kind")
+    parser.add_argument("--check", action="store_true",
+                        help="only check that both implementations agree, untimed")
+    parser.add_argument("--output", default="bench_kernels.json")
+    args = parser.parse_args()
+
+    if args.quick:
+        args.sizes, args.repeats = [256], 1
+
+    implementations = ["numpy"]
+    if importlib.util.find_spec("numba") is not None:
+        implementations.append("numba")
+        # compile (or load from the cache) once, untimed
+        with kernels("numba"), quiet():
+            for func in stages(make_image("logo", 32), generate_shades(PALETTE[:3], [1.0, 0.5, 0.5])).values():
+                func()
+    elif args.check:
+        parser.error("--check compares against the Numba kernels, but numba is not installed")
+    else:
+        print("numba is not installed: measuring the NumPy path only")
+
+    cases = list(itertools.product(args.images, args.sizes, args.filaments))
+    if any(not 2 <= n <= len(PALETTE) for *_, n in cases):
+        parser.error(f"filament count must be between 2 and {len(PALETTE)}")
+    if args.check:
+        differ = [stage for case in cases for stage in check_case(*case)]
+        print(f"\n{len(differ)} stage(s) differ" if differ else "\nAll results equal")
+        return 1 if differ else 0
+
+    results = []
+    for kind, size, n in cases:
+        results.extend(bench_case(kind, size, n, implementations, args.repeats, not args.no_memory))
+
+    write_results(args.output, results, args=vars(args), implementations=implementations)
+    print(f"\nWrote {len(results)} measurements to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
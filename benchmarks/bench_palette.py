@@ -0,0 +1,83 @@
+"""
+Palette-suggestion sweep: candidates scored per second by the batched
+palette.score_candidates() against generate_shades() + segment_to_labels()
+on the same sampled grid, one candidate at a time.
+
+    python benchmarks/bench_palette.py --quick
+    python benchmarks/bench_palette.py --filaments 4 5 6 --output palette.json
+
+The loop is only run for --loop candidates and its rate extrapolated.
+"""
+import argparse
+import itertools
+import sys
+
+import numpy as np
+
+from common import IMAGE_KINDS, PALETTE, make_image, measure, quiet, write_results
+
+from src.lib.mask_creation import generate_shades, segment_to_labels
+from src.lib.palette import PaletteSample, candidates, score_candidates
+
+
+def one_by_one(grid, colors, orders, covers):
+    """Per-candidate segmentation, as a redraw would do it."""
+    for order, cover in zip(orders, covers):
+        shades = generate_shades([colors[i] for i in order], list(cover))
+        segment_to_labels(grid, shades)
+
+
+def bench_case(kind, size, n_filaments, loop, repeats):
+    case = {"image": kind, "size": size, "filaments": n_filaments}
+    image = make_image(kind, size)
+    colors = PALETTE[:n_filaments]
+    orders, covers = candidates(n_filaments)
+
+    print(f"{kind} {size}px, {n_filaments} filaments, {len(orders)} candidates")
+    sample, sample_stats = measure(lambda: PaletteSample(image), repeats=repeats, memory=False)
+    _, batched = measure(lambda: score_candidates(sample, colors, orders, covers), repeats=repeats, memory=True)
+    grid = np.ascontiguousarray(np.asarray(image)[::max(1, size // 128), ::max(1, size // 128)])
+    with quiet():
+        _, looped = measure(lambda: one_by_one(grid, colors, orders[:loop], covers[:loop]),
+                            repeats=repeats, memory=False)
+
+    rate = len(orders) / batched["seconds"]
+    loop_rate = min(loop, len(orders)) / looped["seconds"]
+    peak = f", peak {batched['peak_bytes'] / 2**20:.1f} MiB" if batched["peak_bytes"] is not None else ""
+    print(f"  sample {sample_stats['seconds'] * 1e3:.1f} ms, {len(sample.lab)} distinct colours")
+    print(f"  batched {rate:9.0f} candidates/s{peak}")
+    print(f"  one by one {loop_rate:6.0f} candidates/s → {rate / loop_rate:.0f}× faster")
+    return [
+        dict(case=case, stage="PaletteSample", **sample_stats, colours=len(sample.lab)),
+        dict(case=case, stage="score_candidates", **batched, candidates=len(orders), rate=rate),
+        dict(case=case, stage="one_by_one", **looped, candidates=loop, rate=loop_rate),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the batched palette-suggestion sweep.")
+    parser.add_argument("--images", nargs="+", default=["gradient", "noise", "testimg"], choices=IMAGE_KINDS)
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1024])
+    parser.add_argument("--filaments", nargs="+", type=int, default=[3, 4, 5])
+    parser.add_argument("--loop", type=int, default=20, help="candidates segmented one at a time")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--quick", action="store_true", help="one small case per image kind")
+    parser.add_argument("--output", default="bench_palette.json")
+    args = parser.parse_args()
+
+    if args.quick:
+        args.sizes, args.filaments, args.loop, args.repeats = [256], [4], 5, 1
+
+    results = []
+    for kind, size, n in itertools.product(args.images, args.sizes, args.filaments):
+        if not 2 <= n <= len(PALETTE):
+            parser.error(f"filament count must be between 2 and {len(PALETTE)}")
+        results.extend(bench_case(kind, size, n, args.loop, args.repeats))
+
+    write_results(args.output, results, args=vars(args))
+    print(f"\nWrote {len(results)} measurements to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
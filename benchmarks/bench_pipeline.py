@@ -0,0 +1,144 @@
+"""
+Per-stage pipeline benchmark on deterministic inputs.
+
+Sweeps image kind × size × filament count × cover factor and times every
+stage on its own, plus the two parallel stages end to end:
+
+    python benchmarks/bench_pipeline.py --quick
+    python benchmarks/bench_pipeline.py --sizes 256 1024 --output base.json
+    python benchmarks/bench_pipeline.py --compare base.json
+
+Results are written as JSON (best time, all runs, peak traced memory per
+stage). With --compare the run is matched against a saved result file and
+the exit status is 1 if any stage got slower than --threshold.
+"""
+import argparse
+import itertools
+import sys
+from io import BytesIO
+
+import numpy as np
+import shapely
+
+from common import IMAGE_KINDS, PALETTE, compare, make_image, measure, quiet, write_results
+
+from src.lib.geometry import LayeredGeometry
+from src.lib.mask_creation import generate_shades, segment_to_shades
+from src.lib.mesh_generator import (
+    create_layered_polygons_parallel,
+    extract_color_masks,
+    generate_layer_mesh,
+    mask_to_polygons,
+    merge_polys_downward,
+    outline_options,
+    polygons_to_meshes_parallel,
+    prepare_mask_tasks,
+    render_polygons_to_png,
+    unpack_mask,
+)
+
+LAYER_HEIGHT = 0.12
+
+
+def bench_case(kind, size, n_filaments, cover_factor, repeats, memory):
+    case = {"image": kind, "size": size, "filaments": n_filaments, "cover_factor": cover_factor}
+    image = make_image(kind, size)
+    colors = PALETTE[:n_filaments]
+    cover_factors = [1.0] + [cover_factor] * (n_filaments - 1)
+    results = []
+
+    def run(stage, func, setup=None, **extra):
+        result, stats = measure(func, repeats=repeats, memory=memory, setup=setup)
+        results.append(dict(case=case, stage=stage, **stats, **extra))
+        peak = f"{stats['peak_bytes'] / 2**20:8.1f} MiB" if stats["peak_bytes"] is not None else ""
+        print(f"  {stage:32s} {stats['seconds']:8.4f}s {peak}")
+        return result
+
+    print(f"{kind} {size}px, {n_filaments} filaments, cover {cover_factor}")
+    shades = run("generate_shades", lambda: generate_shades(colors, cover_factors))
+    segmented = run("segment_to_shades", lambda: segment_to_shades(image, shades))
+
+    seg_arr = np.array(segmented.convert("RGBA"))
+    run("extract_color_masks", lambda: extract_color_masks(seg_arr, shades))
+
+    with quiet():
+        tasks, _, _ = prepare_mask_tasks(segmented, shades)
+    masks = [unpack_mask(packed) for _, _, packed, *_ in tasks if packed[0].any()]
+    outline = outline_options(segmented.size)
+    polys = run("mask_to_polygons",
+                lambda: [mask_to_polygons(m, **outline) for m in masks],
+                masks=len(masks))
+    vertices = int(sum(shapely.get_num_coordinates(group).sum() for group in polys if group))
+
+    layered = run("create_layered_polygons_parallel",
+                  lambda: create_layered_polygons_parallel(segmented, shades),
+                  vertices=vertices)
+
+    run("merge_polys_downward", merge_polys_downward,
+        setup=lambda: ([[list(g) for g in layer] for layer in layered[1:]],))
+
+    groups = [group for layer in layered[1:] for group in layer]
+    run("generate_layer_mesh", lambda: [generate_layer_mesh(g, LAYER_HEIGHT) for g in groups if g],
+        groups=len(groups))
+
+    run("render_polygons_to_png", lambda: render_polygons_to_png(layered, shades, segmented.size))
+    geometry = run("LayeredGeometry.from_polygons", lambda: LayeredGeometry.from_polygons(layered))
+    results[-1]["bytes"] = geometry.nbytes
+    run("render_polygons_to_png/columnar", lambda: render_polygons_to_png(geometry, shades, segmented.size))
+
+    meshes = run("polygons_to_meshes_parallel",
+                 lambda: polygons_to_meshes_parallel(segmented, layered[1:], layer_height=LAYER_HEIGHT))
+
+    def export_stl():
+        total = 0
+        for mesh in meshes:
+            buf = BytesIO()
+            mesh.export(file_obj=buf, file_type="stl")
+            total += buf.tell()
+        return total
+    stl_bytes = run("stl_export", export_stl, triangles=sum(len(m.faces) for m in meshes))
+    results[-1]["bytes"] = stl_bytes
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage pipeline benchmark.")
+    parser.add_argument("--images", nargs="+", default=list(IMAGE_KINDS), choices=IMAGE_KINDS)
+    parser.add_argument("--sizes", nargs="+", type=int, default=[128, 256, 512])
+    parser.add_argument("--filaments", nargs="+", type=int, default=[3, 5])
+    parser.add_argument("--cover-factors", nargs="+", type=float, default=[0.25, 0.5])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run")
+    parser.add_argument("--quick", action="store_true", help="one small case per image kind")
+    parser.add_argument("--output", default="bench_pipeline.json")
+    parser.add_argument("--compare", metavar="BASELINE", help="result file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed slowdown before flagging")
+    args = parser.parse_args()
+
+    if args.quick:
+        args.sizes, args.filaments, args.cover_factors, args.repeats = [128], [3], [0.25], 1
+
+    # the library imports its heavy dependencies lazily; pay that once, untimed,
+    # so the first measured case is not charged for it
+    with quiet():
+        bench_case("logo", 32, 3, 0.25, repeats=1, memory=False)
+
+    results = []
+    for kind, size, n, cf in itertools.product(args.images, args.sizes, args.filaments, args.cover_factors):
+        if not 2 <= n <= len(PALETTE):
+            parser.error(f"filament count must be between 2 and {len(PALETTE)}")
+        results.extend(bench_case(kind, size, n, cf, args.repeats, not args.no_memory))
+
+    write_results(args.output, results, args=vars(args))
+    print(f"\nWrote {len(results)} measurements to {args.output}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} stage(s) slower than {args.threshold:.0%} over baseline")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
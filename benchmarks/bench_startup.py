@@ -0,0 +1,112 @@
+"""
+Startup cost: how long importing each entry module takes, which imported
+modules dominate, and how long a pool worker needs before its first task.
+
+    python benchmarks/bench_startup.py [--top 15] [--json out.json]
+
+Every measurement runs in a fresh interpreter so nothing is already cached
+in sys.modules. Run it from a checkout; the package is imported as `src`.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import REPO_ROOT
+
+ENTRY_MODULES = [
+    "src.lib.mask_creation",
+    "src.lib.mesh_generator",
+    "src.lib.streaming",
+    "src.cli",
+    "src.window",  # needs PyGObject; reported as skipped without it
+]
+
+WORKER_PROBE = """
+import multiprocessing as mp, time
+def first_task(_):
+    from src.lib import mesh_generator
+    return 0
+if __name__ == "__main__":
+    ctx = mp.get_context({method!r})
+    t0 = time.perf_counter()
+    with ctx.Pool(processes=1) as pool:
+        pool.map(first_task, [0])
+    print(time.perf_counter() - t0)
+"""
+
+
+def _python(args, **kwargs):
+    return subprocess.run([sys.executable] + args, cwd=REPO_ROOT, capture_output=True, text=True, **kwargs)
+
+
+def import_profile(module):
+    """Wall time of `import module` plus the cumulative cost of every top-level package."""
+    t0 = time.perf_counter()
+    proc = _python(["-X", "importtime", "-c", f"import {module}"])
+    wall = time.perf_counter() - t0
+    if proc.returncode != 0:
+        return None
+
+    # -X importtime lines: "import time: self [us] | cumulative | imported package";
+    # every package is imported once, so its own line carries its full cost
+    packages = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        if "." not in name and not name.startswith("_"):
+            packages[name] = int(cumulative_us) / 1e6
+    return {"wall_s": wall, "imports_s": packages}
+
+
+def worker_spinup(method):
+    # spawned children re-import __main__, so the probe must live in a real file
+    with tempfile.NamedTemporaryFile("w", suffix=".py", delete=False) as f:
+        f.write(WORKER_PROBE.format(method=method))
+    try:
+        proc = _python([f.name], timeout=120, env=dict(os.environ, PYTHONPATH=REPO_ROOT))
+    except subprocess.TimeoutExpired:
+        return None
+    finally:
+        os.unlink(f.name)
+    if proc.returncode != 0:
+        return None
+    return float(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--top", type=int, default=10, help="heaviest imports to list per module")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = {"python": sys.version.split()[0], "modules": {}, "worker_spinup_s": {}}
+    for module in ENTRY_MODULES:
+        profile = import_profile(module)
+        results["modules"][module] = profile
+        if profile is None:
+            print(f"{module:28s} skipped (import failed)")
+            continue
+        print(f"{module:28s} {profile['wall_s']:.3f}s wall")
+        heaviest = sorted(profile["imports_s"].items(), key=lambda kv: -kv[1])[:args.top]
+        for name, seconds in heaviest:
+            print(f"    {name:32s} {seconds:.3f}s")
+
+    import multiprocessing as mp
+    for method in mp.get_all_start_methods():
+        seconds = worker_spinup(method)
+        results["worker_spinup_s"][method] = seconds
+        print(f"worker spin-up ({method:10s}) " + (f"{seconds:.3f}s" if seconds is not None else "failed"))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Shared helpers for the benchmark scripts: deterministic inputs, timing with
+peak memory, and machine-readable results that can be compared to a baseline.
+"""
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+TEST_IMAGE = os.path.join(REPO_ROOT, "testimg.png")
+
+# Filaments ordered from base (dark) to top (light); a palette of n uses the first n
+PALETTE = [
+    (20, 20, 20),
+    (200, 40, 40),
+    (40, 90, 200),
+    (60, 170, 80),
+    (230, 200, 40),
+    (245, 245, 245),
+]
+
+SEED = 1234
+
+
+def make_image(kind, size):
+    """Deterministic square RGB test image of the given kind and edge length."""
+    if kind == "gradient":
+        x = np.linspace(0, 255, size, dtype=np.float32)
+        r = np.tile(x, (size, 1))
+        g = r.T
+        b = np.full((size, size), 128, dtype=np.float32)
+        arr = np.stack([r, g, b], axis=2).astype(np.uint8)
+        return Image.fromarray(arr, mode="RGB")
+    if kind == "noise":
+        rng = np.random.default_rng(SEED)
+        return Image.fromarray(rng.integers(0, 256, (size, size, 3), dtype=np.uint8), mode="RGB")
+    if kind == "logo":
+        # flat-colour shapes: few, large regions with holes
+        image = Image.new("RGB", (size, size), (245, 245, 245))
+        draw = ImageDraw.Draw(image)
+        s = size / 100
+        draw.ellipse([10 * s, 10 * s, 90 * s, 90 * s], fill=(20, 20, 20))
+        draw.ellipse([25 * s, 25 * s, 75 * s, 75 * s], fill=(200, 40, 40))
+        draw.rectangle([40 * s, 5 * s, 60 * s, 95 * s], fill=(40, 90, 200))
+        draw.ellipse([45 * s, 45 * s, 55 * s, 55 * s], fill=(245, 245, 245))
+        return image
+    if kind == "testimg":
+        with Image.open(TEST_IMAGE) as image:
+            image = image.convert("RGB")
+            w, h = image.size
+            scale = size / max(w, h)
+            return image.resize((max(1, round(w * scale)), max(1, round(h * scale))), Image.LANCZOS)
+    raise ValueError(f"Unknown image kind {kind!r}")
+
+
+IMAGE_KINDS = ("gradient", "noise", "logo", "testimg")
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silence the pipeline's progress prints while measuring."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def measure(func, repeats=3, memory=True, setup=None):
+    """
+    Time func() `repeats` times (best and all runs) and, in a separate run under
+    tracemalloc, its peak Python/NumPy allocation. `setup` returns fresh
+    arguments per run for functions that mutate their input.
+    Returns (result of the last run, stats dict).
+    """
+    times = []
+    result = None
+    for _ in range(repeats):
+        args = setup() if setup else ()
+        with quiet():
+            t0 = time.perf_counter()
+            result = func(*args)
+            times.append(time.perf_counter() - t0)
+
+    peak = None
+    if memory:
+        args = setup() if setup else ()
+        tracemalloc.start()
+        try:
+            with quiet():
+                func(*args)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return result, {"seconds": min(times), "runs": times, "peak_bytes": peak}
+
+
+def environment():
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                             capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        rev = None
+    return {
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "git_rev": rev,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def write_results(path, results, **meta):
+    with open(path, "w") as f:
+        json.dump({"meta": dict(environment(), **meta), "results": results}, f, indent=2)
+
+
+def case_key(entry):
+    return json.dumps(entry["case"], sort_keys=True), entry["stage"]
+
+
+def compare(results, baseline_path, threshold=0.15):
+    """
+    Print the time ratio of every (case, stage) present in both runs and
+    return the entries that got slower than `threshold` (0.15 = 15%).
+    """
+    with open(baseline_path) as f:
+        baseline = {case_key(e): e for e in json.load(f)["results"]}
+
+    regressions = []
+    print(f"\n{'stage':32s} {'case':60s} {'base':>9s} {'now':>9s} {'ratio':>7s}")
+    for entry in results:
+        old = baseline.get(case_key(entry))
+        if old is None or not old["seconds"]:
+            continue
+        ratio = entry["seconds"] / old["seconds"]
+        flag = " !" if ratio > 1 + threshold else ""
+        case = ",".join(f"{k}={v}" for k, v in sorted(entry["case"].items()))
+        print(f"{entry['stage']:32s} {case[:60]:60s} {old['seconds']:9.4f} {entry['seconds']:9.4f} {ratio:7.2f}{flag}")
+        if flag:
+            regressions.append(entry)
+    return regressions
@@ -0,0 +1,269 @@
+"""
+Headless batch conversion: images in, ZIP archives of STL meshes out.
+
+    drucken3d-cli --settings palette.json --output out/ images/ extra.png
+
+The settings file is JSON:
+
+    {
+      "filaments": [
+        {"color": "#1a1a1a", "cover_factor": 1.0},
+        {"color": "#d04040", "cover_factor": 0.25},
+        {"color": "#ffffff", "cover_factor": 0.25}
+      ],
+      "layer_height": 0.12,
+      "base_layers": 2,
+      "max_size_cm": 25.0,
+      "nozzle_mm": 0.4
+    }
+
+Filaments are listed from the base (printed first) to the top, i.e. in the
+reverse order of the list in the window. Nothing here imports GTK.
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from io import BytesIO
+
+from .lib.artifact_cache import ArtifactCache
+from .lib.disk_cache import DiskCache
+from .lib.ingest import decode_image, open_header, working_max_side, working_size
+from .lib.mask_creation import generate_shades, segment_to_shades
+from .lib.mesh_generator import BACKENDS, default_backend, make_pool
+from .lib.planner import default_budget, parse_size, plan_memory
+from .lib.streaming import stream_export
+from .lib.tracing import Trace, maybe_recording, span
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+# Same defaults as the export settings in the window
+DEFAULT_SETTINGS = {
+    "layer_height": 0.12,
+    "base_layers": 2,
+    "max_size_cm": 25.0,
+    "nozzle_mm": 0.4,
+}
+
+
+def parse_color(value):
+    """Accept "#rrggbb" or [r, g, b] and return an (R, G, B) tuple of ints."""
+    if isinstance(value, str):
+        text = value.lstrip("#")
+        if len(text) != 6:
+            raise ValueError(f"Invalid colour {value!r}, expected #rrggbb")
+        return tuple(int(text[i:i + 2], 16) for i in (0, 2, 4))
+    if isinstance(value, (list, tuple)) and len(value) == 3:
+        return tuple(int(c) for c in value)
+    raise ValueError(f"Invalid colour {value!r}")
+
+
+def load_settings(path):
+    with open(path) as f:
+        return parse_settings(json.load(f))
+
+
+def parse_settings(raw):
+    """Validate a decoded settings document (see the module docstring)."""
+    if not isinstance(raw, dict):
+        raise ValueError("Settings must be a JSON object")
+    filaments = raw.get("filaments") or []
+    if len(filaments) < 2:
+        raise ValueError("Settings need at least 2 filaments")
+
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update({k: raw[k] for k in DEFAULT_SETTINGS if k in raw})
+    settings["colors"] = [parse_color(f["color"]) for f in filaments]
+    settings["cover_factors"] = [float(f.get("cover_factor", 0.25)) for f in filaments]
+    for cf in settings["cover_factors"][1:]:
+        if not 0 < cf <= 1:
+            raise ValueError(f"Cover factor {cf} is outside (0, 1]")
+    if not float(settings["nozzle_mm"]) > 0:
+        raise ValueError(f"Nozzle width {settings['nozzle_mm']} must be positive")
+    return settings
+
+
+def collect_images(inputs, recursive=False):
+    """Expand files and directories into a sorted list of image paths."""
+    images = []
+    for item in inputs:
+        if os.path.isdir(item):
+            if recursive:
+                for dirpath, _, filenames in os.walk(item):
+                    images.extend(os.path.join(dirpath, n) for n in filenames
+                                  if n.lower().endswith(IMAGE_EXTENSIONS))
+            else:
+                images.extend(os.path.join(item, n) for n in os.listdir(item)
+                              if n.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            images.append(item)
+    return sorted(images)
+
+
+def largest_image_size(paths, max_side=None):
+    """
+    (w, h) of the image with the most pixels, reading only the headers. With
+    `max_side`, sizes are those decode_image() reduces the images to.
+    """
+    largest = (1, 1)
+    for path in paths:
+        try:
+            with open_header(path) as image:
+                size = working_size(image.size, max_side)
+        except OSError:
+            continue  # reported when the image is converted
+        if size[0] * size[1] > largest[0] * largest[1]:
+            largest = size
+    return largest
+
+
+def convert_image(path, settings, shades, output_dir, pool, caches=None, trace=None, plan=None):
+    """Convert one image into <output_dir>/<name>.zip. Returns (zip path, mesh count)."""
+    with maybe_recording(trace), span("convert_image", image=path):
+        return _convert_image(path, settings, shades, output_dir, pool, caches or {}, plan)
+
+
+def _convert_image(path, settings, shades, output_dir, pool, caches, plan):
+    name = os.path.splitext(os.path.basename(path))[0]
+    zip_path = os.path.join(output_dir, f"{name}.zip")
+    image = decode_image(path, working_max_side(settings["max_size_cm"]))
+    try:
+        count = convert_to_zip(image, settings, shades, zip_path, pool, caches, plan)
+    finally:
+        image.close()
+    return zip_path, count
+
+
+def convert_to_zip(image, settings, shades, output, pool, caches=None, plan=None, progress_cb=None):
+    """
+    Segment `image` and stream its meshes into a ZIP archive at `output`, a
+    path or a writable (even unseekable) file. Returns the mesh count.
+    """
+    caches = caches or {}
+    segmented = segment_to_shades(image, shades, cache=caches.get("labels"),
+                                  chunk_rows=plan and plan.chunk_rows)
+
+    with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        def _write_mesh(idx, mesh):
+            buf = BytesIO()
+            mesh.export(file_obj=buf, file_type="stl")
+            archive.writestr(f"mesh_{idx}.stl", buf.getvalue())
+
+        return stream_export(
+            segmented,
+            shades,
+            _write_mesh,
+            layer_height=settings["layer_height"],
+            base_layers=settings["base_layers"],
+            target_max_cm=settings["max_size_cm"],
+            nozzle_mm=settings["nozzle_mm"],
+            progress_cb=progress_cb,
+            cache=caches.get("meshes"),
+            polygon_cache=caches.get("polygons"),
+            pool=pool,
+            plan=plan,
+        )
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="drucken3d-cli",
+        description="Convert images into layered STL meshes without the GUI.",
+    )
+    parser.add_argument("inputs", nargs="+", help="image files or directories of images")
+    parser.add_argument("-s", "--settings", required=True, help="JSON palette/settings file")
+    parser.add_argument("-o", "--output", default=".", help="directory for the ZIP archives")
+    parser.add_argument("-r", "--recursive", action="store_true", help="descend into subdirectories")
+    parser.add_argument("-w", "--workers", type=int, default=mp.cpu_count(),
+                        help="worker processes shared by all images (default: CPU count)")
+    parser.add_argument("-j", "--jobs", type=int, default=2,
+                        help="images in flight at once; their tasks share the worker pool (default: 2)")
+    parser.add_argument("--cache", action="store_true",
+                        help="reuse label maps, polygons and meshes from the on-disk cache")
+    parser.add_argument("--backend", choices=BACKENDS, default=None,
+                        help="worker pool type: processes, or threads sharing memory with the CLI "
+                             "(default: $DRUCKEN3D_BACKEND, else process)")
+    parser.add_argument("--memory-budget", metavar="SIZE", type=parse_size,
+                        help="memory to plan the run for, e.g. 8G (default: $DRUCKEN3D_MEMORY_BUDGET "
+                             "or 60%% of the available memory); may lower --workers")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="write per-stage and per-task timings to FILE (JSON; "
+                             "a name ending in .chrome.json gives the Chrome trace format)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    try:
+        settings = load_settings(args.settings)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"drucken3d-cli: cannot read settings: {e}", file=sys.stderr)
+        return 2
+
+    images = collect_images(args.inputs, args.recursive)
+    if not images:
+        print("drucken3d-cli: no images found", file=sys.stderr)
+        return 2
+    os.makedirs(args.output, exist_ok=True)
+
+    # shades only depend on the palette, so they are computed once for the batch
+    shades = generate_shades(settings["colors"], settings["cover_factors"])
+
+    caches = {}
+    if args.cache:
+        disk = DiskCache()
+        caches = {
+            "labels": ArtifactCache(max_entries=4, backing=disk),
+            "polygons": ArtifactCache(backing=disk),
+            "meshes": ArtifactCache(max_entries=256, backing=disk),
+        }
+
+    try:
+        backend = args.backend or default_backend("export")
+    except ValueError as e:
+        print(f"drucken3d-cli: {e}", file=sys.stderr)
+        return 2
+
+    # plan for the largest image, with --jobs of them in flight at once
+    jobs = max(1, min(args.jobs, len(images)))
+    n_shades = sum(len(s) for s in shades)
+    largest = largest_image_size(images, working_max_side(settings["max_size_cm"]))
+    plan = plan_memory(largest, n_shades, budget=args.memory_budget or default_budget(),
+                       max_processes=max(1, args.workers), concurrent_images=jobs, backend=backend)
+    print(plan.describe())
+
+    trace = Trace() if args.trace else None
+    failures = 0
+    t0 = time.perf_counter()
+    with make_pool(plan.processes, backend) as pool:
+        # each image thread only coordinates; the heavy tasks of every image
+        # land in the same process pool so cores stay busy across images
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {
+                executor.submit(convert_image, path, settings, shades, args.output, pool, caches, trace, plan): path
+                for path in images
+            }
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    zip_path, count = future.result()
+                    print(f"{path} → {zip_path} ({count} meshes)")
+                except Exception as e:
+                    failures += 1
+                    print(f"drucken3d-cli: {path}: {e}", file=sys.stderr)
+
+    print(f"Converted {len(images) - failures}/{len(images)} images in {time.perf_counter() - t0:0.1f}s")
+    if trace is not None:
+        print(trace.format_summary())
+        trace.save(args.trace)
+        print(f"Trace written to {args.trace}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def mask_digest(mask, *params):
+    """
+    Content hash of a boolean mask plus any parameters that influence what is
+    derived from it (tolerances, image height, ...). Two masks with the same
+    digest produce the same polygons, whichever shades or filament they came from.
+    """
+    return packed_mask_digest((np.packbits(mask, axis=None), mask.shape), *params)
+
+
+def packed_mask_digest(packed, *params):
+    """mask_digest() of a mask bit-packed as (np.packbits(mask, axis=None), mask.shape)."""
+    bits, shape = packed
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr((tuple(shape), params)).encode())
+    h.update(bits.tobytes())
+    return h.hexdigest()
+
+
+def image_digest(image):
+    """
+    Content hash of a PIL image or ingest.SourceImage: mode, size and raw
+    pixel bytes. A SourceImage hashes like the RGB PIL image it stands for,
+    band by band so a memory-mapped one is never copied whole.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr((image.mode, image.size)).encode())
+    pixels = getattr(image, "pixels", None)
+    if pixels is None:
+        h.update(image.tobytes())
+    else:
+        for top in range(0, len(pixels), 1024):
+            h.update(np.ascontiguousarray(pixels[top:top + 1024]))
+    return h.hexdigest()
+
+
+def polygons_digest(polygons, *params):
+    """Content hash of a polygon group (a geometry or list of geometries) via WKB."""
+    import shapely
+
+    geoms = polygons if isinstance(polygons, (list, tuple)) else [polygons]
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr(params).encode())
+    for wkb in shapely.to_wkb(list(geoms)):
+        h.update(wkb)
+    return h.hexdigest()
+
+
+class ArtifactCache:
+    """
+    Thread-safe in-memory LRU for intermediate pipeline results.
+
+    Keys are tuples starting with the artifact kind, e.g. ("polygons", digest),
+    so a single cache can hold every stage without collisions. An optional
+    `backing` store (see DiskCache) is consulted on misses and written through
+    on puts for the kinds it supports, which makes results survive restarts.
+    """
+
+    def __init__(self, max_entries=512, backing=None):
+        self.max_entries = max_entries
+        self.backing = backing
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        if self.backing is not None and self.backing.supports(key):
+            value = self.backing.get(key)
+            if value is not None:
+                self._store(key, value)
+                self.hits += 1
+                return value
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        self._store(key, value)
+        if self.backing is not None and self.backing.supports(key):
+            self.backing.put(key, value)
+
+    def _store(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
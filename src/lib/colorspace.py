@@ -0,0 +1,61 @@
+import numpy as np
+
+# Pixels converted per block: the block's float32 scratch arrays stay in L2
+BLOCK_PIXELS = 1 << 14
+
+# sRGB → XYZ and the D65 / 2° reference white, as skimage.color.rgb2lab uses them
+_XYZ_FROM_RGB = np.array([[0.412453, 0.357580, 0.180423],
+                          [0.212671, 0.715160, 0.072169],
+                          [0.019334, 0.119193, 0.950227]])
+_WHITE = np.array([0.95047, 1.0, 1.08883])
+# applied to row vectors, with the white point folded in
+XYZ_RELATIVE = (_XYZ_FROM_RGB / _WHITE[:, None]).T.astype(np.float32)
+
+# Inputs are 8-bit, so the sRGB transfer curve is one lookup per channel
+_v = np.arange(256) / 255.0
+SRGB_TO_LINEAR = np.where(_v > 0.04045, ((_v + 0.055) / 1.055) ** 2.4, _v / 12.92).astype(np.float32)
+del _v
+
+
+def rgb8_to_lab(rgb8, out=None, block_pixels=BLOCK_PIXELS):
+    """
+    CIE Lab of `rgb8`, an (..., 3) uint8 array, as float32 — rgb2lab() to
+    within float32 rounding. The pixels are converted a block at a time
+    through fixed scratch buffers, so the only full-size allocation is the
+    result, which can be passed in as `out`.
+    """
+    rgb8 = np.asarray(rgb8)
+    if rgb8.dtype != np.uint8 or rgb8.shape[-1] != 3:
+        raise ValueError(f"expected (..., 3) uint8 pixels, got {rgb8.dtype} {rgb8.shape}")
+    if out is None:
+        out = np.empty(rgb8.shape, dtype=np.float32)
+    elif out.shape != rgb8.shape or out.dtype != np.float32 or not out.flags.c_contiguous:
+        raise ValueError("out must be a C-contiguous float32 array shaped like the input")
+    if rgb8.size == 0:
+        return out  # no pixels: range() rejects the zero block size
+
+    pixels = rgb8.reshape(-1, 3)
+    lab = out.reshape(-1, 3)
+    block = min(block_pixels, len(pixels))
+    linear = np.empty((block, 3), dtype=np.float32)
+    xyz = np.empty((block, 3), dtype=np.float32)
+    f = np.empty((block, 3), dtype=np.float32)
+
+    for start in range(0, len(pixels), block):
+        stop = min(start + block, len(pixels))
+        n = stop - start
+        np.take(SRGB_TO_LINEAR, pixels[start:stop], out=linear[:n])
+        np.matmul(linear[:n], XYZ_RELATIVE, out=xyz[:n])
+        np.cbrt(xyz[:n], out=f[:n])
+        small = xyz[:n] <= 0.008856
+        f[:n][small] = xyz[:n][small] * 7.787 + 16 / 116
+
+        fx, fy, fz = f[:n, 0], f[:n, 1], f[:n, 2]
+        L, a, b = lab[start:stop, 0], lab[start:stop, 1], lab[start:stop, 2]
+        np.multiply(fy, 116, out=L)
+        L -= 16
+        np.subtract(fx, fy, out=a)
+        a *= 500
+        np.subtract(fy, fz, out=b)
+        b *= 200
+    return out
@@ -0,0 +1,193 @@
+import numpy as np
+
+# Where mask_to_polygons() gets its rings from:
+# - "marching": skimage's marching squares at level 0.5, which cuts every
+#   pixel corner with a half-pixel diagonal
+# - "pixel": the pixel edges, one vertex per corner of the outline, with
+#   one-pixel staircases collapsed into diagonals (see collapse_staircases())
+CONTOUR_SOURCES = ("marching", "pixel")
+
+# Directions along the lattice of pixel corners as (row, col) steps: east,
+# south, west, north. A right turn is the next one, a left turn the previous.
+_STEPS = np.array([(0, 1), (1, 0), (0, -1), (-1, 0)])
+_E, _S, _W, _N = range(4)
+
+
+def default_contour_source():
+    """$DRUCKEN3D_CONTOURS, "marching" by default."""
+    import os
+
+    source = os.environ.get("DRUCKEN3D_CONTOURS", "").strip() or "marching"
+    if source not in CONTOUR_SOURCES:
+        raise ValueError(f"Unknown contour source {source!r}, expected one of {CONTOUR_SOURCES}")
+    return source
+
+
+def _runs(lines, starts, stops, direction):
+    """
+    Merge unit edges on the same lattice line into maximal runs. Edges are
+    given by (line, start, stop) along the line and all point the same way.
+    """
+    if not len(lines):
+        return np.empty((0, 3), dtype=np.int64)
+    order = np.lexsort((starts, lines))
+    lines, starts, stops = lines[order], starts[order], stops[order]
+    lo, hi = np.minimum(starts, stops), np.maximum(starts, stops)
+    # a run continues while the next edge is on the same line and starts where this one stops
+    breaks = np.flatnonzero((lines[1:] != lines[:-1]) | (lo[1:] != hi[:-1])) + 1
+    first = np.concatenate(([0], breaks))
+    last = np.concatenate((breaks - 1, [len(lines) - 1]))
+    run_lo, run_hi = lo[first], hi[last]
+    forward = _STEPS[direction].sum() > 0
+    begin, end = (run_lo, run_hi) if forward else (run_hi, run_lo)
+    return np.stack([lines[first], begin, end], axis=1)
+
+
+def trace_pixel_edges(mask):
+    """
+    Outlines of the True pixels of an H×W boolean mask along the pixel edges,
+    as a list of closed (n, 2) float arrays of (x, y) corners: x = col and
+    y = row with pixel centres on integers, as find_contours() sees them, so
+    pixel (r, c) spans r ± 0.5 and c ± 0.5.
+
+    Outlines are axis-aligned with one vertex per corner: collinear edges are
+    merged into runs. Walking a ring, the region is always on the right in
+    image coordinates (y down), so outer boundaries and holes come out in
+    opposite orientations. Regions are 4-connected like marching squares'
+    default: where two pixels only touch at a corner, each ring turns
+    around its own pixel and the two rings share that corner.
+    """
+    padded = np.pad(np.asarray(mask, dtype=bool), 1)
+    h, w = padded.shape[0] - 2, padded.shape[1] - 2
+
+    # horizontal edges: between padded rows a and a + 1, on lattice row a,
+    # from corner column b - 1 to b (eastward when the region is below)
+    a, b = np.nonzero(padded[:-1, :] != padded[1:, :])
+    below = padded[a + 1, b]
+    east = _runs(a[below], b[below] - 1, b[below], _E)
+    west = _runs(a[~below], b[~below], b[~below] - 1, _W)
+    # vertical edges: between padded columns b and b + 1, on lattice column b,
+    # from corner row a - 1 to a (southward when the region is to the left)
+    a, b = np.nonzero(padded[:, :-1] != padded[:, 1:])
+    left = padded[a, b]
+    south = _runs(b[left], a[left] - 1, a[left], _S)
+    north = _runs(b[~left], a[~left], a[~left] - 1, _N)
+
+    # every run as (start corner, end corner, direction); corners are numbered row-major
+    corner = lambda row, col: row * (w + 1) + col
+    runs = []
+    for direction, (lines, begin, end) in ((_E, east.T), (_W, west.T)):
+        runs.append((corner(lines, begin), corner(lines, end), np.full(len(lines), direction)))
+    for direction, (lines, begin, end) in ((_S, south.T), (_N, north.T)):
+        runs.append((corner(begin, lines), corner(end, lines), np.full(len(lines), direction)))
+    start, end, direction = (np.concatenate(parts) for parts in zip(*runs))
+    if not len(start):
+        return []
+
+    # the run after each one leaves its end corner turning right, keeping
+    # regions that only touch at a corner apart; the only other way out of a
+    # corner is a left turn (runs are maximal, so never straight on)
+    keys = start * 4 + direction
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+    following = np.empty(len(start), dtype=np.int64)
+    for turn in (3, 1):  # left first, so a right turn overrides it where both exist
+        wanted = end * 4 + (direction + turn) % 4
+        pos = np.minimum(np.searchsorted(sorted_keys, wanted), len(sorted_keys) - 1)
+        found = sorted_keys[pos] == wanted
+        following[found] = order[pos[found]]
+
+    rows, cols = np.divmod(start, w + 1)
+    xs, ys = (cols - 0.5).tolist(), (rows - 0.5).tolist()
+    following = following.tolist()
+    seen = bytearray(len(start))
+    rings = []
+    for first in range(len(start)):
+        if seen[first]:
+            continue
+        ring = []
+        run = first
+        while not seen[run]:
+            seen[run] = 1
+            ring.append((xs[run], ys[run]))
+            run = following[run]
+        ring.append(ring[0])
+        rings.append(np.array(ring))
+    return rings
+
+
+def collapse_staircases(ring):
+    """
+    A closed axis-aligned ring with its one-pixel staircases made diagonal:
+    every unit run between a left and a right turn (a step, not a bump) is
+    replaced by its midpoint, so a slope of steps becomes one straight line
+    through the middle of them, where marching squares puts it too. Bumps,
+    notches and longer runs keep their corners. Without the collapse a
+    diagonal edge keeps two vertices per pixel that simplify() cannot remove,
+    as the corners stand 0.7 px off the line through them.
+    """
+    corners = ring[:-1]
+    n = len(corners)
+    if n < 4:
+        return ring
+    steps = np.roll(corners, -1, axis=0) - corners  # run i goes from corner i to i + 1
+    prev = np.roll(steps, 1, axis=0)
+    # turn at each corner, into run i: +1 one way, -1 the other
+    turn = np.sign(prev[:, 0] * steps[:, 1] - prev[:, 1] * steps[:, 0])
+    unit = np.abs(steps).sum(axis=1) == 1
+    collapsed = unit & (turn != np.roll(turn, -1))
+    if not collapsed.any():
+        return ring
+    # a corner survives unless a run on either side of it collapsed
+    keep = ~(collapsed | np.roll(collapsed, 1))
+    # kept corner i goes before the midpoint of run i
+    position = np.concatenate([np.flatnonzero(keep) * 2, np.flatnonzero(collapsed) * 2 + 1])
+    chosen = np.concatenate([corners[keep], (corners + steps / 2)[collapsed]])[np.argsort(position)]
+    if len(chosen) < 3:
+        return ring
+    return np.concatenate([chosen, chosen[:1]])
+
+
+def pixel_edge_polygons(mask, staircases=True):
+    """
+    The True regions of `mask` as shapely Polygons with holes, traced by
+    trace_pixel_edges(). Holes are given to the innermost outer boundary
+    around them. Rings that touch at a corner stay separate rings:
+    polygonizing the linework would turn every enclosed gap between them
+    into a face of its own. A region that closes on itself through a corner
+    touches its own ring there; buffer(0), as mask_to_polygons() applies it,
+    makes that a valid polygon with a hole.
+
+    With `staircases` the rings go through collapse_staircases(), which
+    takes about as many vertices as marching squares leaves after
+    simplify(). Without it each polygon covers exactly its pixels, at one
+    vertex per pixel step.
+    """
+    import shapely
+
+    rings = trace_pixel_edges(mask)
+    if not rings:
+        return []
+    # shoelace with y down: outer boundaries are positive, holes negative
+    signed = np.array([np.dot(r[:-1, 0], r[1:, 1]) - np.dot(r[1:, 0], r[:-1, 1]) for r in rings]) / 2
+    outer = np.flatnonzero(signed > 0)
+    inner = np.flatnonzero(signed < 0)
+
+    holes = {i: [] for i in outer}
+    if len(inner):
+        # the centre of the background pixel left of each hole's first edge lies inside it
+        first = np.array([rings[i][0] for i in inner])
+        step = np.sign(np.array([rings[i][1] for i in inner]) - first)
+        points = shapely.points(first + 0.5 * step + 0.5 * np.stack([step[:, 1], -step[:, 0]], axis=1))
+        shells = [shapely.Polygon(rings[i]) for i in outer]
+        hole_idx, shell_idx = shapely.STRtree(shells).query(points, predicate="within")
+        owner = {}
+        for h, s in zip(hole_idx.tolist(), shell_idx.tolist()):
+            if h not in owner or signed[outer[s]] < signed[outer[owner[h]]]:
+                owner[h] = s
+        for h, s in owner.items():
+            holes[outer[s]].append(rings[inner[h]])
+    if staircases:
+        return [shapely.Polygon(collapse_staircases(rings[i]), [collapse_staircases(r) for r in holes[i]])
+                for i in outer]
+    return [shapely.Polygon(rings[i], holes[i]) for i in outer]
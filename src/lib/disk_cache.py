@@ -0,0 +1,211 @@
+import hashlib
+import io
+import os
+import sys
+import threading
+
+import numpy as np
+
+MAGIC = b"STRC1"
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3  # 2 GiB
+
+
+def default_cache_dir():
+    """Per-user cache directory, resolved without GLib so headless runs can use it too."""
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "drucken3d")
+
+
+def _encode_labels(labels):
+    return {"labels": labels}
+
+
+def _decode_labels(arrays):
+    return arrays["labels"]
+
+
+def _encode_polygons(polygons):
+    from .geometry import LayeredGeometry
+
+    if not isinstance(polygons, LayeredGeometry):
+        polygons = LayeredGeometry.from_polygons([[polygons]])
+    return polygons.arrays()
+
+
+def _decode_polygons(arrays):
+    import shapely
+
+    from .geometry import COLUMNS, LayeredGeometry
+
+    if "wkb" not in arrays:
+        return LayeredGeometry.from_arrays({name: arrays[name] for name in COLUMNS})
+    # entries written before polygons were cached in columns
+    data = arrays["wkb"].tobytes()
+    offsets = arrays["offsets"]
+    blobs = [data[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+    return list(shapely.from_wkb(blobs)) if blobs else []
+
+
+def _encode_mesh(mesh):
+    return {"vertices": np.asarray(mesh.vertices), "faces": np.asarray(mesh.faces)}
+
+
+def _decode_mesh(arrays):
+    import trimesh
+
+    return trimesh.Trimesh(vertices=arrays["vertices"], faces=arrays["faces"], process=False)
+
+
+# artifact kind → (encode to dict of arrays, decode from loaded npz)
+CODECS = {
+    "labels": (_encode_labels, _decode_labels),
+    "polygons": (_encode_polygons, _decode_polygons),
+    "mesh": (_encode_mesh, _decode_mesh),
+}
+
+
+class DiskCache:
+    """
+    Content-addressed on-disk store for label maps, polygon sets and meshes.
+
+    Every entry is one file named after the hash of its key, holding a magic
+    tag, a checksum of the payload and an uncompressed npz payload. Corrupt or
+    truncated entries fail the checksum and are treated as misses. The total
+    size is bounded; the least recently used entries are evicted first. The
+    directory is only walked for its size on the first write, not on
+    construction, so opening a large cache costs nothing up front.
+    """
+
+    def __init__(self, root=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root or default_cache_dir()
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+        self._size = None  # unknown until _indexed_size() walks the directory
+
+    def _indexed_size(self):
+        # caller holds the lock
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        return self._size
+
+    @staticmethod
+    def supports(key):
+        return isinstance(key, tuple) and bool(key) and key[0] in CODECS
+
+    def _path(self, key):
+        name = hashlib.blake2b(repr(key).encode(), digest_size=20).hexdigest()
+        return os.path.join(self.root, name[:2], name[2:] + ".bin")
+
+    def _entries(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith(".bin"):
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, st.st_size, st.st_mtime
+
+    def get(self, key, default=None):
+        if not self.supports(key):
+            return default
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                blob = f.read()
+        except OSError:
+            return default
+
+        header = len(MAGIC) + 32
+        payload = blob[header:]
+        if blob[:len(MAGIC)] != MAGIC or blob[len(MAGIC):header] != hashlib.blake2b(payload, digest_size=32).digest():
+            print(f"Discarding corrupt cache entry {path}")
+            self._remove(path)
+            return default
+
+        try:
+            with np.load(io.BytesIO(payload), allow_pickle=False) as arrays:
+                value = CODECS[key[0]][1](arrays)
+        except Exception as e:
+            print(f"Discarding unreadable cache entry {path}: {e}")
+            self._remove(path)
+            return default
+
+        # mtime doubles as the LRU clock
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+        if not self.supports(key) or value is None:
+            return
+        buf = io.BytesIO()
+        np.savez(buf, **CODECS[key[0]][0](value))
+        payload = buf.getvalue()
+        blob = MAGIC + hashlib.blake2b(payload, digest_size=32).digest() + payload
+
+        path = self._path(key)
+        with self._lock:
+            self._indexed_size()  # before the new entry exists, so it is not counted twice
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(blob)
+            try:
+                old_size = os.path.getsize(path)
+            except OSError:
+                old_size = 0
+            os.replace(tmp, path)  # atomic, readers never see a partial entry
+        except OSError as e:
+            print(f"Could not write cache entry {path}: {e}")
+            self._remove(tmp)
+            return
+
+        with self._lock:
+            self._size += len(blob) - old_size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            if self._size is not None:
+                self._size -= size
+
+    def _evict(self):
+        # caller holds the lock; drop oldest entries until we are 10% under budget
+        target = self.max_bytes * 0.9
+        for path, size, _ in sorted(self._entries(), key=lambda e: e[2]):
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= size
+
+    def clear(self):
+        with self._lock:
+            for path, _, _ in list(self._entries()):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._size = 0
+
+    @property
+    def size(self):
+        with self._lock:
+            return self._indexed_size()
@@ -0,0 +1,180 @@
+import numpy as np
+from shapely.geometry import MultiPolygon
+
+# Geometry coming out of the pipeline is mirrored about y = height (see
+# flip_polygons_vertically), so row r of the image lies at y = 2 * height - r,
+# with pixel centres on integer coordinates as find_contours() sees them.
+# Rasterizing maps it back onto the pixel grid so a faster path can be scored
+# against the counts map it was built from, layer by layer.
+
+
+def _fill(mask, rows, cols, value=True):
+    from skimage.draw import polygon
+
+    rr, cc = polygon(rows, cols, mask.shape)
+    mask[rr, cc] = value
+
+
+def rasterize_polygons(geoms, shape):
+    """
+    H×W boolean mask of the pixels whose centre lies inside (or on) any of
+    `geoms`, a polygon group as produced by create_layered_polygons_parallel().
+    """
+    h, w = shape
+    mask = np.zeros(shape, dtype=bool)
+    if not isinstance(geoms, list):
+        geoms = [geoms]
+    polys = []
+    for geom in geoms:
+        polys.extend(geom.geoms if isinstance(geom, MultiPolygon) else [geom])
+
+    for poly in polys:
+        if poly.is_empty:
+            continue
+        # fill each polygon on its own bounding box so holes only clear its own pixels
+        x0, y0, x1, y1 = poly.bounds
+        r0, r1 = max(int(np.floor(2 * h - y1)), 0), min(int(np.ceil(2 * h - y0)) + 1, h)
+        c0, c1 = max(int(np.floor(x0)), 0), min(int(np.ceil(x1)) + 1, w)
+        if r0 >= r1 or c0 >= c1:
+            continue
+        local = np.zeros((r1 - r0, c1 - c0), dtype=bool)
+        ext = np.asarray(poly.exterior.coords)
+        _fill(local, 2 * h - ext[:, 1] - r0, ext[:, 0] - c0)
+        for ring in poly.interiors:
+            hole = np.asarray(ring.coords)
+            _fill(local, 2 * h - hole[:, 1] - r0, hole[:, 0] - c0, False)
+        mask[r0:r1, c0:c1] |= local
+    return mask
+
+
+def _fill_triangles(mask, rows, cols, batch=1 << 22):
+    """
+    Set the pixels whose centre lies inside (or on) any of the triangles given
+    by (n, 3) vertex rows and cols. Earcut leaves thousands of small triangles
+    per slab, too many for one draw call each, so they are tested in batches:
+    every pixel of every bounding box against the three edge functions.
+    """
+    h, w = mask.shape
+    r0 = np.clip(np.ceil(rows.min(axis=1)), 0, h).astype(np.int64)
+    r1 = np.clip(np.floor(rows.max(axis=1)) + 1, 0, h).astype(np.int64)
+    c0 = np.clip(np.ceil(cols.min(axis=1)), 0, w).astype(np.int64)
+    c1 = np.clip(np.floor(cols.max(axis=1)) + 1, 0, w).astype(np.int64)
+    nc = np.maximum(c1 - c0, 0)
+    sizes = np.maximum(r1 - r0, 0) * nc
+
+    start = 0
+    while start < len(sizes):
+        stop = start + max(1, int(np.searchsorted(np.cumsum(sizes[start:]), batch)))
+        count = sizes[start:stop]
+        tri = np.repeat(np.arange(start, stop), count)
+        local = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+        rr = r0[tri] + local // nc[tri]
+        cc = c0[tri] + local % nc[tri]
+
+        edges = []
+        for a, b in ((0, 1), (1, 2), (2, 0)):
+            ar, ac = rows[tri, a], cols[tri, a]
+            edges.append((rows[tri, b] - ar) * (cc - ac) - (cols[tri, b] - ac) * (rr - ar))
+        edges = np.stack(edges)
+        inside = (edges >= -1e-9).all(axis=0) | (edges <= 1e-9).all(axis=0)
+        mask[rr[inside], cc[inside]] = True
+        start = stop
+    return mask
+
+
+def mesh_slab_masks(mesh, shape, scale_xy=1.0):
+    """
+    Footprints of the slabs of one extruded mesh, bottom to top: the
+    upward-facing triangles are grouped by height and rasterized like
+    polygons. `scale_xy` is the mesh's millimetres per pixel (1 for the unit
+    meshes of build_unit_layer_meshes()).
+    """
+    h, _ = shape
+    if mesh is None or len(mesh.faces) == 0:
+        return []
+    up = mesh.face_normals[:, 2] > 0.5
+    triangles = mesh.vertices[mesh.faces[up]] / np.array([scale_xy, scale_xy, 1.0])
+    tops = np.round(triangles[:, :, 2].max(axis=1), 6)
+
+    masks = []
+    for z in np.unique(tops):
+        slab = triangles[tops == z]
+        masks.append(_fill_triangles(np.zeros(shape, dtype=bool), 2 * h - slab[:, :, 1], slab[:, :, 0]))
+    return masks
+
+
+def layer_scores(reference, candidate):
+    """
+    IoU and symmetric Hausdorff distance (in pixels) between two masks. The
+    Hausdorff distance is taken over the regions, not just their outlines, so
+    a filled-in hole counts as far as its radius.
+    """
+    from scipy import ndimage
+
+    ref_px = int(np.count_nonzero(reference))
+    px = int(np.count_nonzero(candidate))
+    union = np.count_nonzero(reference | candidate)
+    iou = np.count_nonzero(reference & candidate) / union if union else 1.0
+
+    if not ref_px and not px:
+        hausdorff = 0.0
+    elif not ref_px or not px:
+        hausdorff = float("inf")
+    else:
+        to_ref = ndimage.distance_transform_edt(~reference)
+        to_candidate = ndimage.distance_transform_edt(~candidate)
+        hausdorff = float(max(to_ref[candidate].max(), to_candidate[reference].max()))
+    return {"iou": float(iou), "hausdorff": hausdorff, "ref_pixels": ref_px, "pixels": px}
+
+
+def compare_polygons(counts_map, layered_polygons, filaments):
+    """
+    Score every (filament, level) polygon group against counts_map[fi] >= level.
+    `layered_polygons` and `filaments` are what
+    create_layered_polygons_parallel(..., return_filaments=True) returns,
+    base slab first. Returns one dict per level with fi, level and layer_scores().
+    """
+    shape = next(iter(counts_map.values())).shape
+    scores = []
+    for fi, layer in zip(filaments[1:], layered_polygons[1:]):
+        for level, group in enumerate(layer, 1):
+            reference = counts_map[fi] >= level
+            scores.append(dict(fi=fi, level=level, **layer_scores(reference, rasterize_polygons(group, shape))))
+    return scores
+
+
+def compare_meshes(counts_map, layered_polygons, filaments, meshes, scale_xy=1.0):
+    """
+    Score the slabs of `meshes`, the output of polygons_to_meshes_parallel()
+    for `layered_polygons` (base mesh first; see compare_polygons() for
+    `filaments`), against the counts map. Only
+    non-empty polygon groups become slabs, and slabs are merged downward, so
+    each one is compared to the union of its own level and all levels above it.
+    """
+    shape = next(iter(counts_map.values())).shape
+    slabs = [mask for mesh in meshes[1:] for mask in mesh_slab_masks(mesh, shape, scale_xy)]
+
+    levels = [(fi, level) for fi, layer in zip(filaments[1:], layered_polygons[1:])
+              for level, group in enumerate(layer, 1) if group]
+    above = np.zeros(shape, dtype=bool)
+    references = []
+    for fi, level in reversed(levels):
+        above = above | (counts_map[fi] >= level)
+        references.append((fi, level, above))
+    references.reverse()
+
+    return [dict(fi=fi, level=level, **layer_scores(reference, slab))
+            for (fi, level, reference), slab in zip(references, slabs)]
+
+
+def summarize(scores):
+    """Worst and mean IoU and worst Hausdorff distance over the layers of one run."""
+    if not scores:
+        return {"layers": 0, "min_iou": 1.0, "mean_iou": 1.0, "max_hausdorff": 0.0}
+    ious = [s["iou"] for s in scores]
+    return {
+        "layers": len(scores),
+        "min_iou": min(ious),
+        "mean_iou": float(np.mean(ious)),
+        "max_hausdorff": max(s["hausdorff"] for s in scores),
+    }
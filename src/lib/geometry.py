@@ -0,0 +1,207 @@
+import numpy as np
+
+# Column names, as .stratum projects store them under polygons/
+COLUMNS = ("group_keys", "group_offsets", "layer_offsets", "multi", "coords",
+           "ring_offsets", "part_offsets", "geometry_offsets")
+
+
+class LayeredGeometry:
+    """
+    layered_polygons[layer][level] as create_layered_polygons_parallel()
+    returns them, stored in columns instead of Shapely objects. The
+    geometries use shapely's MultiPolygon ragged layout: one coordinate
+    array plus ring, part and geometry offsets, and a flag for those that
+    were plain Polygons. Each group has its (layer, level) key and a range of
+    geometries; each layer has a range of groups, so layers without any
+    keep their place.
+
+    Groups are stored layer by layer, so every layer's coordinates are one
+    contiguous slice of `coords`. Empty geometries are left out.
+
+    It reads like the nested lists: len() is the layer count, indexing a
+    layer gives its groups as lists of Polygons (built on demand and not
+    kept), and slicing gives the layers as another LayeredGeometry sharing
+    the coordinates.
+    """
+
+    __slots__ = COLUMNS + ("_bounds", "_areas")
+
+    def __init__(self, group_keys, group_offsets, layer_offsets, multi, coords, ring_offsets, part_offsets,
+                 geometry_offsets):
+        self.group_keys = np.asarray(group_keys).reshape(-1, 2)
+        self.group_offsets = np.asarray(group_offsets)
+        if layer_offsets is None:
+            # projects written before layer_offsets was stored: trailing empty layers are lost
+            n_layers = int(self.group_keys[:, 0].max()) + 1 if len(self.group_keys) else 0
+            layer_offsets = np.searchsorted(self.group_keys[:, 0], np.arange(n_layers + 1))
+        # layer i holds groups layer_offsets[i]:layer_offsets[i + 1]
+        self.layer_offsets = np.asarray(layer_offsets)
+        self.multi = np.asarray(multi)
+        self.coords = np.asarray(coords).reshape(-1, 2)
+        self.ring_offsets = np.asarray(ring_offsets)
+        self.part_offsets = np.asarray(part_offsets)
+        self.geometry_offsets = np.asarray(geometry_offsets)
+        self._bounds = None
+        self._areas = None
+
+    @classmethod
+    def from_polygons(cls, layered_polygons):
+        """Columns of nested lists of Polygons/MultiPolygons (a group may also be a single geometry)."""
+        import shapely
+
+        if isinstance(layered_polygons, cls):
+            return layered_polygons
+        geoms, keys, group_offsets, layer_offsets = [], [], [0], [0]
+        for layer, groups in enumerate(layered_polygons):
+            for level, group in enumerate(groups):
+                group = group if isinstance(group, (list, tuple)) else [group]
+                # an empty Polygon would be a part without rings, which from_ragged_array() cannot take
+                geoms.extend(g for g in group if not g.is_empty)
+                keys.append((layer, level))
+                group_offsets.append(len(geoms))
+            layer_offsets.append(len(keys))
+
+        multi = np.array([g.geom_type == "MultiPolygon" for g in geoms], dtype=bool)
+        if geoms:
+            geom_type, coords, offsets = shapely.to_ragged_array(geoms)
+            if geom_type == shapely.GeometryType.POLYGON:
+                # no MultiPolygons at all: one part per geometry
+                offsets += (np.arange(len(geoms) + 1, dtype=np.int64),)
+            rings, parts, polygons = offsets
+        else:
+            coords, rings, parts, polygons = np.empty((0, 2)), *(np.zeros(1, dtype=np.int64),) * 3
+        return cls(np.array(keys, dtype=np.int32).reshape(-1, 2), np.array(group_offsets, dtype=np.int64),
+                   np.array(layer_offsets, dtype=np.int64), multi, coords, rings, parts, polygons)
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        From a {column: array} mapping, e.g. memory-mapped project members;
+        nothing is copied. layer_offsets may be missing (older projects).
+        """
+        return cls(**{name: arrays.get(name) if name == "layer_offsets" else arrays[name] for name in COLUMNS})
+
+    def arrays(self):
+        """{column: array}, the inverse of from_arrays()."""
+        return {name: getattr(self, name) for name in COLUMNS}
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in COLUMNS)
+
+    def __len__(self):
+        return len(self.layer_offsets) - 1
+
+    def __iter__(self):
+        for layer in range(len(self)):
+            yield self[layer]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError("LayeredGeometry slices take every layer")
+            return self._subset(start, max(start, stop))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.layer_polygons(index)
+
+    def _subset(self, start, stop):
+        """The layers start:stop as a LayeredGeometry of views, renumbered from 0."""
+        first, last = self.layer_offsets[start], self.layer_offsets[stop]
+        g0, g1 = self.group_offsets[first], self.group_offsets[last]
+        p0, p1 = self.geometry_offsets[g0], self.geometry_offsets[g1]
+        r0, r1 = self.part_offsets[p0], self.part_offsets[p1]
+        c0, c1 = self.ring_offsets[r0], self.ring_offsets[r1]
+        keys = self.group_keys[first:last] - (start, 0)
+        return type(self)(keys, self.group_offsets[first:last + 1] - g0,
+                          self.layer_offsets[start:stop + 1] - first, self.multi[g0:g1],
+                          self.coords[c0:c1], self.ring_offsets[r0:r1 + 1] - c0,
+                          self.part_offsets[p0:p1 + 1] - r0, self.geometry_offsets[g0:g1 + 1] - p0)
+
+    def layer_polygons(self, layer):
+        """The groups of one layer as lists of Shapely geometries, built from the columns."""
+        import shapely
+
+        part = self._subset(layer, layer + 1)
+        if len(part.multi):
+            geoms = shapely.from_ragged_array(
+                shapely.GeometryType.MULTIPOLYGON, np.asarray(part.coords),
+                (np.asarray(part.ring_offsets), np.asarray(part.part_offsets),
+                 np.asarray(part.geometry_offsets)))
+            single = ~np.asarray(part.multi)
+            geoms[single] = shapely.get_geometry(geoms[single], 0)
+        else:
+            geoms = []
+        offsets = part.group_offsets
+        return [list(geoms[start:stop]) for start, stop in zip(offsets[:-1], offsets[1:])]
+
+    def to_polygons(self):
+        """The nested lists create_layered_polygons_parallel() returned."""
+        return list(self)
+
+    def group_rings(self, group):
+        """
+        Coordinates of every ring of a group, closed, and where each ring
+        starts in them (plus the end): a view, not a copy.
+        """
+        g0, g1 = self.group_offsets[group], self.group_offsets[group + 1]
+        r0, r1 = self.part_offsets[self.geometry_offsets[g0]], self.part_offsets[self.geometry_offsets[g1]]
+        starts = self.ring_offsets[r0:r1 + 1]
+        return self.coords[starts[0]:starts[-1]], starts - starts[0]
+
+    def _coord_ranges(self):
+        """First and end coordinate index of every geometry."""
+        ends = self.ring_offsets[self.part_offsets[self.geometry_offsets]]
+        return ends[:-1], ends[1:]
+
+    @property
+    def bounds(self):
+        """(minx, miny, maxx, maxy) of every geometry, NaN for empty ones."""
+        if self._bounds is None:
+            starts, stops = self._coord_ranges()
+            bounds = np.full((len(starts), 4), np.nan)
+            filled = stops > starts
+            if filled.any():
+                coords = np.asarray(self.coords)
+                bounds[filled, :2] = np.minimum.reduceat(coords, starts[filled])
+                bounds[filled, 2:] = np.maximum.reduceat(coords, starts[filled])
+            self._bounds = bounds
+        return self._bounds
+
+    @property
+    def total_bounds(self):
+        """(minx, miny, maxx, maxy) of everything, NaN when empty."""
+        bounds = self.bounds
+        if not np.isfinite(bounds).any():
+            return np.full(4, np.nan)
+        return np.concatenate([np.nanmin(bounds[:, :2], axis=0), np.nanmax(bounds[:, 2:], axis=0)])
+
+    @property
+    def areas(self):
+        """Area of every geometry: shells minus holes, whatever the ring orientation."""
+        if self._areas is None:
+            coords = np.asarray(self.coords)
+            rings = self.ring_offsets
+            n_geoms = len(self.geometry_offsets) - 1
+            if len(coords) < 2:
+                self._areas = np.zeros(n_geoms)
+                return self._areas
+            x, y = coords[:, 0], coords[:, 1]
+            cross = x[:-1] * y[1:] - x[1:] * y[:-1]
+            # the steps from one ring's last point to the next ring's first
+            joins = rings[1:-1]
+            cross[joins[(joins > 0) & (joins <= len(cross))] - 1] = 0
+            ring_area = np.zeros(len(rings) - 1)
+            filled = rings[1:] > rings[:-1]
+            # each sum runs to the next filled ring's start; the last one to the end of `cross`
+            ring_area[filled] = np.abs(np.add.reduceat(cross, rings[:-1][filled])) / 2
+
+            ring_part = np.repeat(np.arange(len(self.part_offsets) - 1), np.diff(self.part_offsets))
+            shell = np.arange(len(ring_part)) == self.part_offsets[:-1][ring_part]
+            part_geom = np.repeat(np.arange(n_geoms), np.diff(self.geometry_offsets))
+            self._areas = np.bincount(part_geom[ring_part], weights=np.where(shell, ring_area, -ring_area),
+                                      minlength=n_geoms)
+        return self._areas
@@ -0,0 +1,272 @@
+import math
+import tempfile
+import threading
+
+import numpy as np
+from PIL import Image
+
+# Finer than any nozzle can print: at the default 10 cm print size an image is
+# worked on at up to 2000 px; larger ones are reduced while they are decoded.
+WORKING_PX_PER_MM = 20
+# Decoded images with more pixels than this live in a temporary file
+MEMMAP_PIXELS = 64 * 2**20
+BAND_ROWS = 512
+PREVIEW_MAX_SIDE = 2048
+# Gigapixel scans are what the band reader is for. Pillow's decompression bomb
+# guard (Image.MAX_IMAGE_PIXELS) is left as it is: only open_header() lifts
+# it, and only images the band reader never holds whole get past it.
+_header_lock = threading.Lock()
+
+# Pillow raw modes that can be mapped straight from the file: bytes per
+# pixel and where R, G and B sit in them
+RAW_LAYOUTS = {
+    "RGB": (3, (0, 1, 2)),
+    "BGR": (3, (2, 1, 0)),
+    "RGBX": (4, (0, 1, 2)),
+    "RGBA": (4, (0, 1, 2)),
+    "BGRX": (4, (2, 1, 0)),
+    "BGRA": (4, (2, 1, 0)),
+    "L": (1, (0, 0, 0)),
+}
+
+
+def working_max_side(target_max_cm):
+    """Longest image side worth keeping for a print whose longest side is `target_max_cm`."""
+    return int(target_max_cm * 10 * WORKING_PX_PER_MM)
+
+
+def reduction_factor(size, max_side=None):
+    """Smallest integer stride that brings `size` down to `max_side` (1 = keep)."""
+    if not max_side:
+        return 1
+    return max(1, math.ceil(max(size) / max_side))
+
+
+def working_size(size, max_side=None):
+    """
+    (w, h) an image of `size` is decoded to by decode_image(..., max_side):
+    scaled so that its longest side is exactly `max_side`, never enlarged.
+    """
+    if not max_side or max(size) <= max_side:
+        return tuple(size)
+    scale = max_side / max(size)
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+
+def _prereduce_factor(size, target):
+    """Largest integer factor that keeps `size` at or above `target` on both sides."""
+    return max(1, min(int(size[0]) // target[0], int(size[1]) // target[1]))
+
+
+def open_header(source):
+    """
+    Image.open() without Pillow's decompression bomb check, so that the size
+    of any image can be read: nothing is decoded. Call check_pixel_limit()
+    before decoding the result whole.
+    """
+    with _header_lock:
+        limit, Image.MAX_IMAGE_PIXELS = Image.MAX_IMAGE_PIXELS, None
+        try:
+            return Image.open(source)
+        finally:
+            Image.MAX_IMAGE_PIXELS = limit
+
+
+def check_pixel_limit(size):
+    """Raise Image.DecompressionBombError where Image.open() would have for an image of `size`."""
+    limit = Image.MAX_IMAGE_PIXELS
+    if limit is not None and size[0] * size[1] > 2 * limit:
+        raise Image.DecompressionBombError(
+            f"Image size ({size[0] * size[1]} pixels) exceeds limit of {2 * limit} pixels, "
+            "could be decompression bomb DOS attack.")
+
+
+class SourceImage:
+    """
+    A decoded image as one H×W×3 uint8 array (an np.memmap for large
+    images), shared by the preview and the pipeline. It passes for an RGB
+    PIL image where the pipeline needs one: size, mode and convert().
+    """
+
+    mode = "RGB"
+
+    def __init__(self, pixels, original_size, filename=None, backing=None):
+        self.pixels = pixels
+        self.original_size = tuple(original_size)
+        self.filename = filename
+        self._backing = backing
+
+    @property
+    def size(self):
+        return self.pixels.shape[1], self.pixels.shape[0]
+
+    @property
+    def reduced(self):
+        return self.size != self.original_size
+
+    def matches(self, max_side):
+        """Whether decoding the source for `max_side` would give this very image."""
+        return self.size == working_size(self.original_size, max_side)
+
+    def convert(self, mode="RGB"):
+        """A PIL copy, for code that needs a real Image."""
+        return Image.fromarray(np.asarray(self.pixels), mode="RGB").convert(mode)
+
+    def preview(self, max_side=PREVIEW_MAX_SIDE):
+        """A strided view of at most `max_side` pixels per side; nothing is copied."""
+        step = reduction_factor(self.size, max_side)
+        return self.pixels[::step, ::step]
+
+    def close(self):
+        self.pixels = None
+        if self._backing is not None:
+            self._backing.close()
+            self._backing = None
+
+
+def as_rgb_array(image):
+    """H×W×3 uint8 pixels of a SourceImage, an array or a PIL image (copied only for PIL)."""
+    if isinstance(image, SourceImage):
+        return image.pixels
+    if isinstance(image, np.ndarray):
+        return image
+    return np.asarray(image.convert("RGB"))
+
+
+def _allocate(shape, memmap_pixels):
+    if shape[0] * shape[1] <= memmap_pixels:
+        return np.empty(shape, dtype=np.uint8), None
+    backing = tempfile.TemporaryFile(prefix="drucken3d-", suffix=".rgb")
+    return np.memmap(backing, dtype=np.uint8, mode="w+", shape=shape), backing
+
+
+def _raw_tiles(image, path, factor):
+    """
+    The image's tiles as (extents, offset, rawmode, stride, orientation) when
+    every one of them can be mapped from the file and reduced by `factor`
+    block by block; None otherwise.
+    """
+    if not isinstance(path, str) or image.mode not in ("RGB", "RGBA", "L"):
+        return None
+    w, h = image.size
+    tiles = []
+    for tile in image.tile:
+        codec, extents, offset, args = tile[:4]
+        args = args if isinstance(args, tuple) else (args,)
+        if codec != "raw" or args[0] not in RAW_LAYOUTS:
+            return None
+        x0, y0, x1, y1 = extents
+        if x0 % factor or y0 % factor or (x1 < w and x1 % factor) or (y1 < h and y1 % factor):
+            return None
+        stride = (args[1] if len(args) > 1 else 0) or (x1 - x0) * RAW_LAYOUTS[args[0]][0]
+        orientation = args[2] if len(args) > 2 else 1
+        tiles.append((extents, offset, args[0], stride, orientation))
+    return tiles or None
+
+
+def _read_raw(path, tiles, pixels, factor):
+    """Read raw tiles from the file one band of rows at a time into `pixels`, box-averaging by `factor`."""
+    h, w = pixels.shape[:2]
+    band = max(1, BAND_ROWS // factor) * factor
+    with open(path, "rb") as f:
+        for (x0, y0, x1, y1), offset, rawmode, stride, orientation in tiles:
+            nbytes, channels = RAW_LAYOUTS[rawmode]
+            rows = y1 - y0
+            for top in range(0, rows, band):
+                n = min(band, rows - top)
+                # bottom-up files (BMP) hold this band n rows before the previous one
+                first = top if orientation > 0 else rows - top - n
+                f.seek(offset + first * stride)
+                chunk = np.empty((n, stride), dtype=np.uint8)
+                f.readinto(chunk)
+                if orientation < 0:
+                    chunk = chunk[::-1]
+                rgb = chunk[:, :(x1 - x0) * nbytes].reshape(n, x1 - x0, nbytes)[:, :, list(channels)]
+                if factor > 1:
+                    bh, bw = n // factor, (x1 - x0) // factor
+                    blocks = rgb[:bh * factor, :bw * factor].reshape(bh, factor, bw, factor, 3)
+                    rgb = ((blocks.sum(axis=(1, 3), dtype=np.uint32) + factor * factor // 2)
+                           // (factor * factor)).astype(np.uint8)
+                r0, c0 = (y0 + top) // factor, x0 // factor
+                rgb = rgb[:h - r0, :w - c0]
+                pixels[r0:r0 + rgb.shape[0], c0:c0 + rgb.shape[1]] = rgb
+
+
+def _resize_bands(src, dst):
+    """
+    Box-filter the H×W×3 `src` into `dst` band by band. Each band reads only
+    the source rows under it and is resized with its exact source box, so
+    the bands meet without seams.
+    """
+    (sh, sw), (dh, dw) = src.shape[:2], dst.shape[:2]
+    scale = sh / dh
+    for top in range(0, dh, BAND_ROWS):
+        bottom = min(top + BAND_ROWS, dh)
+        first, last = int(top * scale), min(sh, math.ceil(bottom * scale))
+        band = Image.fromarray(np.asarray(src[first:last]), mode="RGB")
+        box = (0, top * scale - first, sw, bottom * scale - first)
+        dst[top:bottom] = np.asarray(band.resize((dw, bottom - top), Image.BOX, box=box))
+
+
+def decode_image(source, max_side=None, memmap_pixels=MEMMAP_PIXELS):
+    """
+    Decode `source` (a path or file object) once into a SourceImage whose
+    longest side is at most `max_side`, exactly `max_side` when it is reduced.
+
+    - JPEGs are reduced by libjpeg while decoding (Image.draft), everything
+      else by Image.reduce() right after it, in both cases only by a whole
+      factor that stays at or above the working size; a box filter takes it
+      the rest of the way.
+    - Uncompressed files (BMP, PPM, raw TIFF) larger than `memmap_pixels`
+      are read from disk band by band and never held whole. Pillow can only
+      decode compressed ones whole; they are then moved over band by band,
+      and Pillow's decompression bomb limit applies to them.
+    - Results larger than `memmap_pixels` live in a temporary memory-mapped file.
+    """
+    filename = source if isinstance(source, str) else None
+    with open_header(source) as image:
+        original = image.size
+        target = working_size(original, max_side)
+        shape = (target[1], target[0], 3)
+
+        if original[0] * original[1] > memmap_pixels:
+            factor = _prereduce_factor(original, target)
+            tiles = _raw_tiles(image, source, factor)
+            if tiles is not None:
+                pixels, backing = _allocate(shape, memmap_pixels)
+                reduced_shape = (original[1] // factor, original[0] // factor, 3)
+                if reduced_shape == shape:
+                    _read_raw(source, tiles, pixels, factor)
+                else:
+                    reduced, reduced_backing = _allocate(reduced_shape, memmap_pixels)
+                    try:
+                        _read_raw(source, tiles, reduced, factor)
+                        _resize_bands(reduced, pixels)
+                    finally:
+                        del reduced
+                        if reduced_backing is not None:
+                            reduced_backing.close()
+                return SourceImage(pixels, original, filename, backing)
+
+        check_pixel_limit(original)
+        # the part of the decoded image that covers the source, in its pixels
+        box = (0, 0) + original
+        if target != original and image.format == "JPEG":
+            drafted = image.draft("RGB", target)  # decodes at 1/2, 1/4 or 1/8 scale, never below target
+            if drafted:
+                box = drafted[1]
+        factor = _prereduce_factor(box[2:], target)
+        decoded = image.reduce(factor) if factor > 1 else image
+        box = tuple(v / factor for v in box)
+        decoded = decoded.convert("RGB") if decoded.mode != "RGB" else decoded
+        if decoded.size != target or box != (0, 0) + decoded.size:
+            # reduce() and draft() keep partial edge blocks; the box leaves them out
+            decoded = decoded.resize(target, Image.BOX, box=box)
+
+        if shape[0] * shape[1] <= memmap_pixels:
+            return SourceImage(np.asarray(decoded), original, filename)
+        pixels, backing = _allocate(shape, memmap_pixels)
+        for top in range(0, target[1], BAND_ROWS):
+            band = decoded.crop((0, top, target[0], min(top + BAND_ROWS, target[1])))
+            pixels[top:top + band.size[1]] = np.asarray(band)
+        return SourceImage(pixels, original, filename, backing)
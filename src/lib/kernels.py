@@ -0,0 +1,190 @@
+import functools
+import importlib.util
+import os
+import threading
+
+import numpy as np
+
+# Numba is optional. With it, the per-pixel hot loops run as single fused,
+# parallel passes; without it (or with DRUCKEN3D_KERNELS=numpy) every caller
+# takes its NumPy path. numba is imported and the kernels compiled on first
+# use, and cached on disk, so neither window start nor pool workers pay for it.
+KERNELS = ("numba", "numpy")
+
+# The workqueue threading layer survives the fork of a process pool (with TBB
+# the interpreter hangs on exit), but it aborts when two threads launch
+# parallel kernels at once (a redraw next to an export), so launches are
+# serialized. $NUMBA_THREADING_LAYER still takes precedence.
+THREADING_LAYER = "workqueue"
+_launch_lock = threading.Lock()
+
+
+def enabled():
+    """Whether the Numba kernels are used: $DRUCKEN3D_KERNELS, else whenever numba is installed."""
+    setting = os.environ.get("DRUCKEN3D_KERNELS", "").strip()
+    if setting and setting not in KERNELS:
+        raise ValueError(f"Unknown kernels {setting!r}, expected one of {KERNELS}")
+    if setting == "numpy":
+        return False
+    available = importlib.util.find_spec("numba") is not None
+    if setting == "numba" and not available:
+        raise ValueError("DRUCKEN3D_KERNELS=numba, but numba is not installed")
+    return available
+
+
+@functools.lru_cache(maxsize=None)
+def _compiled():
+    import numba
+    from numba import njit, prange
+
+    if "NUMBA_THREADING_LAYER" not in os.environ:
+        numba.config.THREADING_LAYER = THREADING_LAYER
+    jit = njit(parallel=True, cache=True, nogil=True)
+
+    @njit(inline="always")
+    def lab_f(r, g, b, matrix, c):
+        t = r * matrix[0, c] + g * matrix[1, c] + b * matrix[2, c]
+        return np.cbrt(t) if t > 0.008856 else t * 7.787 + 16 / 116
+
+    @jit
+    def classify(pixels, lut, matrix, shade_lab, out):
+        for i in prange(pixels.shape[0]):
+            r, g, b = lut[pixels[i, 0]], lut[pixels[i, 1]], lut[pixels[i, 2]]
+            fx, fy, fz = lab_f(r, g, b, matrix, 0), lab_f(r, g, b, matrix, 1), lab_f(r, g, b, matrix, 2)
+            L, A, B = 116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)
+            best, best_d = 0, np.inf
+            for s in range(shade_lab.shape[0]):
+                dL, dA, dB = L - shade_lab[s, 0], A - shade_lab[s, 1], B - shade_lab[s, 2]
+                d = dL * dL + dA * dA + dB * dB
+                if d < best_d:
+                    best, best_d = s, d
+            out[i] = best
+
+    @jit
+    def counts(rgb, codes, targets, out):
+        h, w = rgb.shape[0], rgb.shape[1]
+        for y in prange(h):
+            for x in range(w):
+                code = (np.uint32(rgb[y, x, 0]) << 16) | (np.uint32(rgb[y, x, 1]) << 8) | np.uint32(rgb[y, x, 2])
+                lo, hi = 0, codes.shape[0]
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    if codes[mid] < code:
+                        lo = mid + 1
+                    else:
+                        hi = mid
+                if lo < codes.shape[0] and codes[lo] == code and targets[lo, 0] >= 0:
+                    out[targets[lo, 0], y, x] = targets[lo, 1]
+
+    @jit
+    def threshold_pack(flat, level, out):
+        # np.packbits(flat >= level): eight pixels per output byte, most significant bit first
+        full = flat.shape[0] // 8
+        for i in prange(full):
+            byte = np.uint8(0)
+            for k in range(8):
+                byte = (byte << 1) | np.uint8(flat[i * 8 + k] >= level)
+            out[i] = byte
+        if full < out.shape[0]:
+            byte = np.uint8(0)
+            for k in range(8):
+                j = full * 8 + k
+                byte = (byte << 1) | np.uint8(j < flat.shape[0] and flat[j] >= level)
+            out[full] = byte
+
+    @njit(cache=True, nogil=True)
+    def find_root(parent, i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    @njit(cache=True, nogil=True)
+    def threshold_label(cnt, level, out):
+        # union-find over 4-neighbours, then renumber in raster order of first pixel like ndimage.label
+        h, w = cnt.shape
+        parent = np.empty(h * w + 1, dtype=np.int32)
+        parent[0] = 0
+        n = 0
+        for y in range(h):
+            for x in range(w):
+                if cnt[y, x] < level:
+                    out[y, x] = 0
+                    continue
+                up = out[y - 1, x] if y > 0 else 0
+                left = out[y, x - 1] if x > 0 else 0
+                if up and left:
+                    a, b = find_root(parent, up), find_root(parent, left)
+                    if a != b:
+                        parent[max(a, b)] = min(a, b)
+                    out[y, x] = min(a, b)
+                elif up or left:
+                    out[y, x] = up or left
+                else:
+                    n += 1
+                    parent[n] = n
+                    out[y, x] = n
+        number = np.zeros(n + 1, dtype=np.int32)
+        count = 0
+        for y in range(h):
+            for x in range(w):
+                if out[y, x]:
+                    root = find_root(parent, out[y, x])
+                    if number[root] == 0:
+                        count += 1
+                        number[root] = count
+                    out[y, x] = number[root]
+        return count
+
+    return classify, counts, threshold_pack, threshold_label
+
+
+def classify_rgb8(rgb8, shade_lab, out):
+    """
+    Nearest shade of every pixel of the (..., 3) uint8 `rgb8` in one pass:
+    the sRGB table, XYZ and Lab of colorspace.rgb8_to_lab() and the squared
+    distance to every row of `shade_lab`, written to `out` (uint16, same
+    shape without the channels). No Lab or distance array is ever built.
+    """
+    from .colorspace import SRGB_TO_LINEAR, XYZ_RELATIVE
+
+    classify = _compiled()[0]
+    with _launch_lock:
+        classify(np.ascontiguousarray(rgb8).reshape(-1, 3), SRGB_TO_LINEAR, XYZ_RELATIVE,
+                 np.ascontiguousarray(shade_lab, dtype=np.float32), out.reshape(-1))
+    return out
+
+
+def counts_from_rgb(rgb, codes, targets, out):
+    """
+    Fill `out` (filaments × H × W, zeroed) from an H×W×C uint8 image: a pixel
+    whose 24-bit colour is codes[i] (sorted) sets out[targets[i, 0]] to
+    targets[i, 1]; rows with a negative filament are skipped.
+    """
+    counts = _compiled()[1]
+    with _launch_lock:
+        counts(rgb, codes, targets, out)
+    return out
+
+
+def threshold_pack(cnt, level):
+    """
+    np.packbits(cnt >= level, axis=None) of an H×W uint8 counts map in one
+    pass, without the boolean mask in between.
+    """
+    flat = np.ascontiguousarray(cnt).reshape(-1)
+    out = np.empty((flat.size + 7) // 8, dtype=np.uint8)
+    with _launch_lock:
+        _compiled()[2](flat, level, out)
+    return out
+
+
+def threshold_label(cnt, level):
+    """
+    ndimage.label(cnt >= level) of an H×W uint8 counts map in one pass plus
+    a renumbering pass: the 4-connected components as int32 labels numbered
+    in raster order of their first pixel, and their count.
+    """
+    out = np.empty(cnt.shape, dtype=np.int32)
+    n = _compiled()[3](np.ascontiguousarray(cnt), level, out)
+    return out, int(n)
@@ -1,40 +1,99 @@
 from PIL import Image
 import numpy as np
-from skimage.color import rgb2lab
 
+from .artifact_cache import image_digest
+from .colorspace import rgb8_to_lab
+from . import kernels
+from .ingest import as_rgb_array
+from .tracing import annotate, traced
 
-def segment_to_shades(source_image: Image, filament_shades):
-    # 1) load & normalize to [0,1]
-    rgb = np.asarray(source_image.convert('RGB'), dtype=float) / 255.0
-    lab = rgb2lab(rgb)  # (H, W, 3)
 
-    h, w, _ = lab.shape
-    lab_flat = lab.reshape(-1, 3)  # (H*W, 3)
+@traced
+def segment_to_shades(source_image: Image, filament_shades, cache=None, chunk_rows=None):
+    """
+    Map every pixel to its nearest shade in Lab space and return the result as
+    an RGB image of shade colours. With a cache, the label map is looked up by
+    image content and shade set before anything is computed. `chunk_rows` is
+    passed on to segment_to_labels().
+    """
+    key = None
+    if cache is not None:
+        key = ("labels", image_digest(source_image), repr(filament_shades))
+        labels = cache.get(key)
+        if labels is not None:
+            print("Reusing cached label map")
+            return labels_to_image(labels, filament_shades)
+
+    labels = segment_to_labels(source_image, filament_shades, chunk_rows)
+    if cache is not None:
+        cache.put(key, labels)
+    return labels_to_image(labels, filament_shades)
+
+
+@traced
+def segment_to_labels(source_image: Image, filament_shades, chunk_rows=None):
+    """
+    Return an H×W array holding the flat index of each pixel's nearest shade.
+
+    The pixel × shade distance matrix is the largest allocation of the whole
+    pipeline; with `chunk_rows` (see planner.plan_memory()) it is only built
+    for that many image rows at a time.
+    """
+    rgb8 = as_rgb_array(source_image)  # a SourceImage is used in place
+    h, w, _ = rgb8.shape
 
-    # 2) flatten your shades into one array
+    # 1) flatten your shades into one array
     flat_shades = [shade for shade_list in filament_shades for shade in shade_list]
     print (f"Total shades: {len(flat_shades)}")
-    shade_rgb = np.array(flat_shades, dtype=float)  # (N, 3), still 0–255
+    shade_lab = rgb8_to_lab(np.array(flat_shades, dtype=np.uint8))  # (N, 3)
 
-    # normalize & convert to Lab
-    shade_rgb_norm = shade_rgb / 255.0
-    shade_lab = rgb2lab(shade_rgb_norm.reshape(1, -1, 3)).reshape(-1, 3)  # (N, 3)
+    labels = np.empty((h, w), dtype=np.uint16)
+    step = h if not chunk_rows else max(1, chunk_rows)
+    if kernels.enabled():
+        # one fused pass over the pixels: no Lab or distance array at all
+        kernels.classify_rgb8(rgb8, shade_lab, labels)
+    else:
+        lab = np.empty((min(step, h), w, 3), dtype=np.float32)  # reused by every band
+        for top in range(0, h, step):
+            # 2) convert this band to Lab (float32, straight from the 8-bit pixels)
+            band = rgb8[top:top + step]
+            lab_flat = rgb8_to_lab(band, out=lab[:len(band)]).reshape(-1, 3)
 
-    # 3) compute all distances: each pixel vs. each shade
-    #    result shape: (H*W, N)
-    dists = np.linalg.norm(lab_flat[:, None, :] - shade_lab[None, :, :], axis=2)
+            # 3) distances of each pixel to each shade, shape (rows*W, N)
+            dists = np.linalg.norm(lab_flat[:, None, :] - shade_lab[None, :, :], axis=2)
 
-    # 4) pick the nearest shade index for each pixel
-    nearest = np.argmin(dists, axis=1)  # (H*W,)
+            # 4) pick the nearest shade index for each pixel
+            labels[top:top + step] = np.argmin(dists, axis=1).reshape(-1, w)
 
-    # 5) build segmented array & back to image
-    seg_flat_rgb = shade_rgb[nearest].astype(np.uint8)  # (H*W, 3)
-    seg_rgb = seg_flat_rgb.reshape(h, w, 3)
+    print(f"Shades used: {np.flatnonzero(np.bincount(labels.ravel()))}")
+    annotate(pixels=h * w, shades=len(flat_shades), chunk_rows=step)
+    return labels
 
-    print(f"Shades used: {np.unique(nearest)}")
 
+def labels_to_image(labels, filament_shades):
+    """Turn a label map from segment_to_labels() back into a shade-coloured image."""
+    flat_shades = [shade for shade_list in filament_shades for shade in shade_list]
+    shade_rgb = np.array(flat_shades, dtype=np.uint8)  # (N, 3)
+    seg_rgb = shade_rgb[labels]  # (H, W, 3)
     return Image.fromarray(seg_rgb, mode='RGB')
 
+
+def image_to_labels(segmented_image, filament_shades):
+    """
+    Inverse of labels_to_image(): the label map of a shade-coloured image.
+    Duplicate shades map to their first index, which renders identically.
+    """
+    flat_shades = np.array([shade for shade_list in filament_shades for shade in shade_list], dtype=np.uint32)
+    shade_codes = (flat_shades[:, 0] << 16) | (flat_shades[:, 1] << 8) | flat_shades[:, 2]
+    codes, first = np.unique(shade_codes, return_index=True)
+
+    rgb = np.asarray(segmented_image.convert('RGB'))
+    pixel_codes = (rgb[..., 0].astype(np.uint32) << 16) | (rgb[..., 1].astype(np.uint32) << 8) | rgb[..., 2]
+    idx = np.clip(np.searchsorted(codes, pixel_codes), 0, len(codes) - 1)
+    if not np.array_equal(codes[idx], pixel_codes):
+        raise ValueError("image holds colours that are not among the shades")
+    return first[idx].astype(np.uint16)
+
 def generate_shades(filament_order, cover_factors):
     """
     Generate blended shades for a sequence of filaments based on individual cover factors.
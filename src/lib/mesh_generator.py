@@ -1,38 +1,47 @@
+import importlib
 import io
-import time
 
-from matplotlib import pyplot as plt
 from shapely.geometry.linestring import LineString
 import os
 import numpy as np
-from skimage import measure
 from shapely.geometry import Polygon, MultiPolygon
 from shapely import affinity
-import trimesh
-from skimage.color import rgb2lab, deltaE_ciede2000
-import geopandas as gpd
-from gi.repository import GLib
-from descartes import PolygonPatch
-from functools import wraps
-
-from trimesh.path.packing import meshes
+from shapely.ops import unary_union
+import shapely
+
+from . import kernels
+from .artifact_cache import packed_mask_digest, polygons_digest
+from .contours import default_contour_source, pixel_edge_polygons
+from .geometry import LayeredGeometry
+from .scheduling import (
+    PartCollector,
+    level_costs,
+    merge_mesh_parts,
+    merge_polygon_parts,
+    plan_splits,
+    polygons_cost,
+    label_level,
+    split_mask,
+    split_polygons,
+)
+from .tracing import TracedTask, annotate, collect, traced
+
+# matplotlib, geopandas, skimage and trimesh are imported inside the functions
+# that use them: importing them here would cost every window start and every
+# spawned worker a second or more, even for stages they never run.
 
 # Configuration defaults
 OUTPUT_DIR = 'meshes'
 SIMPLIFY_TOLERANCE = 0.4  # Simplify tolerance for raw polygons
 SMOOTHING_WINDOW = 3  # Window size for contour smoothing
 MIN_AREA = 1  # Minimum polygon area to keep
-
-def timed(func):
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        t0 = time.perf_counter()
-        result = func(*args, **kwargs)
-        t1 = time.perf_counter()
-        print(f"[TIMING] {func.__name__:25s}: {t1-t0:0.3f}s")
-        return result
-    return wrapper
-
+NOZZLE_WIDTH_MM = 0.4  # Default nozzle width outlines are simplified for
+SIMPLIFY_NOZZLE_FRACTION = 1 / 8  # Simplify tolerance at print scale, as a share of the nozzle width
+MIN_FEATURE_NOZZLE_FRACTION = 1 / 2  # Smallest kept blob: a square this share of the nozzle wide
+UNIT_THICKNESS = 1.0  # Extrusion height of cached meshes, scaled to layer height on export
+# Masks are packed by the fused Numba kernel from this size on. Below it np.packbits
+# is faster; above it the kernel saves a full-size boolean mask per level.
+FUSED_PACK_MIN_PIXELS = 1 << 24
 
 def ensure_dir(path):
     if not os.path.exists(path):
@@ -64,24 +73,56 @@ def extract_color_masks(img_arr, filament_shades):
     return masks
 
 
-@timed
-def mask_to_polygons(mask, min_area=100, simplify_tol=1.0):
-    # 1️⃣ Clean the raster mask – keep exactly the same pre-processing you had
-    # mask = binary_fill_holes(mask)                        # fills boundary-connected zeros :contentReference[oaicite:1]{index=1}
-    # mask = binary_closing(mask, structure=np.ones((3, 3)))# closes one-pixel gaps :contentReference[oaicite:2]{index=2}
-    padded = np.pad(mask.astype(float), 1, constant_values=0)
+def outline_options(size, target_max_cm=None, nozzle_mm=None, contours=None):
+    """
+    mask_to_polygons() keyword arguments for masks of an image of `size`
+    (w, h) pixels printed `target_max_cm` long on its longest side. The
+    simplify tolerance and minimum blob area follow the nozzle width at that
+    scale, so a finely sampled image is not traced finer than it can print;
+    they never drop below SIMPLIFY_TOLERANCE and MIN_AREA, which are all
+    that applies when the print size is unknown.
+    """
+    simplify_tol, min_area = SIMPLIFY_TOLERANCE, MIN_AREA
+    if target_max_cm:
+        px_per_mm = max(size) / (target_max_cm * 10)
+        nozzle_px = (nozzle_mm or NOZZLE_WIDTH_MM) * px_per_mm
+        simplify_tol = max(simplify_tol, nozzle_px * SIMPLIFY_NOZZLE_FRACTION)
+        min_area = max(min_area, (nozzle_px * MIN_FEATURE_NOZZLE_FRACTION) ** 2)
+    return {"min_area": min_area, "simplify_tol": simplify_tol, "contours": contours or default_contour_source()}
 
-    # 2️⃣ Convert every *ring* returned by marching-squares into a LineString
-    rings = [
-        LineString([(p[1] - 1, p[0] - 1) for p in c])  # shift because of the 1-pixel pad
-        for c in measure.find_contours(padded, 0.5)  # skimage marching squares :contentReference[oaicite:3]{index=3}
-    ]
 
-    if not rings:
-        return []
+@traced
+def mask_to_polygons(mask, min_area=100, simplify_tol=1.0, contours="marching"):
+    """
+    Polygons of the True regions of `mask`. `contours` picks the outline
+    source (see contours.CONTOUR_SOURCES): marching squares, or the pixel
+    edges with their staircases collapsed.
+    """
+    import geopandas as gpd
+    from skimage import measure
+
+    if contours == "pixel":
+        # axis-aligned outlines with their holes already assigned
+        polys = gpd.GeoSeries(pixel_edge_polygons(mask))
+        if polys.empty:
+            return []
+    else:
+        # 1️⃣ Clean the raster mask – keep exactly the same pre-processing you had
+        # mask = binary_fill_holes(mask)                        # fills boundary-connected zeros :contentReference[oaicite:1]{index=1}
+        # mask = binary_closing(mask, structure=np.ones((3, 3)))# closes one-pixel gaps :contentReference[oaicite:2]{index=2}
+        padded = np.pad(mask.astype(float), 1, constant_values=0)
 
-    # 3️⃣ Build polygons *with holes* at C speed — one line!
-    polys = gpd.GeoSeries(rings).build_area()  # GEOS/JTS build-area :contentReference[oaicite:4]{index=4}
+        # 2️⃣ Convert every *ring* returned by marching-squares into a LineString
+        rings = [
+            LineString([(p[1] - 1, p[0] - 1) for p in c])  # shift because of the 1-pixel pad
+            for c in measure.find_contours(padded, 0.5)  # skimage marching squares :contentReference[oaicite:3]{index=3}
+        ]
+
+        if not rings:
+            return []
+
+        # 3️⃣ Build polygons *with holes* at C speed — one line!
+        polys = gpd.GeoSeries(rings).build_area()  # GEOS/JTS build-area :contentReference[oaicite:4]{index=4}
 
     # 4️⃣ Optional smoothing / simplification exactly like before
     polys = polys.buffer(0)  # ensure valid shells after build-area :contentReference[oaicite:5]{index=5}
@@ -90,14 +131,19 @@ def mask_to_polygons(mask, min_area=100, simplify_tol=1.0):
     # 5️⃣ Filter out tiny blobs and return plain Shapely objects
     polys = polys[polys.area >= min_area]
 
-    return list(polys.geometry)
+    result = list(polys.geometry)
+    annotate(pixels=int(mask.size), polygons=len(result),
+             vertices=int(shapely.get_num_coordinates(result).sum()) if result else 0)
+    return result
 
 
 def flip_polygons_vertically(polygons, height_px):
     return [affinity.scale(poly, xfact=1, yfact=-1, origin=(0, height_px)) for poly in polygons]
 
-@timed
+@traced
 def generate_layer_mesh(polygons, thickness):
+    import trimesh
+
     if not isinstance(polygons, list):
         polygons = [polygons]
 
@@ -114,10 +160,13 @@ def generate_layer_mesh(polygons, thickness):
             continue
         m = trimesh.creation.extrude_polygon(poly, thickness)
         meshes.append(m)
+    annotate(polygons=len(flat_polys), triangles=sum(len(m.faces) for m in meshes))
     return trimesh.util.concatenate(meshes) if meshes else None
 
-@timed
+@traced
 def merge_layers_downward(meshes_list):
+    import trimesh
+
     last = None
     for i, meshes in enumerate(meshes_list[::-1]):
         for j, mesh in enumerate(meshes[::-1]):
@@ -127,8 +176,7 @@ def merge_layers_downward(meshes_list):
                 last = trimesh.util.concatenate(last, mesh)
                 meshes_list[-(i + 1)][-(j + 1)] = last
 
-from shapely.ops import unary_union
-@timed
+@traced
 def merge_polys_downward(polys_list):
     """
     In-place cumulative union of every sub-layer group with all above it.
@@ -170,88 +218,332 @@ def merge_polys_downward(polys_list):
 
 
 
-def _generate_base_mesh(segmented_image, layer_height=0.2, base_layers=4,
-                      target_max_cm=10):
-    base_height = layer_height * base_layers
-    w_px, h_px = segmented_image.size
-    scale_xy = (target_max_cm * 10) / max(w_px, h_px)
+import multiprocessing as mp
+import queue
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 
-    # Base layer
-    base_rect = Polygon([(0, 0), (w_px, 0), (w_px, h_px), (0, h_px)])
-    base_poly = flip_polygons_vertically([base_rect], h_px)
-    base_mesh = generate_layer_mesh(base_poly, base_height)
-    if base_mesh:
-        base_mesh.apply_scale([scale_xy, scale_xy, 1])
-        return base_mesh, base_height
+# Heavy modules the pool workers need for polygonization and extrusion
+WORKER_MODULES = ("skimage.measure", "geopandas", "trimesh")
+
+# "process" pays for worker start-up and pickling but runs pure-Python code in
+# parallel; "thread" shares memory with the caller and relies on GEOS, NumPy
+# and zlib releasing the GIL. benchmarks/bench_backends.py compares them.
+BACKENDS = ("process", "thread")
+STAGES = ("polygons", "meshes", "export")
+
+
+def default_backend(stage):
+    """
+    Backend for `stage` from $DRUCKEN3D_BACKEND: either one backend for every
+    stage ("thread") or per stage ("polygons=thread,meshes=process").
+    Defaults to "process".
+    """
+    import os
+
+    setting = os.environ.get("DRUCKEN3D_BACKEND", "").strip()
+    if not setting:
+        return "process"
+    if "=" not in setting:
+        choices = {s: setting for s in STAGES}
+    else:
+        choices = dict(item.split("=", 1) for item in setting.split(",") if "=" in item)
+    backend = choices.get(stage, "process").strip()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r} for {stage}, expected one of {BACKENDS}")
+    return backend
 
-import multiprocessing as mp
-from itertools import product
+
+def preload_worker_modules():
+    """
+    With the fork start method, children inherit the parent's modules, so
+    importing the worker modules once here (off the UI thread, right before a
+    pool is created) saves every worker from importing them again. Spawned
+    workers import only what their first task needs, so nothing is done then.
+    """
+    if mp.get_start_method() == "fork":
+        for name in WORKER_MODULES:
+            importlib.import_module(name)
+
+
+def make_pool(processes=None, backend="process"):
+    """A process pool, or a thread pool with the same interface for backend="thread"."""
+    if backend == "thread":
+        return ThreadPool(processes=processes)
+    if backend != "process":
+        raise ValueError(f"Unknown backend {backend!r}, expected one of {BACKENDS}")
+    preload_worker_modules()
+    return mp.Pool(processes=processes)
+
+
+@contextmanager
+def worker_pool(pool=None, n_tasks=None, processes=None, backend="process"):
+    """
+    Yield `pool` if the caller shares one, otherwise a fresh `backend` pool
+    sized to the work (and at most `processes` large) that is closed again on exit.
+    """
+    if pool is not None:
+        yield pool
+        return
+    limit = processes or mp.cpu_count()
+    processes = limit if n_tasks is None else max(1, min(limit, n_tasks))
+    with make_pool(processes, backend) as own_pool:
+        yield own_pool
+
+
+def pool_size(plan=None):
+    """
+    Number of workers a stage will run on, to size task splits for: the
+    plan's, else one per CPU. Callers sharing a pool pass the plan it was
+    sized by, or their share of it.
+    """
+    return (plan and plan.processes) or mp.cpu_count()
+
+
+def imap_bounded(workers, func, tasks, max_inflight=None):
+    """
+    Like workers.imap_unordered(func, tasks), but with at most `max_inflight`
+    tasks handed to the pool at once, so a planner can cap how many task
+    inputs and results are alive at the same time.
+    """
+    if not max_inflight:
+        yield from workers.imap_unordered(func, tasks)
+        return
+
+    done = queue.Queue()
+    pending = iter(tasks)
+    inflight = 0
+
+    def submit():
+        nonlocal inflight
+        while inflight < max_inflight:
+            task = next(pending, None)
+            if task is None:
+                return
+            workers.apply_async(func, (task,),
+                                callback=lambda r: done.put((True, r)),
+                                error_callback=lambda e: done.put((False, e)))
+            inflight += 1
+
+    submit()
+    while inflight:
+        ok, result = done.get()
+        inflight -= 1
+        if not ok:
+            raise result
+        submit()
+        yield result
+
+
+def pack_mask(mask):
+    """Bit-pack a boolean mask (8× smaller to hold and to send to a worker)."""
+    return np.packbits(mask, axis=None), mask.shape
+
+
+def pack_level(counts, level, min_pixels=FUSED_PACK_MIN_PIXELS):
+    """
+    pack_mask(counts >= level); with the Numba kernels and at least
+    `min_pixels` pixels in one pass, without the boolean mask in between.
+    """
+    if counts.size >= min_pixels and kernels.enabled():
+        return kernels.threshold_pack(counts, level), counts.shape
+    return pack_mask(counts >= level)
+
+
+def unpack_mask(packed):
+    bits, shape = packed
+    return np.unpackbits(bits, count=shape[0] * shape[1]).reshape(shape).view(bool)
 
 
 def process_mask(task):
-    from shapely.geometry import Polygon  # If needed for serialization safety
-    (fi, L), mask, h_px = task
-    if not mask.any():
-        return (fi, L, [])
-    polys = mask_to_polygons(mask, min_area=MIN_AREA, simplify_tol=SIMPLIFY_TOLERANCE)
+    (fi, L), part, packed, h_px, (x0, y0), outline = task
+    if not packed[0].any():
+        return (fi, L, part, [])
+    mask = unpack_mask(packed)
+    polys = mask_to_polygons(mask, **outline)
+    if x0 or y0:
+        # the mask was cropped out of the full image by split_mask()
+        polys = [affinity.translate(poly, xoff=x0, yoff=y0) for poly in polys]
     flipped = flip_polygons_vertically(polys, h_px)
-    return (fi, L, flipped)
+    return (fi, L, part, flipped)
+
+def build_counts_map(seg_arr, shades):
+    """
+    For every filament fi ≥ 1, an H×W uint8 array holding how many of its
+    layers cover each pixel (0 = none).
+    """
+    if kernels.enabled():
+        counts = _fused_counts(seg_arr, shades)
+        counts_map = {fi: counts[fi - 1] for fi in range(1, len(shades))}
+    else:
+        masks = extract_color_masks(seg_arr, shades)
+        counts_map = {}
+        for fi in range(1, len(shades)):
+            cnt = np.zeros(seg_arr.shape[:2], dtype=np.uint8)
+            for si in range(len(shades[fi])):
+                m = masks.get((fi, si))
+                if m is not None:
+                    cnt[m] = si + 1
+            counts_map[fi] = cnt
+    for fi, cnt in counts_map.items():
+        print(f"Layer height {fi}: {np.flatnonzero(np.bincount(cnt.ravel()))}")
+    return counts_map
+
+
+def _fused_counts(seg_arr, shades):
+    """
+    build_counts_map() in one pass over the pixels (see kernels.counts_from_rgb()).
+    Like extract_color_masks(), a colour shared by several shades counts for
+    the first of them only.
+    """
+    first = {}
+    for fi, group in enumerate(shades):
+        for si, (r, g, b) in enumerate(group):
+            first.setdefault((r << 16) | (g << 8) | b, (fi - 1, si + 1))
+    codes = sorted(first)
+    targets = np.array([first[c] for c in codes], dtype=np.int64).reshape(-1, 2)
+    out = np.zeros((max(len(shades) - 1, 0),) + seg_arr.shape[:2], dtype=np.uint8)
+    return kernels.counts_from_rgb(seg_arr, np.array(codes, dtype=np.uint32), targets, out)
+
 
-@timed
+def mask_levels(counts):
+    """
+    The levels L whose masks counts >= L are polygonized: 1 up to the highest
+    count. Counts can skip values (a filament only ever printed four blend
+    layers thick has counts 0 and 4 alone), so the number of distinct counts
+    is not the number of levels; every level below the highest still prints.
+    """
+    return range(1, int(counts.max()) + 1)
+
+
+def get_cached_polygons(cache, digest):
+    """The polygons cached for a mask digest as a list, or None."""
+    cached = cache.get(("polygons", digest))
+    if isinstance(cached, LayeredGeometry):
+        return cached.layer_polygons(0)[0]
+    return cached
+
+
+def put_cached_polygons(cache, digest, polys):
+    """Cache a mask's polygons in columns: a session's worth of them would be large as Shapely objects."""
+    cache.put(("polygons", digest), LayeredGeometry.from_polygons([[polys]]))
+
+
+def prepare_mask_tasks(segmented_image, shades, cache=None, workers=1, outline=None):
+    """
+    Build the (filament, level) polygonization tasks for process_mask().
+    Masks travel bit-packed (see pack_mask()), so all of them can be queued
+    without holding a full-size boolean array per task. `outline` holds the
+    mask_to_polygons() options, outline_options() of the image if None.
+
+    Tasks come longest first by mask_cost(). With several `workers`, masks that
+    would take longer than a worker's share of the stage are split along their
+    connected components; each part is a task of its own, see PartCollector.
+
+    :returns: (tasks, cached_results, digests) — masks found in `cache` are
+              returned as ready (fi, L, polys) results instead of tasks, and
+              `digests` maps every remaining (fi, L) to its cache key digest.
+    """
+    outline = outline or outline_options(segmented_image.size)
+    seg_arr = np.array(segmented_image.convert("RGBA"))
+    counts_map = build_counts_map(seg_arr, shades)
+
+    h_px = seg_arr.shape[0]
+    digests = {}
+    results = []
+    todo = []
+    for fi in range(1, len(shades)):
+        cnt = counts_map[fi]
+        levels = mask_levels(cnt)
+        costs = level_costs(cnt, len(levels))
+        for L in levels:
+            if cache is not None:
+                digest = packed_mask_digest(pack_level(cnt, L), h_px, *sorted(outline.items()))
+                cached = get_cached_polygons(cache, digest)
+                if cached is not None:
+                    results.append((fi, L, cached))
+                    continue
+                digests[(fi, L)] = digest
+            todo.append((fi, L, costs[L]))
+
+    # masks are rebuilt from the counts map here rather than kept from above,
+    # so only one full-size boolean mask is alive at a time
+    costed = []
+    splits = plan_splits([cost for _, _, cost in todo], workers)
+    for (fi, L, cost), parts in zip(todo, splits):
+        if parts > 1:
+            labeled = label_level(counts_map[fi], L)
+            pieces = [(pack_mask(piece), offset) for piece, offset in split_mask(labeled[0] > 0, parts, labeled)]
+        else:
+            pieces = [(pack_level(counts_map[fi], L), (0, 0))]
+        for part, (packed, offset) in enumerate(pieces):
+            costed.append((cost / len(pieces), ((fi, L), part, packed, h_px, offset, outline)))
+    tasks = [task for _, task in sorted(costed, key=lambda c: -c[0])]
+
+    if cache is not None:
+        print(f"Polygon cache: reused {len(results)} masks, computing {len(todo)}")
+    return tasks, results, digests
+
+@traced
 def create_layered_polygons_parallel(
     segmented_image,
     shades,
     progress_cb=None,
+    is_cancelled=None,
+    cache=None,
+    pool=None,
+    plan=None,
+    backend=None,
+    outline=None,
+    return_filaments=False,
 ):
     """
-    :progress_cb: a callable progress_cb(completed: int, total: int) → bool
-                  should return False if you want to abort early.
+    Layered polygons, base slab first, then one layer per filament that has
+    any polygons.
+
+    :progress_cb: a callable progress_cb(fraction: float), called from this
+                  thread; GTK callers must hop to the main loop themselves.
+    :is_cancelled: optional callable polled after every finished mask; when it
+                   returns True the pool is terminated and None is returned.
+    :cache: optional ArtifactCache; polygons are stored under the digest of the
+            (filament, level) mask they came from, so layers whose mask did not
+            change since an earlier call are reused instead of re-polygonized.
+    :pool: optional shared multiprocessing pool; by default a private one is used.
+    :plan: optional planner.MemoryPlan capping worker count and tasks in flight.
+    :backend: "process" or "thread" for a private pool; default_backend("polygons") when None.
+    :outline: mask_to_polygons() options from outline_options(); pixel-scale defaults when None.
+    :return_filaments: also return the filament index of every layer (0 for
+                       the base), as (layered polygons, filaments).
     """
 
     ensure_dir(OUTPUT_DIR)
     w_px, h_px = segmented_image.size
-    seg_arr = np.array(segmented_image.convert("RGBA"))
-
-    # ---- steps 1 & 2 unchanged ----
-    masks = extract_color_masks(seg_arr, shades)
-    counts_map = {}
-    for fi in range(1, len(shades)):
-        cnt = np.zeros(seg_arr.shape[:2], dtype=int)
-        for si in range(len(shades[fi])):
-            m = masks.get((fi, si))
-            if m is not None:
-                cnt[m] = si + 1
-        counts_map[fi] = cnt
-        print(f"Layer height {fi}: {np.unique(cnt)}")
-
-    # ---- step 3: build tasks ----
-    h_px = seg_arr.shape[0]
-    tasks = []
-    for fi in range(1, len(shades)):
-        cnt = counts_map[fi]
-        for L in range(1, len(np.unique(cnt)) + 1):
-            mask_L = cnt >= L
-            tasks.append(((fi, L), mask_L, h_px))
+    tasks, results, digests = prepare_mask_tasks(segmented_image, shades, cache, pool_size(plan), outline)
+    parts = PartCollector((key for key, *_ in tasks), merge_polygon_parts)
 
     total = len(tasks)
     completed = 0
-    results = []
 
     # ---- step 5: run in parallel but iterate for progress ----
-    with mp.Pool(processes=mp.cpu_count()) as pool:
-        # imap yields one result at a time as soon as it's ready
-        for fi, L, polys in pool.imap_unordered(process_mask, tasks):
-            results.append((fi, L, polys))
-            completed += 1
-
-            if progress_cb:
-                # We must call into GTK from the main thread:
-                # GLib.idle_add will schedule the callback on the main loop.
-                # We pass fraction (0.0–1.0) or raw counts if you prefer.
-                def _emit(done, tot):
-                    # If callback returns False, that means “please abort”
-                    return progress_cb((done/tot) / 2)
-                GLib.idle_add(_emit, completed, total)
+    if tasks:
+        with worker_pool(pool, total, plan and plan.processes,
+                         backend or default_backend("polygons")) as workers:
+            # yields one result at a time as soon as it's ready
+            results_iter = imap_bounded(workers, TracedTask(process_mask), tasks, plan and plan.max_inflight)
+            for fi, L, part, polys in map(collect, results_iter):
+                if is_cancelled and is_cancelled():
+                    if workers is not pool:
+                        workers.terminate()
+                    return None
+                completed += 1
+                done, polys = parts.add((fi, L), part, polys)
+                if done:
+                    results.append((fi, L, polys))
+                    if cache is not None:
+                        put_cached_polygons(cache, digests[(fi, L)], polys)
+
+                if progress_cb:
+                    progress_cb((completed / total) / 2)
 
     # ---- steps 6 & 7 unchanged ----
     polys_map = {}
@@ -259,53 +551,103 @@ def create_layered_polygons_parallel(
         polys_map.setdefault(fi, {})[L] = polys
 
     polys_list = []
+    filaments = [0]
     for fi in range(1, len(shades)):
         poly_list = [polys_map.get(fi, {}).get(L, []) for L in range(1, len(shades[fi]) + 1)]
         if any(poly_list):
             polys_list.append(poly_list)
+            filaments.append(fi)
 
     base = Polygon([(0, 0), (w_px, 0), (w_px, h_px), (0, h_px)])
     base = flip_polygons_vertically([base], h_px)[0]
     polys_list.insert(0, [[base]])
 
+    if return_filaments:
+        return polys_list, filaments
     return polys_list
 
 
 def process_generate_layer_mesh(task):
-    idx, idy, sublayer, layer_height = task
+    idx, idy, part, sublayer, layer_height = task
     try:
         m = generate_layer_mesh(sublayer, layer_height)
-        return (idx, idy, m)
+        return (idx, idy, part, m)
     except Exception as e:
         print(f"Error in generate_layer_mesh for layer {idx}, shade {idy}: {e}")
-        return (idx, idy, None)
+        return (idx, idy, part, None)
 
 
-@timed
-def polygons_to_meshes_parallel(segmented_image,
-                                polys_list,
-                                layer_height=0.2,
-                                base_layers=4,
-                                target_max_cm=10,
-                                progress_cb=None):
+def prepare_mesh_tasks(groups, thickness, workers=1):
+    """
+    Extrusion tasks for process_generate_layer_mesh() from {(idx, idy): polygons},
+    longest first by vertex count, with oversized groups split into runs.
+    """
+    keys = list(groups)
+    costs = [polygons_cost(groups[key]) for key in keys]
+    costed = []
+    for key, cost, parts in zip(keys, costs, plan_splits(costs, workers)):
+        runs = split_polygons(groups[key], parts) if parts > 1 else [groups[key]]
+        for part, run in enumerate(runs):
+            costed.append((cost / len(runs), key + (part, run, thickness)))
+    return [task for _, task in sorted(costed, key=lambda c: -c[0])]
+
+
+@traced
+def build_unit_layer_meshes(polys_list, progress_cb=None, cache=None, pool=None, plan=None, backend=None):
+    """
+    Extrude every sub-layer to unit height in pixel space and merge downward.
+
+    The result only depends on the polygon footprints; layer height, base
+    thickness and print size are applied afterwards by place_layer_meshes(),
+    so changing export settings never re-triangulates anything.
+
+    :cache: optional ArtifactCache; sub-layer meshes are stored under the digest
+            of their polygons, and the merged stack under the digests of all of them.
+    :plan: optional planner.MemoryPlan capping worker count and tasks in flight.
+    :backend: "process" or "thread" for a private pool; default_backend("meshes") when None.
+    :returns: unit_layers[layer][slab], meshes with z in [0, 1]
+    """
     # 1) Flatten out all the (layer, shade, sublayer) tasks
-    tasks = []
+    digests = {}
+    if cache is not None:
+        for idx, polys in enumerate(polys_list):
+            for idy, sublayer in enumerate(polys):
+                digests[(idx, idy)] = polygons_digest(sublayer, UNIT_THICKNESS)
+        stack_key = ("unit-layers",) + tuple(digests[k] for k in sorted(digests))
+        stacked = cache.get(stack_key)
+        if stacked is not None:
+            if progress_cb:
+                progress_cb(1.0)
+            return stacked
+
+    groups = {}
+    results = []
     for idx, polys in enumerate(polys_list):
         for idy, sublayer in enumerate(polys):
-            tasks.append((idx, idy, sublayer, layer_height))
+            if cache is not None:
+                cached = cache.get(("mesh", digests[(idx, idy)]))
+                if cached is not None:
+                    results.append((idx, idy, cached))
+                    continue
+            groups[(idx, idy)] = sublayer
+    tasks = prepare_mesh_tasks(groups, UNIT_THICKNESS, pool_size(plan))
+    parts = PartCollector(((idx, idy) for idx, idy, *_ in tasks), merge_mesh_parts)
     total = len(tasks)
-    if total == 0:
-        if progress_cb:
-            progress_cb(1.0)
-        return []
 
-    # 2) Run them in a Pool, reporting progress as each result arrives
-    results = []
-    with mp.Pool(processes=mp.cpu_count()) as pool:
-        for n, triple in enumerate(pool.imap(process_generate_layer_mesh, tasks), start=1):
-            results.append(triple)
-            if progress_cb:
-                progress_cb(n / total)
+    # 2) Run them in a Pool, longest first, reporting progress as each result arrives
+    if tasks:
+        with worker_pool(pool, len(tasks), plan and plan.processes,
+                         backend or default_backend("meshes")) as workers:
+            traced_mesh = TracedTask(process_generate_layer_mesh)
+            for completed, (idx, idy, part, mesh) in enumerate(
+                    map(collect, imap_bounded(workers, traced_mesh, tasks, plan and plan.max_inflight)), 1):
+                done, mesh = parts.add((idx, idy), part, mesh)
+                if done:
+                    results.append((idx, idy, mesh))
+                    if cache is not None and mesh is not None:
+                        cache.put(("mesh", digests[(idx, idy)]), mesh)
+                if progress_cb:
+                    progress_cb(completed / total)
 
     # 3) Rebuild into meshes_list[layer][shade]
     meshes_dict = {}
@@ -320,26 +662,92 @@ def polygons_to_meshes_parallel(segmented_image,
         if sublayers:
             meshes_list.append(sublayers)
 
-    # 4) Merge downward and build the base
+    # 4) Merge downward; this only replaces list entries, cached meshes stay untouched
     merge_layers_downward(meshes_list)
-    base_mesh, base_height = _generate_base_mesh(
-        segmented_image, layer_height, base_layers, target_max_cm
-    )
 
-    # 5) Scale & stack each layer
-    w_px, h_px = segmented_image.size
+    if cache is not None:
+        cache.put(stack_key, meshes_list)
+    if progress_cb:
+        progress_cb(1.0)
+    return meshes_list
+
+
+def unit_base_mesh(w_px, h_px):
+    """Unit-height slab covering the whole image, flipped like the layer polygons."""
+    base_rect = Polygon([(0, 0), (w_px, 0), (w_px, h_px), (0, h_px)])
+    base_poly = flip_polygons_vertically([base_rect], h_px)
+    return generate_layer_mesh(base_poly, UNIT_THICKNESS)
+
+
+def place_unit_mesh(mesh, scale_xy, scale_z, z0):
+    # affine copy of a unit mesh; faces are shared, only vertices are transformed
+    import trimesh
+
+    vertices = mesh.vertices * np.array([scale_xy, scale_xy, scale_z])
+    vertices[:, 2] += z0
+    return trimesh.Trimesh(vertices=vertices, faces=mesh.faces, process=False)
+
+
+@traced
+def place_layer_meshes(unit_layers,
+                       image_size,
+                       layer_height=0.2,
+                       base_layers=4,
+                       target_max_cm=10):
+    """
+    Scale and stack the unit meshes from build_unit_layer_meshes() into print
+    coordinates. Returns [base_mesh, layer_0, layer_1, ...] in millimetres.
+    """
+    import trimesh
+
+    w_px, h_px = image_size
     scale_xy = (target_max_cm * 10) / max(w_px, h_px)
-    meshes = [base_mesh] if base_mesh else []
+    base_height = layer_height * base_layers
+
+    # Base layer
+    base_mesh = unit_base_mesh(w_px, h_px)
+    meshes = [place_unit_mesh(base_mesh, scale_xy, base_height, 0.0)] if base_mesh else []
+
+    # Scale & stack each layer
     current_z0 = base_height
-    for layer in meshes_list:
+    for layer in unit_layers:
+        placed = []
         for m in layer:
-            m.apply_translation([0, 0, current_z0])
+            placed.append(place_unit_mesh(m, scale_xy, layer_height, current_z0))
             if not m.is_empty:
                 current_z0 += layer_height
+        meshes.append(trimesh.util.concatenate(placed))
+
+    return meshes
+
+
+@traced
+def polygons_to_meshes_parallel(segmented_image,
+                                polys_list,
+                                layer_height=0.2,
+                                base_layers=4,
+                                target_max_cm=10,
+                                progress_cb=None,
+                                cache=None,
+                                pool=None,
+                                plan=None,
+                                backend=None):
+    """
+    :cache: optional ArtifactCache, see build_unit_layer_meshes(). With a cache,
+            re-exporting the same polygons with other settings only re-places meshes.
+    :pool: optional shared multiprocessing pool.
+    :plan: optional planner.MemoryPlan.
+    :backend: see build_unit_layer_meshes().
+    """
+    if not any(len(polys) for polys in polys_list):
+        if progress_cb:
+            progress_cb(1.0)
+        return []
 
-        combined = trimesh.util.concatenate(layer)
-        combined.apply_scale([scale_xy, scale_xy, 1])
-        meshes.append(combined)
+    unit_layers = build_unit_layer_meshes(polys_list, progress_cb=progress_cb, cache=cache,
+                                          pool=pool, plan=plan, backend=backend)
+    meshes = place_layer_meshes(unit_layers, segmented_image.size,
+                                layer_height, base_layers, target_max_cm)
 
     # final callback = 100%
     if progress_cb:
@@ -349,18 +757,15 @@ def polygons_to_meshes_parallel(segmented_image,
 
 
 
-import numpy as np
-import matplotlib
-matplotlib.use('Agg')  # non-interactive backend
-import matplotlib.pyplot as plt
-from shapely.geometry import Polygon, MultiPolygon
-from shapely.ops import unary_union
-from gi.repository import GdkPixbuf
-import io
+def _pyplot():
+    import matplotlib
+    matplotlib.use('Agg')  # non-interactive backend
+    import matplotlib.pyplot as plt
+    return plt
 
 
-@timed
-def render_polygons_to_pixbuf(
+@traced
+def render_polygons_to_png(
     layered_polygons,
     filament_shades,
     image_size=None,
@@ -368,9 +773,11 @@ def render_polygons_to_pixbuf(
     height=400,
     bg_color='white',
     progress_cb=None,
+    is_cancelled=None,
 ):
     """
-    Render each polygon in `layered_polygons` using its exact shade color.
+    Render each polygon in `layered_polygons` using its exact shade color and
+    return the picture as PNG bytes.
 
     - layered_polygons: list of layers; each layer is a list of sub-layer groups,
       and each sub-layer group is either a Polygon/MultiPolygon or an iterable of them.
@@ -378,7 +785,15 @@ def render_polygons_to_pixbuf(
       gives the exact color for that sub-layer.
     - image_size: (w_px, h_px) to match input resolution, else use width/height.
     - bg_color: background fill (name, hex, or 'transparent').
+    - is_cancelled: optional callable; returning True aborts and yields None.
+
+    A geometry.LayeredGeometry is drawn straight from its coordinate arrays,
+    one compound path per group, without building any Shapely objects.
     """
+    plt = _pyplot()
+    from matplotlib.path import Path
+    from matplotlib.patches import PathPatch
+
     # 1) Determine output resolution
     if image_size:
         w_px, h_px = image_size
@@ -389,7 +804,19 @@ def render_polygons_to_pixbuf(
 
     # 2) Flatten out all polys & assign each its precise shade color
     flat_polys, flat_colors = [], []
-    for layer_idx, layer_groups in enumerate(layered_polygons):
+    columnar = isinstance(layered_polygons, LayeredGeometry)
+    if columnar:
+        for group, (layer_idx, shade_idx) in enumerate(layered_polygons.group_keys):
+            shades = filament_shades[layer_idx]
+            color = shades[shade_idx] if shade_idx < len(shades) else shades[-1]
+            coords, starts = layered_polygons.group_rings(group)
+            if len(coords):
+                codes = np.full(len(coords), Path.LINETO, dtype=Path.code_type)
+                codes[starts[:-1]] = Path.MOVETO
+                codes[starts[1:] - 1] = Path.CLOSEPOLY
+                flat_polys.append(Path(np.asarray(coords), codes))
+                flat_colors.append(color)
+    for layer_idx, layer_groups in enumerate(() if columnar else layered_polygons):
         shades = filament_shades[layer_idx]
         for shade_idx, group in enumerate(layer_groups):
             color = shades[shade_idx] if shade_idx < len(shades) else shades[-1]
@@ -418,33 +845,40 @@ def render_polygons_to_pixbuf(
 
     # 4) Auto-zoom to all polygons
     xs, ys = [], []
-    for poly in flat_polys:
-        minx, miny, maxx, maxy = poly.bounds
-        xs.extend([minx, maxx])
-        ys.extend([miny, maxy])
+    if columnar:
+        if flat_polys:
+            minx, miny, maxx, maxy = layered_polygons.total_bounds
+            xs, ys = [minx, maxx], [miny, maxy]
+    else:
+        for poly in flat_polys:
+            minx, miny, maxx, maxy = poly.bounds
+            xs.extend([minx, maxx])
+            ys.extend([miny, maxy])
     if xs and ys:
         ax.set_xlim(min(xs), max(xs))
         ax.set_ylim(min(ys), max(ys))
 
     # 5) Draw every shape with its shade (full opacity)
-    from matplotlib.path import Path
-    from matplotlib.patches import PathPatch
-
     length = len(flat_polys)
     current = 0
     for poly, rgb in zip(flat_polys, flat_colors):
-        geoms = poly.geoms if isinstance(poly, MultiPolygon) else [poly]
-        for geom in geoms:
-            # Exterior ring
-            verts = list(geom.exterior.coords)
-            codes = [Path.MOVETO] + [Path.LINETO]*(len(verts)-2) + [Path.CLOSEPOLY]
-            # Interior holes
-            for interior in geom.interiors:
-                icoords = list(interior.coords)
-                verts += icoords
-                codes += [Path.MOVETO] + [Path.LINETO]*(len(icoords)-2) + [Path.CLOSEPOLY]
-
-            path = Path(verts, codes)
+        if columnar:
+            paths = [poly]
+        else:
+            paths = []
+            geoms = poly.geoms if isinstance(poly, MultiPolygon) else [poly]
+            for geom in geoms:
+                # Exterior ring
+                verts = list(geom.exterior.coords)
+                codes = [Path.MOVETO] + [Path.LINETO]*(len(verts)-2) + [Path.CLOSEPOLY]
+                # Interior holes
+                for interior in geom.interiors:
+                    icoords = list(interior.coords)
+                    verts += icoords
+                    codes += [Path.MOVETO] + [Path.LINETO]*(len(icoords)-2) + [Path.CLOSEPOLY]
+                paths.append(Path(verts, codes))
+
+        for path in paths:
             patch = PathPatch(
                 path,
                 facecolor=np.array(rgb)/255.0,
@@ -454,24 +888,33 @@ def render_polygons_to_pixbuf(
             ax.add_patch(patch)
         # 5.1) Progress callback
         current += 1
+        if is_cancelled and current % 30 == 0 and is_cancelled():
+            plt.close(fig)
+            return None
         if progress_cb and current % 30 == 0:
-            # We must call into GTK from the main thread:
-            # GLib.idle_add will schedule the callback on the main loop.
-            def _emit(done, tot):
-                # If callback returns False, that means “please abort”
-                return progress_cb((done/tot) / 2 + 0.5)
-            GLib.idle_add(_emit, current, length)
+            progress_cb((current / length) / 2 + 0.5)
 
 
     # 6) Export to PNG in memory
     buf = io.BytesIO()
     fig.savefig(buf, format='png', dpi=dpi, transparent=(bg_color=='transparent'))
     plt.close(fig)
-    buf.seek(0)
+    return buf.getvalue()
+
+
+def render_polygons_to_pixbuf(layered_polygons, filament_shades, image_size=None, **kwargs):
+    """
+    GTK wrapper around render_polygons_to_png(); same arguments, returns a
+    GdkPixbuf (or None when cancelled). GdkPixbuf is only imported here so the
+    rest of this module stays usable without a display.
+    """
+    from gi.repository import GdkPixbuf
 
-    # 7) Load into a GdkPixbuf
+    png = render_polygons_to_png(layered_polygons, filament_shades, image_size, **kwargs)
+    if png is None:
+        return None
     loader = GdkPixbuf.PixbufLoader.new_with_type('png')
-    loader.write(buf.getvalue())
+    loader.write(png)
     loader.close()
     return loader.get_pixbuf()
 
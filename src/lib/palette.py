@@ -0,0 +1,176 @@
+import itertools
+import math
+
+import numpy as np
+
+from .colorspace import rgb8_to_lab
+from .ingest import as_rgb_array, reduction_factor
+
+# Candidates are scored on a strided grid of at most this many pixels per side
+SAMPLE_MAX_SIDE = 128
+# Cover factors tried for every filament above the base: 1 to 5 blend layers
+COVER_FACTOR_CHOICES = (1.0, 0.5, 0.34, 0.25, 0.2)
+# More combinations than this are sampled rather than all scored
+MAX_CANDIDATES = 2000
+# Up to this many times MAX_CANDIDATES, the sample is drawn from the enumerated combinations
+ENUMERATE_FACTOR = 8
+# Distance matrix entries (candidates × shades × colours) computed at once: 16 MiB of float32
+BLOCK_ELEMENTS = 1 << 22
+# Score = mean ΔE + these penalties, so a suggestion has to buy extra layers
+# and busier outlines with colour accuracy
+LAYER_PENALTY = 0.25  # ΔE per printed blend layer
+EDGE_PENALTY = 10.0  # ΔE for an outline between every pair of neighbouring pixels
+
+
+class PaletteSample:
+    """
+    What palette candidates are scored against, computed once per image: a
+    strided grid of its pixels, the distinct colours in it with their Lab
+    values and pixel counts, and the grid as indices into those colours.
+    """
+
+    __slots__ = ("lab", "weights", "inverse")
+
+    def __init__(self, image, max_side=SAMPLE_MAX_SIDE):
+        rgb8 = as_rgb_array(image)
+        step = reduction_factor(rgb8.shape[1::-1], max_side)
+        grid = np.ascontiguousarray(rgb8[::step, ::step])
+        codes = (grid[..., 0].astype(np.uint32) << 16) | (grid[..., 1].astype(np.uint32) << 8) | grid[..., 2]
+        unique, inverse, counts = np.unique(codes.ravel(), return_inverse=True, return_counts=True)
+        colors = np.stack([unique >> 16, (unique >> 8) & 0xFF, unique & 0xFF], axis=1).astype(np.uint8)
+        self.lab = rgb8_to_lab(colors)
+        self.weights = counts.astype(np.float32)
+        self.inverse = inverse.reshape(grid.shape[:2])
+
+
+def candidates(n_filaments, max_candidates=MAX_CANDIDATES, seed=0):
+    """
+    Filament orders (C × n, indices base first) and cover factors (C × n; the
+    base's is unused and 1.0): every combination of order and
+    COVER_FACTOR_CHOICES, or `max_candidates` distinct ones drawn from them.
+    """
+    n_covers = n_filaments - 1
+    n_orders = math.factorial(n_filaments)
+    total = n_orders * len(COVER_FACTOR_CHOICES) ** n_covers
+    choices = np.array(COVER_FACTOR_CHOICES)
+    rng = np.random.default_rng(seed)
+    if total <= max_candidates * ENUMERATE_FACTOR:
+        orders = np.array(list(itertools.permutations(range(n_filaments))), dtype=np.int64)
+        picks = np.array(list(itertools.product(range(len(choices)), repeat=n_covers)), dtype=np.int64)
+        orders = np.repeat(orders, len(picks), axis=0)
+        picks = np.tile(picks, (n_orders, 1))
+        if total > max_candidates:
+            keep = np.sort(rng.choice(total, max_candidates, replace=False))
+            orders, picks = orders[keep], picks[keep]
+    else:
+        # far more combinations than wanted: draw until enough of them are distinct
+        drawn = np.empty((0, n_filaments + n_covers), dtype=np.int64)
+        while len(drawn) < max_candidates:
+            batch = np.concatenate([np.argsort(rng.random((max_candidates, n_filaments)), axis=1),
+                                    rng.integers(len(choices), size=(max_candidates, n_covers))], axis=1)
+            drawn = np.concatenate([drawn, batch])
+            _, first = np.unique(drawn, axis=0, return_index=True)
+            drawn = drawn[np.sort(first)]
+        drawn = drawn[:max_candidates]
+        orders, picks = drawn[:, :n_filaments], drawn[:, n_filaments:]
+    covers = np.ones(orders.shape)
+    covers[:, 1:] = choices[picks.reshape(len(orders), n_covers)]
+    return orders, covers
+
+
+def shade_table(colors, orders, covers):
+    """
+    generate_shades() for many candidates at once. Returns the shades as
+    (C × S × 3) uint8, which of them exist (C × S) and the blend level of
+    each slot (S): slot 0 is the base, then every filament gets as many
+    slots as the candidate with the most blend layers needs, unused ones
+    last, so the existing shades keep generate_shades()' order.
+    """
+    colors = np.asarray(colors, dtype=np.float64)
+    n, f = orders.shape
+    layers = np.round(1 / covers[:, 1:]).astype(np.int64)  # (C, F-1), as int(round()) rounds
+    m = int(layers.max()) if layers.size else 0
+    level = np.arange(1, m + 1)
+    blend = np.minimum(covers[:, 1:, None] * level, 1.0)[..., None]  # (C, F-1, M, 1)
+    prev, cur = colors[orders[:, :-1]][:, :, None], colors[orders[:, 1:]][:, :, None]
+    blended = np.round(prev * (1 - blend) + cur * blend)
+
+    shades = np.empty((n, 1 + (f - 1) * m, 3), dtype=np.uint8)
+    shades[:, 0] = colors[orders[:, 0]]
+    shades[:, 1:] = blended.reshape(n, -1, 3)
+    valid = np.ones(shades.shape[:2], dtype=bool)
+    valid[:, 1:] = (level <= layers[..., None]).reshape(n, -1)
+    return shades, valid, np.concatenate([[0], np.tile(level, f - 1)])
+
+
+def score_candidates(sample, colors, orders, covers):
+    """
+    Segment `sample` with every candidate the way segment_to_labels() does,
+    one vectorized distance computation per block of candidates. Returns a
+    dict of per-candidate arrays: mean ΔE of the sampled pixels to their
+    shade, printed blend layers (the highest level used per filament,
+    summed), the share of neighbouring grid pixels with different shades
+    (the outlines polygonization will have to trace) and the score.
+    """
+    n, f = orders.shape
+    pixel_lab = sample.lab
+    pixel_sq = np.einsum("uk,uk->u", pixel_lab, pixel_lab)
+    total_weight = sample.weights.sum()
+    h, w = sample.inverse.shape
+    pairs = max(h * (w - 1) + (h - 1) * w, 1)
+
+    delta_e = np.empty(n)
+    layers = np.empty(n, dtype=np.int64)
+    edges = np.empty(n)
+    n_slots = 1 + (f - 1) * int(np.round(1 / covers[:, 1:]).max()) if n and f > 1 else 1
+    block = max(1, BLOCK_ELEMENTS // (len(pixel_lab) * n_slots))
+    for start in range(0, n, block):
+        stop = min(start + block, n)
+        shades, valid, level = shade_table(colors, orders[start:stop], covers[start:stop])
+        shade_lab = rgb8_to_lab(shades)  # (b, S, 3)
+        shade_sq = np.einsum("bsk,bsk->bs", shade_lab, shade_lab)
+        dist = np.matmul(shade_lab, pixel_lab.T)  # squared distances, expanded
+        dist *= -2
+        dist += shade_sq[..., None]
+        dist += pixel_sq
+        dist[~valid] = np.inf
+        nearest = np.argmin(dist, axis=1)  # (b, U), the first of equal shades like np.argmin in the pipeline
+        best = np.take_along_axis(dist, nearest[:, None, :], axis=1)[:, 0]
+        delta_e[start:stop] = np.sqrt(np.maximum(best, 0)) @ sample.weights / total_weight
+
+        used = np.zeros(valid.shape, dtype=bool)
+        used[np.arange(stop - start)[:, None], nearest] = True
+        top = np.where(used[:, 1:], level[1:], 0).reshape(stop - start, f - 1, -1)
+        layers[start:stop] = top.max(axis=2).sum(axis=1)
+
+        labels = nearest[:, sample.inverse]  # (b, h, w)
+        changes = (labels[:, :, 1:] != labels[:, :, :-1]).sum(axis=(1, 2))
+        changes += (labels[:, 1:] != labels[:, :-1]).sum(axis=(1, 2))
+        edges[start:stop] = changes / pairs
+
+    score = delta_e + LAYER_PENALTY * layers + EDGE_PENALTY * edges
+    return {"delta_e": delta_e, "layers": layers, "edges": edges, "score": score}
+
+
+def suggest_palettes(sample, colors, count=5, max_candidates=MAX_CANDIDATES):
+    """
+    The `count` best-scoring filament orders and cover factors for `colors`
+    (RGB, any order) on a PaletteSample, best first, as dicts: order (indices
+    into `colors`, base first, as generate_shades() takes them),
+    cover_factors (for that order), delta_e, layers, edges and score.
+    Candidates that only differ in shades nothing maps to score the same;
+    of those only the first is suggested.
+    """
+    orders, covers = candidates(len(colors), max_candidates)
+    scores = score_candidates(sample, colors, orders, covers)
+    suggestions, seen = [], set()
+    for i in np.argsort(scores["score"], kind="stable"):
+        outcome = tuple(round(scores[key][i].item(), 6) for key in ("delta_e", "layers", "edges"))
+        if outcome in seen:
+            continue
+        seen.add(outcome)
+        suggestions.append(dict(order=orders[i].tolist(), cover_factors=covers[i].tolist(),
+                                **{key: values[i].item() for key, values in scores.items()}))
+        if len(suggestions) == count:
+            break
+    return suggestions
@@ -0,0 +1,139 @@
+import multiprocessing as mp
+import os
+
+# Rough per-unit costs, measured on the current pipeline (float32 Lab).
+# They are deliberately on the high side: the planner should keep a run inside
+# its budget, not predict it to the byte.
+SEGMENT_BYTES_PER_PIXEL = 32        # float32 Lab band and the argmin indices
+SEGMENT_BYTES_PER_PIXEL_SHADE = 30  # (pixels, shades, 3) difference, its square and the norm
+IMAGE_BYTES_PER_PIXEL = 16          # source, segmented RGB/RGBA and the label map
+POLYGON_TASK_BYTES_PER_PIXEL = 12   # unpacked mask + padded float64 copy in the worker
+MESH_TASK_BYTES_PER_PIXEL = 4       # triangulation, bounded by the mask's outline
+DECODE_BYTES_PER_PIXEL = 8          # a source Pillow decodes whole: its own mode and the RGB copy
+WORKER_BASE_BYTES = 160 * 2**20     # interpreter + numpy/shapely/skimage/trimesh per worker
+MIN_CHUNK_ROWS = 16
+
+DEFAULT_BUDGET_FRACTION = 0.6       # of the memory available when the run starts
+FALLBACK_BUDGET = 4 * 2**30
+
+
+def parse_size(text):
+    """'512M', '4G', '1.5g' or a plain byte count → bytes."""
+    text = str(text).strip().upper().rstrip("B")
+    factors = {"K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+    if text and text[-1] in factors:
+        return int(float(text[:-1]) * factors[text[-1]])
+    return int(float(text))
+
+
+def available_memory():
+    """Memory the OS could hand out right now, in bytes; None if unknown."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def default_budget():
+    """DRUCKEN3D_MEMORY_BUDGET if set, otherwise a share of the available memory."""
+    configured = os.environ.get("DRUCKEN3D_MEMORY_BUDGET")
+    if configured:
+        return parse_size(configured)
+    available = available_memory()
+    return int(available * DEFAULT_BUDGET_FRACTION) if available else FALLBACK_BUDGET
+
+
+class MemoryPlan:
+    """
+    How to run one image within a memory budget:
+
+    - chunk_rows: image rows segmented at once (None = whole image)
+    - processes: worker processes to start
+    - max_inflight: polygon/mesh tasks handed to the pool at once
+    - estimates: stage name → estimated peak bytes with these settings
+    """
+
+    def __init__(self, budget, chunk_rows, processes, max_inflight, estimates, fits):
+        self.budget = budget
+        self.chunk_rows = chunk_rows
+        self.processes = processes
+        self.max_inflight = max_inflight
+        self.estimates = estimates
+        self.fits = fits
+
+    def describe(self):
+        mib = lambda n: f"{n / 2**20:0.0f} MiB"
+        rows = "whole image" if self.chunk_rows is None else f"{self.chunk_rows} rows"
+        lines = [
+            f"Memory budget {mib(self.budget)}: segment {rows} at a time, "
+            f"{self.processes} worker(s), {self.max_inflight} task(s) in flight",
+        ]
+        lines += [f"  {stage:13s} ~{mib(size)}" for stage, size in self.estimates.items()]
+        if not self.fits:
+            lines.append("  warning: the image does not fit the budget even with one worker")
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return (f"MemoryPlan(chunk_rows={self.chunk_rows}, processes={self.processes}, "
+                f"max_inflight={self.max_inflight}, fits={self.fits})")
+
+
+def plan_memory(image_size, n_shades, n_tasks=None, budget=None, max_processes=None, concurrent_images=1,
+                backend="process", source_size=None):
+    """
+    Estimate each stage's peak memory for an image of `image_size` (w, h)
+    segmented into `n_shades` shades and pick settings that fit `budget`
+    bytes (default_budget() when None). Thread workers (backend="thread")
+    share the parent's interpreter, so only their task working set counts.
+
+    `concurrent_images` images are assumed to be in flight in this process at
+    once, sharing the workers; `n_tasks` (the number of masks, when known)
+    caps the worker count. `source_size` is the size of a source that is
+    decoded whole before it is reduced to `image_size`; it has to fit too.
+    """
+    budget = budget or default_budget()
+    w, h = image_size
+    pixels = w * h
+    max_processes = max_processes or mp.cpu_count()
+    if n_tasks is not None:
+        max_processes = max(1, min(max_processes, n_tasks))
+
+    # parent: the images themselves plus one boolean mask per shade while the
+    # counts map is built, and the bit-packed masks waiting for workers
+    resident = concurrent_images * pixels * (IMAGE_BYTES_PER_PIXEL + n_shades + n_shades / 8)
+
+    # segmentation: one chunk of rows at a time
+    row_cost = w * (SEGMENT_BYTES_PER_PIXEL + SEGMENT_BYTES_PER_PIXEL_SHADE * n_shades)
+    segment_share = max(budget - resident, 0) // max(concurrent_images, 1)
+    chunk_rows = None
+    if row_cost * h > segment_share:
+        chunk_rows = max(MIN_CHUNK_ROWS, int(segment_share // row_cost))
+    segment_peak = row_cost * (chunk_rows or h)
+
+    # workers: each holds one task's working set, process workers also their own interpreter
+    task_bytes = pixels * max(POLYGON_TASK_BYTES_PER_PIXEL, MESH_TASK_BYTES_PER_PIXEL)
+    per_worker = task_bytes + (WORKER_BASE_BYTES if backend == "process" else 0)
+    spare = budget - resident
+    processes = int(max(1, min(max_processes, spare // per_worker)))
+    fits = spare >= per_worker and resident + segment_peak <= budget
+
+    # tasks queued beyond one per worker only wait as packed masks or polygons
+    max_inflight = processes * 2
+
+    estimates = {
+        "images": int(resident),
+        "segmentation": int(segment_peak * concurrent_images),
+        "workers": int(processes * per_worker),
+    }
+    if source_size is not None:
+        # before any of the above: every image being decoded at once
+        estimates["decode"] = int(concurrent_images * source_size[0] * source_size[1] * DECODE_BYTES_PER_PIXEL)
+        fits = fits and estimates["decode"] <= budget
+    return MemoryPlan(budget, chunk_rows, processes, max_inflight, estimates, fits)
@@ -0,0 +1,210 @@
+import io
+import json
+import os
+import struct
+import zipfile
+
+import numpy as np
+
+from .geometry import COLUMNS, LayeredGeometry
+
+PROJECT_EXTENSION = ".stratum"
+FORMAT_VERSION = 1
+# .npy payloads start on this boundary inside the file, so they map aligned
+ALIGNMENT = 64
+_ALIGN_EXTRA_ID = 0xD935  # the zip extra field zipalign uses for padding
+_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+
+
+def _aligned_info(archive, name, size):
+    """ZipInfo for a stored member whose data will start on an ALIGNMENT boundary."""
+    info = zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0))
+    info.compress_type = zipfile.ZIP_STORED
+    info.file_size = size
+    zip64 = size * 1.05 > zipfile.ZIP64_LIMIT
+    start = archive.fp.tell() + _LOCAL_HEADER.size + len(name.encode()) + (20 if zip64 else 0)
+    pad = -start % ALIGNMENT
+    if pad < 6:
+        pad += ALIGNMENT
+    info.extra = struct.pack("<3H", _ALIGN_EXTRA_ID, pad - 4, ALIGNMENT) + bytes(pad - 6)
+    return info
+
+
+def _write_array(archive, name, array):
+    array = np.ascontiguousarray(array)
+    header = io.BytesIO()
+    np.lib.format.write_array_header_2_0(header, np.lib.format.header_data_from_array_1_0(array))
+    info = _aligned_info(archive, name, header.tell() + array.nbytes)
+    with archive.open(info, "w", force_zip64=info.file_size * 1.05 > zipfile.ZIP64_LIMIT) as f:
+        f.write(header.getvalue())
+        f.write(memoryview(array).cast("B"))
+
+
+def _map_array(path, archive, name):
+    """Memory-map a stored .npy member in place; nothing is read until it is touched."""
+    info = archive.getinfo(name)
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise ValueError(f"{name} is compressed and cannot be mapped")
+    with open(path, "rb") as f:
+        f.seek(info.header_offset)
+        fields = _LOCAL_HEADER.unpack(f.read(_LOCAL_HEADER.size))
+        f.seek(fields[-2] + fields[-1], os.SEEK_CUR)  # name and extra field
+        if np.lib.format.read_magic(f) == (1, 0):
+            shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    if not np.prod(shape, dtype=np.int64):
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape,
+                     order="F" if fortran else "C")
+
+
+def _source_bytes(image):
+    """The file the image was opened from, or the image encoded as PNG."""
+    filename = getattr(image, "filename", None)
+    if filename and os.path.isfile(filename):
+        with open(filename, "rb") as f:
+            return f.read(), os.path.splitext(filename)[1].lower() or ".png"
+    buf = io.BytesIO()
+    image.convert("RGB").save(buf, format="PNG")
+    return buf.getvalue(), ".png"
+
+
+def encode_polygons(layered_polygons):
+    """
+    Flatten layered_polygons[layer][level] (lists of Polygons/MultiPolygons,
+    or a LayeredGeometry) into the ragged coordinate arrays of
+    geometry.LayeredGeometry.
+    """
+    return LayeredGeometry.from_polygons(layered_polygons).arrays()
+
+
+def decode_polygons(arrays):
+    """Inverse of encode_polygons(), as a LayeredGeometry over the arrays themselves."""
+    return LayeredGeometry.from_arrays(arrays)
+
+
+POLYGON_ARRAYS = COLUMNS
+
+
+def save_project(path, image, filaments, settings, shades=None, labels=None, polygons=None, preview=None,
+                 source=None):
+    """
+    Write a .stratum project: an uncompressed zip holding project.json, the
+    source image file as it was loaded, and .npy members for the label map,
+    the layered polygons (see encode_polygons()) and the rendered preview.
+
+    :filaments: [{"rgba": [r, g, b, a], "cover_factor": f}, ...] in list order
+    :settings: export settings, e.g. layer_height, base_layers, max_size_cm
+    :labels: H×W shade-index map from segment_to_labels(), if computed
+    :preview: H×W×C uint8 array of the rendered preview, if any
+    :source: (bytes, extension) of the source file, when `image` was not
+             opened from one (e.g. Project.source_bytes() of an opened project)
+    The file is written next to `path` and moved into place when complete.
+    """
+    source, ext = source or _source_bytes(image)
+    meta = {
+        "version": FORMAT_VERSION,
+        "image": {"name": "source" + ext, "size": list(image.size)},
+        "filaments": filaments,
+        "settings": settings,
+        "shades": shades,
+        "arrays": [],
+    }
+
+    tmp = path + ".tmp"
+    try:
+        with zipfile.ZipFile(tmp, "w", zipfile.ZIP_STORED) as archive:
+            archive.writestr(meta["image"]["name"], source)
+            arrays = {}
+            if labels is not None:
+                arrays["labels"] = labels
+            if polygons is not None:
+                arrays.update({f"polygons/{k}": v for k, v in encode_polygons(polygons).items()})
+            if preview is not None:
+                arrays["preview"] = preview
+            for name, array in arrays.items():
+                _write_array(archive, name + ".npy", array)
+            meta["arrays"] = list(arrays)
+            archive.writestr("project.json", json.dumps(meta, indent=1))
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+class Project:
+    """
+    An opened .stratum file. Metadata is parsed on open; the label map,
+    polygons and preview are memory-mapped and only paged in when used, and
+    the source image is decoded on first access.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._archive = zipfile.ZipFile(path)
+        meta = json.loads(self._archive.read("project.json"))
+        if meta.get("version", 0) > FORMAT_VERSION:
+            raise ValueError(f"{path} was written by a newer version (format {meta['version']})")
+        self.meta = meta
+        self.filaments = meta["filaments"]
+        self.settings = meta["settings"]
+        self.shades = [[tuple(s) for s in shades] for shades in meta["shades"]] if meta["shades"] else None
+        self.image_size = tuple(meta["image"]["size"])
+        self._arrays = {name: _map_array(path, self._archive, name + ".npy") for name in meta["arrays"]}
+        self._image = None
+        self._polygons = None
+
+    @property
+    def has_polygons(self):
+        return "polygons/coords" in self._arrays
+
+    @property
+    def labels(self):
+        return self._arrays.get("labels")
+
+    @property
+    def preview(self):
+        return self._arrays.get("preview")
+
+    def open_source(self):
+        """The stored source image file, as a seekable file object."""
+        return self._archive.open(self.meta["image"]["name"])
+
+    def source_bytes(self):
+        """(bytes, extension) of the stored source file, as save_project() takes them."""
+        name = self.meta["image"]["name"]
+        return self._archive.read(name), os.path.splitext(name)[1]
+
+    def source_image(self):
+        """The stored source as a PIL image with only its header read."""
+        from .ingest import open_header
+
+        if self._image is None:
+            self._image = open_header(self.open_source())
+        return self._image
+
+    def segmented_image(self):
+        """The shade-coloured image the polygons were traced from, or None without a label map."""
+        from .mask_creation import labels_to_image
+
+        if self.labels is None or self.shades is None:
+            return None
+        return labels_to_image(self.labels, self.shades)
+
+    def polygons(self):
+        """The layered polygons as a LayeredGeometry over the mapped arrays, or None."""
+        if self._polygons is None and self.has_polygons:
+            self._polygons = decode_polygons({k: self._arrays[f"polygons/{k}"] for k in POLYGON_ARRAYS
+                                             if f"polygons/{k}" in self._arrays})
+        return self._polygons
+
+    def close(self):
+        self._arrays.clear()
+        self._archive.close()
+
+
+def load_project(path):
+    return Project(path)
@@ -0,0 +1,161 @@
+import heapq
+from collections import Counter
+
+import numpy as np
+
+from . import kernels
+
+# Relative weight of one boundary pixel against one interior pixel when
+# estimating polygonization cost: marching squares touches every pixel once,
+# but ring building, buffering and simplification scale with the outline.
+BOUNDARY_WEIGHT = 8
+# Tasks are split when they would take more than this share of a worker's
+# fair share of the whole stage
+SPLIT_FACTOR = 1.0
+
+
+def mask_cost(mask):
+    """Estimated polygonization cost of a boolean mask: pixels plus weighted outline length."""
+    boundary = (np.count_nonzero(mask[:, 1:] != mask[:, :-1])
+                + np.count_nonzero(mask[1:, :] != mask[:-1, :]))
+    return int(np.count_nonzero(mask)) + BOUNDARY_WEIGHT * int(boundary)
+
+
+def level_costs(counts, n_levels):
+    """
+    mask_cost(counts >= L) for every level L = 1..n_levels of a counts map,
+    indexed by L. A pass per level stays on NumPy: with the few levels a
+    filament has, a single scalar pass in Numba measured slower at every size.
+    """
+    return [0] + [mask_cost(counts >= L) for L in range(1, n_levels + 1)]
+
+
+def polygons_cost(group):
+    """Estimated extrusion cost of a polygon group: its vertex count."""
+    import shapely
+
+    geoms = group if isinstance(group, list) else [group]
+    return int(shapely.get_num_coordinates(geoms).sum()) if geoms else 0
+
+
+def _balance(costs, parts):
+    """Assign items to `parts` bins, longest first onto the lightest bin. Returns lists of indices."""
+    bins = [(0, i, []) for i in range(parts)]
+    for idx in sorted(range(len(costs)), key=lambda i: -costs[i]):
+        load, i, items = heapq.heappop(bins)
+        items.append(idx)
+        heapq.heappush(bins, (load + costs[idx], i, items))
+    return [sorted(items) for _, _, items in sorted(bins, key=lambda b: b[1]) if items]
+
+
+def label_level(counts, level):
+    """
+    The 4-connected components of counts >= level as (labels, count), like
+    ndimage.label(); thresholded and labelled in one pass with the Numba kernels.
+    """
+    from scipy import ndimage
+
+    if kernels.enabled():
+        return kernels.threshold_label(counts, level)
+    return ndimage.label(counts >= level)
+
+
+def split_mask(mask, parts, labeled=None):
+    """
+    Split a mask into up to `parts` masks of roughly equal cost along its
+    4-connected components, which is how the contour tracer separates
+    regions too, so the pieces polygonize to exactly the original polygons.
+    Each piece is cropped to its bounding box. `labeled` is the mask's
+    (labels, count) when already known, e.g. from label_level().
+
+    :returns: [(cropped_mask, (x0, y0)), ...]
+    """
+    from scipy import ndimage
+
+    labels, n = labeled or ndimage.label(mask)
+    if n < 2 or parts < 2:
+        return [(mask, (0, 0))]
+
+    slices = ndimage.find_objects(labels)
+    areas = np.bincount(labels.ravel())[1:]
+    costs = [int(areas[i]) + BOUNDARY_WEIGHT * 2 * ((s[0].stop - s[0].start) + (s[1].stop - s[1].start))
+             for i, s in enumerate(slices)]
+
+    pieces = []
+    for members in _balance(costs, min(parts, n)):
+        y0 = min(slices[i][0].start for i in members)
+        y1 = max(slices[i][0].stop for i in members)
+        x0 = min(slices[i][1].start for i in members)
+        x1 = max(slices[i][1].stop for i in members)
+        crop = np.isin(labels[y0:y1, x0:x1], np.asarray(members) + 1)
+        pieces.append((crop, (x0, y0)))
+    return pieces
+
+
+def split_polygons(group, parts):
+    """
+    Split a polygon group into up to `parts` contiguous runs of similar vertex
+    count. Runs keep the original order, so concatenating their meshes in part
+    order gives the same mesh as extruding the whole group.
+    """
+    from shapely.geometry import MultiPolygon
+    import shapely
+
+    geoms = group if isinstance(group, list) else [group]
+    flat = []
+    for geom in geoms:
+        flat.extend(geom.geoms if isinstance(geom, MultiPolygon) else [geom])
+    if len(flat) < 2 or parts < 2:
+        return [group]
+
+    costs = shapely.get_num_coordinates(flat)
+    bounds = np.cumsum(costs) * min(parts, len(flat)) / max(costs.sum(), 1)
+    runs = {}
+    for poly, run in zip(flat, np.minimum(bounds.astype(int), parts - 1)):
+        runs.setdefault(int(run), []).append(poly)
+    return [runs[k] for k in sorted(runs)]
+
+
+def plan_splits(costs, workers):
+    """
+    For tasks with the given costs, how many parts each should be split into
+    so that no single task is much longer than a worker's share of the total.
+    """
+    if workers < 2 or not costs:
+        return [1] * len(costs)
+    share = SPLIT_FACTOR * sum(costs) / workers
+    return [max(1, min(workers, int(np.ceil(cost / share)))) if share else 1 for cost in costs]
+
+
+class PartCollector:
+    """
+    Reassembles the results of split tasks. `expected` maps every task key to
+    its number of parts; add() returns (True, merged) once the last part of a
+    key arrives, with `merge` applied to the parts in part order.
+    """
+
+    def __init__(self, expected, merge):
+        self.expected = Counter(expected)
+        self.merge = merge
+        self._parts = {}
+
+    def add(self, key, part, value):
+        if self.expected[key] <= 1:
+            return True, value
+        parts = self._parts.setdefault(key, {})
+        parts[part] = value
+        if len(parts) < self.expected[key]:
+            return False, None
+        del self._parts[key]
+        return True, self.merge([parts[i] for i in sorted(parts)])
+
+
+def merge_polygon_parts(parts):
+    return [poly for polys in parts for poly in polys]
+
+
+def merge_mesh_parts(parts):
+    import trimesh
+
+    meshes = [m for m in parts if m is not None]
+    return trimesh.util.concatenate(meshes) if meshes else None
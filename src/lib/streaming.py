@@ -0,0 +1,295 @@
+import heapq
+import itertools
+import math
+import queue
+import threading
+
+from shapely.geometry import MultiPolygon
+
+from .artifact_cache import polygons_digest
+from .mesh_generator import (
+    UNIT_THICKNESS,
+    default_backend,
+    worker_pool,
+    pool_size,
+    outline_options,
+    prepare_mask_tasks,
+    put_cached_polygons,
+    process_mask,
+    process_generate_layer_mesh,
+    unit_base_mesh,
+    place_unit_mesh,
+)
+from .scheduling import (
+    PartCollector,
+    merge_mesh_parts,
+    merge_polygon_parts,
+    polygons_cost,
+    split_polygons,
+)
+from .tracing import TracedTask, active_trace, collect, maybe_recording, span, traced
+
+# Layers waiting for the writer thread before the coordinator blocks
+WRITE_QUEUE_SIZE = 4
+# Polygon groups are extruded in parts of about this many vertices. The total
+# is not known while streaming, so the batch path's fair-share split does not apply.
+MESH_PART_VERTICES = 50000
+
+
+def _has_solid(group):
+    # same filter generate_layer_mesh() applies before extruding
+    geoms = group if isinstance(group, list) else [group]
+    for geom in geoms:
+        for poly in (geom.geoms if isinstance(geom, MultiPolygon) else [geom]):
+            if poly.is_valid and not poly.is_empty:
+                return True
+    return False
+
+
+@traced
+def stream_export(segmented_image,
+                  shades,
+                  write_cb,
+                  polys_list=None,
+                  layer_height=0.2,
+                  base_layers=4,
+                  target_max_cm=10,
+                  nozzle_mm=None,
+                  progress_cb=None,
+                  cache=None,
+                  polygon_cache=None,
+                  pool=None,
+                  plan=None,
+                  backend=None):
+    """
+    Streaming variant of create_layered_polygons_parallel() followed by
+    polygons_to_meshes_parallel() and writing the result.
+
+    Every finished (filament, level) polygon set is queued for extrusion right
+    away, and every layer whose meshes are complete is handed to a writer
+    thread right away, so polygonization, extrusion and output overlap.
+
+    - polys_list: polygons from create_layered_polygons_parallel() without the
+      base, as nested lists or a LayeredGeometry (whose layers are only turned
+      into Shapely objects as they are queued); when None the masks are
+      polygonized here as part of the stream.
+    - write_cb: write_cb(index, mesh), called from one writer thread in
+      arbitrary order. Index 0 is the base, then layers bottom to top, matching
+      the list returned by polygons_to_meshes_parallel().
+    - nozzle_mm: nozzle width masks polygonized here are simplified for,
+      see outline_options().
+    - cache: optional ArtifactCache for unit meshes, polygon_cache for polygons.
+    - pool: optional shared multiprocessing pool.
+    - plan: optional planner.MemoryPlan; caps the worker count and how many
+      tasks are handed to the pool at once, the rest wait here.
+    - backend: "process" or "thread" for a private pool; default_backend("export") when None.
+
+    A layer is written once every layer above it is extruded (its slabs carry
+    everything above them) and every layer below it is, which fixes its
+    height: as in place_layer_meshes(), a slab whose extrusion failed takes
+    none. Lower layers hold the larger masks and are extruded first, so
+    most layers can go out before the last extrusion ends.
+
+    Returns the number of meshes written.
+    """
+    import trimesh
+
+    w_px, h_px = segmented_image.size
+    scale_xy = (target_max_cm * 10) / max(w_px, h_px)
+    base_height = layer_height * base_layers
+
+    events = queue.Queue()
+    unit = {}       # (layer_key, sub) → unit mesh, None if nothing to extrude
+    solid = set()   # keys whose polygons will produce a mesh
+    digests = {}
+
+    # ---- writer thread: file output never blocks extrusion ----
+    write_queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+    writer_errors = []
+    trace = active_trace()
+
+    def _writer():
+        with maybe_recording(trace):
+            while True:
+                item = write_queue.get()
+                if item is None:
+                    return
+                if writer_errors:
+                    continue
+                try:
+                    with span("write_mesh", index=item[0], triangles=len(item[1].faces)):
+                        write_cb(*item)
+                except Exception as e:
+                    writer_errors.append(e)
+
+    writer = threading.Thread(target=_writer, daemon=True)
+    writer.start()
+
+    written = 0
+    reported = 0.0
+
+    def _report(fraction):
+        nonlocal reported
+        if progress_cb and fraction > reported:
+            reported = fraction
+            progress_cb(fraction)
+
+    try:
+        with worker_pool(pool, processes=plan and plan.processes,
+                         backend=backend or default_backend("export")) as workers:
+            def _on_error(e):
+                events.put(("error", e, True))
+
+            # tasks waiting for a slot: extrusions before masks (they free polygons
+            # and feed the writer), the most vertices first; masks in the
+            # longest-first order prepare_mask_tasks() gives them
+            backlog = []
+            order = itertools.count()
+            inflight = 0
+            max_inflight = plan.max_inflight if plan else None
+            n_workers = pool_size(plan)
+
+            def _pump():
+                nonlocal inflight
+                while backlog and not (max_inflight and inflight >= max_inflight):
+                    *_, func, task, kind = heapq.heappop(backlog)
+                    workers.apply_async(func, (task,),
+                                        callback=lambda r, kind=kind: events.put((kind, r, True)),
+                                        error_callback=_on_error)
+                    inflight += 1
+
+            def _submit(func, task, kind, cost=0):
+                rank = 0 if kind == "mesh" else 1
+                heapq.heappush(backlog, (rank, -cost, next(order), func, task, kind))
+                _pump()
+
+            # ---- stage 1: polygons, either precomputed or polygonized here ----
+            mask_digests = {}
+            if polys_list is None:
+                tasks, ready, mask_digests = prepare_mask_tasks(
+                    segmented_image, shades, polygon_cache, n_workers,
+                    outline_options(segmented_image.size, target_max_cm, nozzle_mm))
+                mask_parts = PartCollector((key for key, *_ in tasks), merge_polygon_parts)
+                for fi, L, polys in ready:
+                    events.put(("polys", ((fi, L, polys), None), False))
+                # worker spans are unpacked by collect() in this thread, where the trace is active
+                traced_mask = TracedTask(process_mask)
+                for task in tasks:
+                    _submit(traced_mask, task, "polys")
+                pending_polys = len(mask_parts.expected) + len(ready)
+            else:
+                pending_polys = 0
+                for idx, polys in enumerate(polys_list):
+                    for idy, group in enumerate(polys):
+                        events.put(("polys", ((idx, idy + 1, group), None), False))
+                        pending_polys += 1
+            total_polys = max(pending_polys, 1)
+
+            pending_meshes = 0
+            layout = None
+            next_layer = -1
+            above = None  # merged unit mesh of everything above the next layer
+            unplaced = {}  # layer → [(key, merged unit mesh)], waiting for the layers below
+            layer_z = {}  # layer → z of its first slab, once every layer below is extruded
+            resolved = 0  # layers from the bottom whose extrusions have all finished
+            z = 0.0
+            traced_mesh = TracedTask(process_generate_layer_mesh)
+            mesh_parts = PartCollector((), merge_mesh_parts)
+
+            while True:
+                # ---- once every polygon set is known, fix the stack layout ----
+                if layout is None and pending_polys == 0:
+                    layer_keys = sorted({key[0] for key in solid})
+                    layout = [sorted(k for k in solid if k[0] == lk) for lk in layer_keys]
+                    if not layout:
+                        break
+                    z = base_height
+                    base = unit_base_mesh(w_px, h_px)
+                    if base:
+                        write_queue.put((0, place_unit_mesh(base, scale_xy, base_height, 0.0)))
+                        written += 1
+                    next_layer = len(layout) - 1
+
+                # ---- stage 3: write every layer whose slabs, all above and all below are done ----
+                if layout is not None:
+                    while next_layer >= 0 and all(key in unit for key in layout[next_layer]):
+                        merged = []
+                        for key in reversed(layout[next_layer]):
+                            m = unit[key]
+                            if m is not None:
+                                above = m if above is None else trimesh.util.concatenate(above, m)
+                                merged.append(above)
+                        unplaced[next_layer] = merged[::-1]
+                        next_layer -= 1
+                    # a failed extrusion takes no height, so a layer's z waits for every layer below it
+                    while resolved < len(layout) and all(key in unit for key in layout[resolved]):
+                        layer_z[resolved] = z
+                        z += layer_height * sum(unit[key] is not None for key in layout[resolved])
+                        resolved += 1
+                    for layer in sorted(unplaced.keys() & layer_z.keys()):
+                        merged = unplaced.pop(layer)
+                        if merged:
+                            placed = [place_unit_mesh(m, scale_xy, layer_height, layer_z[layer] + i * layer_height)
+                                      for i, m in enumerate(merged)]
+                            write_queue.put((layer + 1, trimesh.util.concatenate(placed)))
+                            written += 1
+                    _report(2 / 3 + (1 - (next_layer + 1 + len(unplaced)) / len(layout)) / 3)
+                    if next_layer < 0 and not unplaced:
+                        break
+
+                # ---- stage 2: react to finished polygons and meshes ----
+                kind, payload, from_worker = events.get()
+                if kind == "error":
+                    raise payload
+                if from_worker:
+                    inflight -= 1
+                    _pump()
+                if kind == "polys":
+                    if from_worker:
+                        fi, L, part, polys = collect(payload)
+                        done, group = mask_parts.add((fi, L), part, polys)
+                        if not done:
+                            continue
+                        layer_key = fi
+                    else:
+                        layer_key, L, group = collect(payload)
+                    pending_polys -= 1
+                    if (layer_key, L) in mask_digests:
+                        put_cached_polygons(polygon_cache, mask_digests[(layer_key, L)], group)
+                    key = (layer_key, L - 1)
+                    if _has_solid(group):
+                        solid.add(key)
+                        if cache is not None:
+                            digests[key] = polygons_digest(group, UNIT_THICKNESS)
+                            cached = cache.get(("mesh", digests[key]))
+                            if cached is not None:
+                                unit[key] = cached
+                                continue
+                        cost = polygons_cost(group)
+                        runs = split_polygons(group, min(n_workers, math.ceil(cost / MESH_PART_VERTICES)))
+                        mesh_parts.expected[key] = len(runs)
+                        for part, run in enumerate(runs):
+                            _submit(traced_mesh, (layer_key, L - 1, part, run, UNIT_THICKNESS), "mesh",
+                                    cost / len(runs))
+                        pending_meshes += 1
+                    _report((1 - pending_polys / total_polys) / 3)
+                elif kind == "mesh":
+                    layer_key, sub, part, mesh = collect(payload)
+                    done, mesh = mesh_parts.add((layer_key, sub), part, mesh)
+                    if not done:
+                        continue
+                    pending_meshes -= 1
+                    unit[(layer_key, sub)] = mesh
+                    if cache is not None and mesh is not None:
+                        cache.put(("mesh", digests[(layer_key, sub)]), mesh)
+                    if layout is not None:
+                        _report(1 / 3 + (1 - pending_meshes / max(len(solid), 1)) / 3)
+    finally:
+        write_queue.put(None)
+        writer.join()
+
+    if writer_errors:
+        raise writer_errors[0]
+    if progress_cb:
+        progress_cb(1.0)
+    return written
@@ -0,0 +1,225 @@
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Spans are only recorded while a Trace is active in the current thread (see
+# recording()); everywhere else traced functions cost one attribute lookup.
+_local = threading.local()
+_ids = itertools.count(1)
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes, None where unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Linux reports KiB
+
+
+class Trace:
+    """
+    Finished spans of one run, gathered from the calling threads and from pool
+    workers. Each span is a dict: id, parent, name, ts (epoch seconds), dur
+    (seconds), pid, tid and attrs (counts such as pixels, vertices, triangles,
+    result_bytes and peak_rss).
+    """
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, spans):
+        with self._lock:
+            self.spans.extend(spans)
+
+    def summary(self):
+        """name → {"count", "total", "max"} over all spans, in order of first start."""
+        stages = {}
+        for s in sorted(self.spans, key=lambda s: s["ts"]):
+            entry = stages.setdefault(s["name"], {"count": 0, "total": 0.0, "max": 0.0})
+            entry["count"] += 1
+            entry["total"] += s["dur"]
+            entry["max"] = max(entry["max"], s["dur"])
+        return stages
+
+    def format_summary(self):
+        lines = [f"{'stage':32s} {'calls':>5s} {'total':>9s} {'max':>9s}"]
+        for name, entry in self.summary().items():
+            lines.append(f"{name:32s} {entry['count']:5d} {entry['total']:8.3f}s {entry['max']:8.3f}s")
+        peaks = {s["pid"]: s["attrs"].get("peak_rss") or 0 for s in self.spans}
+        if any(peaks.values()):
+            lines.append(f"peak RSS: {max(peaks.values()) / 2**20:0.0f} MiB over {len(peaks)} process(es)")
+        return "\n".join(lines)
+
+    def to_json(self):
+        return {"spans": sorted(self.spans, key=lambda s: s["ts"])}
+
+    def to_chrome(self):
+        """Chrome trace event format, for chrome://tracing or Perfetto."""
+        events = [{
+            "name": s["name"],
+            "cat": "stage" if s["pid"] == os.getpid() else "task",
+            "ph": "X",
+            "ts": s["ts"] * 1e6,
+            "dur": s["dur"] * 1e6,
+            "pid": s["pid"],
+            "tid": s["tid"],
+            "args": s["attrs"],
+        } for s in self.spans]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save(self, path):
+        """Write the trace as JSON; paths ending in .chrome.json get the Chrome format."""
+        data = self.to_chrome() if path.endswith(".chrome.json") else self.to_json()
+        with open(path, "w") as f:
+            json.dump(data, f)
+
+
+def active_trace():
+    return getattr(_local, "trace", None)
+
+
+@contextmanager
+def recording(trace=None):
+    """Record the spans of this thread into `trace` (a new Trace by default) and yield it."""
+    previous = active_trace()
+    _local.trace = trace if trace is not None else Trace()
+    try:
+        yield _local.trace
+    finally:
+        _local.trace = previous
+
+
+@contextmanager
+def maybe_recording(trace):
+    """recording(trace) when a trace is given, otherwise leave things as they are."""
+    if trace is None:
+        yield None
+    else:
+        with recording(trace):
+            yield trace
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+@contextmanager
+def span(name, parent=None, **attrs):
+    """
+    Time the enclosed block as a span nested under the current one. Yields the
+    attrs dict so the block can add counts; yields a throwaway dict when
+    nothing is being recorded.
+    """
+    trace = active_trace()
+    if trace is None:
+        yield attrs
+        return
+
+    stack = _stack()
+    record = {
+        "id": f"{os.getpid()}:{next(_ids)}",
+        "parent": stack[-1]["id"] if stack else parent,
+        "name": name,
+        "ts": time.time(),
+        "dur": 0.0,
+        "pid": os.getpid(),
+        "tid": threading.get_ident(),
+        "attrs": attrs,
+    }
+    stack.append(record)
+    t0 = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        record["dur"] = time.perf_counter() - t0
+        stack.pop()
+        rss = peak_rss()
+        if rss is not None:
+            attrs["peak_rss"] = rss
+        trace.add([record])
+
+
+def annotate(**attrs):
+    """Add counts to the innermost open span, if any."""
+    stack = getattr(_local, "stack", None)
+    if active_trace() is not None and stack:
+        stack[-1]["attrs"].update(attrs)
+
+
+def traced(func):
+    """Record every call of `func` as a span named after it."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if active_trace() is None:
+            return func(*args, **kwargs)
+        with span(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def _result_bytes(obj):
+    """
+    Bytes of array data and coordinates in a task result, roughly what a
+    process pool sends back for it, counted without pickling it again.
+    """
+    nbytes = getattr(obj, "nbytes", None)
+    if isinstance(nbytes, int):
+        return nbytes
+    if type(obj).__module__.startswith("shapely"):
+        import shapely
+
+        return 16 * int(shapely.get_num_coordinates(obj))  # 2D float64
+    if isinstance(obj, (list, tuple)):
+        return sum(_result_bytes(item) for item in obj)
+    if hasattr(obj, "vertices") and hasattr(obj, "faces"):  # trimesh
+        return _result_bytes(obj.vertices) + _result_bytes(obj.faces)
+    return 0
+
+
+class TracedTask:
+    """
+    Picklable wrapper for pool task functions. In the worker it records the
+    call (and every traced function it reaches) and returns (result, spans);
+    unwrap the result in the parent with collect().
+
+    Create it at submit time: whether to trace is decided then, from the
+    parent's active trace, so untraced runs pay only for the tuple.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.enabled = active_trace() is not None
+        stack = getattr(_local, "stack", None)
+        self.parent = stack[-1]["id"] if stack else None
+
+    def __call__(self, task):
+        if not self.enabled:
+            return self.func(task), None
+        with recording() as trace:
+            with span(self.func.__name__, parent=self.parent) as attrs:
+                result = self.func(task)
+                attrs["result_bytes"] = _result_bytes(result)
+        return result, trace.spans
+
+
+def collect(item):
+    """Unpack a TracedTask result, adding the worker's spans to the active trace."""
+    result, spans = item
+    trace = active_trace()
+    if spans and trace is not None:
+        trace.add(spans)
+    return result
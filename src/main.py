@@ -21,6 +21,8 @@ class Drucken3dApplication(Adw.Application):
         self.create_action('quit', lambda *_: self.quit(), ['<primary>q'])
         self.create_action('about', self.on_about_action)
         self.create_action('preferences', self.on_preferences_action)
+        self.set_accels_for_action('win.open-project', ['<primary>o'])
+        self.set_accels_for_action('win.save-project', ['<primary>s'])
 
         css_provider = Gtk.CssProvider()
         css_provider.load_from_resource("/dev/seelos/drucken3d/style.css")
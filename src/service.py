@@ -0,0 +1,516 @@
+"""
+Local conversion service: a bounded job queue in front of one warm worker pool.
+
+    drucken3d-service --settings palette.json --port 8765
+
+    POST   /jobs[?settings=<url-encoded JSON>]  body: the image file  → 202 {"id": ...}
+    GET    /jobs/<id>                           → status, progress, mesh count
+    GET    /jobs/<id>/result                    → the ZIP, streamed while it is written
+    DELETE /jobs/<id>                           → cancel a queued job or drop a finished one
+    GET    /status                              → queue depth, admitted cost, workers
+
+Settings use the CLI's JSON format; a job without its own uses the ones the
+service was started with. Jobs are admitted by estimated cost (megapixels ×
+shades): when the queue is full, or the queued cost would exceed
+--max-queued-cost, the request is refused with 503 and a Retry-After header;
+an image whose memory plan does not fit the budget even alone gets 413.
+
+Binds to 127.0.0.1 by default. There is no authentication: put it behind
+whatever front end the internal tool already has.
+"""
+import argparse
+import json
+import multiprocessing as mp
+import queue
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlparse
+
+from PIL import Image
+
+from .cli import convert_to_zip, load_settings, parse_settings
+from .lib.artifact_cache import ArtifactCache
+from .lib.disk_cache import DiskCache
+from .lib.ingest import check_pixel_limit, decode_image, open_header, working_max_side, working_size
+from .lib.mask_creation import generate_shades
+from .lib.mesh_generator import BACKENDS, default_backend, make_pool
+from .lib.planner import default_budget, parse_size, plan_memory
+
+MAX_UPLOAD_BYTES = 256 * 2**20
+MAX_FINISHED_JOBS = 64       # finished jobs (and their ZIPs) kept for polling
+RETRY_AFTER_S = 5
+STREAM_CHUNK = 64 * 1024
+READ_CHUNK = 1024 * 1024     # result bytes read from the spill file per lock hold
+
+
+class AdmissionError(Exception):
+    def __init__(self, status, message, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class StreamBuffer:
+    """
+    Write-only file for zipfile that readers can follow while it grows.
+    Without tell()/seek() zipfile writes in streaming mode. The bytes go to
+    a temporary file, so finished results wait on disk, not in memory, until
+    discard() drops them.
+    """
+
+    def __init__(self):
+        self._file = tempfile.TemporaryFile(prefix="drucken3d-job-", suffix=".zip")
+        self._size = 0
+        self._closed = False
+        self._failed = False
+        self._cond = threading.Condition()
+
+    def write(self, data):
+        data = bytes(data)
+        with self._cond:
+            if self._file is None:
+                raise IOError("result was discarded")
+            self._file.seek(self._size)
+            self._file.write(data)
+            self._size += len(data)
+            self._cond.notify_all()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self, failed=False):
+        with self._cond:
+            self._closed = True
+            self._failed = failed
+            self._cond.notify_all()
+
+    def discard(self):
+        """Delete the bytes; readers still following get an IOError."""
+        with self._cond:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._closed = True
+            self._failed = True
+            self._cond.notify_all()
+
+    def follow(self):
+        """Yield chunks as they are written; raises IOError if the writer failed."""
+        offset = 0
+        while True:
+            with self._cond:
+                while offset == self._size and not self._closed:
+                    self._cond.wait()
+                if self._file is None:
+                    raise IOError("result was discarded")
+                self._file.seek(offset)
+                chunk = self._file.read(min(self._size - offset, READ_CHUNK))
+                offset += len(chunk)
+                done, failed = self._closed and offset == self._size, self._failed
+            if chunk:
+                yield chunk
+            if done:
+                if failed:
+                    raise IOError("job failed while writing its result")
+                return
+
+
+class Job:
+    def __init__(self, image_bytes, settings, shades, plan, cost):
+        self.id = uuid.uuid4().hex[:12]
+        self.image_bytes = image_bytes
+        self.settings = settings
+        self.shades = shades
+        self.plan = plan
+        self.cost = cost
+        self.status = "queued"
+        self.progress = 0.0
+        self.meshes = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.output = StreamBuffer()
+
+    def describe(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "progress": round(self.progress, 3),
+            "cost": round(self.cost, 2),
+            "meshes": self.meshes,
+            "error": self.error,
+            "created": self.created,
+            "finished": self.finished,
+        }
+
+
+class ConversionService:
+    """
+    Owns the job table, the bounded queue and the shared worker pool. `jobs`
+    runner threads take jobs off the queue; their polygon and mesh tasks all
+    land in the same pool, which stays warm between jobs.
+    """
+
+    def __init__(self, default_settings=None, workers=None, jobs=2, backend="process",
+                 max_queue=32, max_queued_cost=500.0, budget=None, caches=None):
+        self.default_settings = default_settings
+        self.workers = workers or mp.cpu_count()
+        self.jobs = jobs
+        self.backend = backend
+        self.max_queue = max_queue
+        self.max_queued_cost = max_queued_cost
+        self.budget = budget or default_budget()
+        self.caches = caches or {}
+        self.pool = None
+
+        self._queue = queue.Queue()
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._queued_cost = 0.0
+        self._threads = []
+
+    def start(self):
+        self.pool = make_pool(self.workers, self.backend)
+        for i in range(self.jobs):
+            thread = threading.Thread(target=self._run, name=f"job-runner-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        with self._lock:
+            for job in self._jobs.values():
+                if job.status == "queued":
+                    job.status = "cancelled"
+                    job.output.close(failed=True)
+                    self._release(job)
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+    # ---- admission ----
+
+    def submit(self, image_bytes, raw_settings=None):
+        if raw_settings is not None:
+            try:
+                settings = parse_settings(raw_settings)
+            except (ValueError, KeyError, TypeError) as e:
+                raise AdmissionError(400, f"invalid settings: {e}")
+        elif self.default_settings is not None:
+            settings = self.default_settings
+        else:
+            raise AdmissionError(400, "no settings given and the service has no default")
+
+        try:
+            with open_header(BytesIO(image_bytes)) as image:
+                # header only, nothing is decoded yet
+                source_size = image.size
+        except OSError as e:
+            raise AdmissionError(415, f"unreadable image: {e}")
+        try:
+            # uploads are decoded whole, so Pillow's limit applies to them
+            check_pixel_limit(source_size)
+        except Image.DecompressionBombError as e:
+            raise AdmissionError(413, str(e))
+        size = working_size(source_size, working_max_side(settings["max_size_cm"]))
+
+        shades = generate_shades(settings["colors"], settings["cover_factors"])
+        n_shades = sum(len(s) for s in shades)
+        plan = plan_memory(size, n_shades, budget=self.budget, max_processes=self.workers,
+                           concurrent_images=self.jobs, backend=self.backend, source_size=source_size)
+        if not plan.fits:
+            raise AdmissionError(413, "image too large for the memory budget:\n" + plan.describe())
+        cost = size[0] * size[1] * n_shades / 1e6
+
+        job = Job(image_bytes, settings, shades, plan, cost)
+        with self._lock:
+            # an empty queue always takes a job, however expensive
+            if self._queued >= self.max_queue or (
+                    self._queued and self._queued_cost + cost > self.max_queued_cost):
+                raise AdmissionError(503, "queue full, try again later", RETRY_AFTER_S)
+            self._queued += 1
+            self._queued_cost += cost
+            self._jobs[job.id] = job
+            self._prune()
+        self._queue.put(job)
+        return job
+
+    def _prune(self):
+        # caller holds the lock; forget the oldest finished jobs
+        finished = [j for j in self._jobs.values() if j.status in ("done", "failed", "cancelled")]
+        for job in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            job.output.discard()
+            del self._jobs[job.id]
+
+    # ---- jobs ----
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        Cancel a queued job or drop a finished one and its result. Returns
+        True when done, False for running jobs and None for unknown ones.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status == "running":
+                return False
+            if job.status == "queued":
+                job.status = "cancelled"
+                self._release(job)
+            job.output.discard()
+            del self._jobs[job_id]
+            return True
+
+    def _release(self, job):
+        # caller holds the lock
+        self._queued -= 1
+        self._queued_cost -= job.cost
+
+    def status(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return {
+                "queued": self._queued,
+                "queued_cost": round(self._queued_cost, 2),
+                "max_queue": self.max_queue,
+                "max_queued_cost": self.max_queued_cost,
+                "workers": self.workers,
+                "backend": self.backend,
+                "jobs": counts,
+            }
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            with self._lock:
+                if job.status == "cancelled":
+                    continue
+                job.status = "running"
+                self._release(job)
+
+            def _progress(fraction, job=job):
+                with self._lock:
+                    job.progress = fraction
+
+            try:
+                image = decode_image(BytesIO(job.image_bytes), working_max_side(job.settings["max_size_cm"]))
+                try:
+                    meshes = convert_to_zip(image, job.settings, job.shades, job.output, self.pool,
+                                            self.caches, job.plan, progress_cb=_progress)
+                finally:
+                    image.close()
+                with self._lock:
+                    job.meshes = meshes
+                    job.status = "done"
+                    job.progress = 1.0
+                job.output.close()
+            except Exception as e:
+                with self._lock:
+                    job.status = "failed"
+                    job.error = str(e)
+                job.output.close(failed=True)
+                print(f"Job {job.id} failed: {e}")
+            finally:
+                with self._lock:
+                    job.image_bytes = None
+                    job.finished = time.time()
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # needed for chunked result streaming
+    server_version = "drucken3d-service"
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status, message, headers=None):
+        self._send_json(status, {"error": message}, headers)
+
+    def _path_parts(self):
+        return [p for p in urlparse(self.path).path.split("/") if p]
+
+    def do_POST(self):
+        parts = self._path_parts()
+        if parts != ["jobs"]:
+            return self._error(404, "not found")
+
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0:
+            return self._error(411, "the image must be sent as the request body with a Content-Length")
+        if length > MAX_UPLOAD_BYTES:
+            self.close_connection = True
+            return self._error(413, f"uploads are limited to {MAX_UPLOAD_BYTES // 2**20} MiB")
+        image_bytes = self.rfile.read(length)
+
+        raw_settings = None
+        query = parse_qs(urlparse(self.path).query)
+        if "settings" in query:
+            try:
+                raw_settings = json.loads(query["settings"][0])
+            except ValueError as e:
+                return self._error(400, f"settings are not valid JSON: {e}")
+
+        try:
+            job = self.service.submit(image_bytes, raw_settings)
+        except AdmissionError as e:
+            headers = {"Retry-After": str(e.retry_after)} if e.retry_after else None
+            return self._error(e.status, str(e), headers)
+        self._send_json(202, job.describe(), {"Location": f"/jobs/{job.id}"})
+
+    def do_GET(self):
+        parts = self._path_parts()
+        if parts == ["status"]:
+            return self._send_json(200, self.service.status())
+        if len(parts) in (2, 3) and parts[0] == "jobs":
+            job = self.service.get(parts[1])
+            if job is None:
+                return self._error(404, "no such job")
+            if len(parts) == 2:
+                return self._send_json(200, job.describe())
+            if parts[2] == "result":
+                return self._stream_result(job)
+        self._error(404, "not found")
+
+    def do_DELETE(self):
+        parts = self._path_parts()
+        if len(parts) != 2 or parts[0] != "jobs":
+            return self._error(404, "not found")
+        cancelled = self.service.cancel(parts[1])
+        if cancelled is None:
+            return self._error(404, "no such job")
+        if not cancelled:
+            return self._error(409, "job is running and cannot be cancelled")
+        self._send_json(200, {"id": parts[1], "deleted": True})
+
+    def _stream_result(self, job):
+        if job.status in ("failed", "cancelled"):
+            return self._error(410, job.error or f"job {job.status}")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Disposition", f'attachment; filename="{job.id}.zip"')
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            pending = b""
+            for chunk in job.output.follow():
+                pending += chunk
+                if len(pending) >= STREAM_CHUNK:
+                    self._write_chunk(pending)
+                    pending = b""
+            if pending:
+                self._write_chunk(pending)
+            self.wfile.write(b"0\r\n\r\n")
+        except IOError:
+            # no terminating chunk: the client sees a truncated transfer
+            self.close_connection = True
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        print(f"{self.address_string()} {format % args}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="drucken3d-service",
+        description="Serve image → STL conversions over local HTTP with a shared worker pool.",
+    )
+    parser.add_argument("-s", "--settings", help="default JSON palette/settings for jobs without their own")
+    parser.add_argument("--host", default="127.0.0.1", help="address to bind (default: 127.0.0.1)")
+    parser.add_argument("-p", "--port", type=int, default=8765, help="port to bind, 0 picks a free one")
+    parser.add_argument("-w", "--workers", type=int, default=mp.cpu_count(),
+                        help="workers in the shared pool (default: CPU count)")
+    parser.add_argument("-j", "--jobs", type=int, default=2, help="jobs converted at once (default: 2)")
+    parser.add_argument("--backend", choices=BACKENDS, default=None,
+                        help="worker pool type (default: $DRUCKEN3D_BACKEND, else process)")
+    parser.add_argument("--queue-size", type=int, default=32, help="jobs waiting at most (default: 32)")
+    parser.add_argument("--max-queued-cost", type=float, default=500.0,
+                        help="admitted work waiting at most, in megapixels × shades (default: 500)")
+    parser.add_argument("--memory-budget", metavar="SIZE", type=parse_size,
+                        help="memory to plan jobs for, e.g. 8G (default: as for drucken3d-cli)")
+    parser.add_argument("--cache", action="store_true",
+                        help="reuse label maps, polygons and meshes from the on-disk cache")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    settings = None
+    if args.settings:
+        try:
+            settings = load_settings(args.settings)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"drucken3d-service: cannot read settings: {e}", file=sys.stderr)
+            return 2
+    try:
+        backend = args.backend or default_backend("export")
+    except ValueError as e:
+        print(f"drucken3d-service: {e}", file=sys.stderr)
+        return 2
+
+    caches = {}
+    if args.cache:
+        disk = DiskCache()
+        caches = {
+            "labels": ArtifactCache(max_entries=4, backing=disk),
+            "polygons": ArtifactCache(backing=disk),
+            "meshes": ArtifactCache(max_entries=256, backing=disk),
+        }
+
+    service = ConversionService(settings, workers=max(1, args.workers), jobs=max(1, args.jobs),
+                                backend=backend, max_queue=max(1, args.queue_size),
+                                max_queued_cost=args.max_queued_cost, budget=args.memory_budget,
+                                caches=caches)
+    service.start()
+
+    httpd = ThreadingHTTPServer((args.host, args.port), ServiceHandler)
+    httpd.daemon_threads = True
+    httpd.service = service
+    host, port = httpd.server_address[:2]
+    print(f"Serving on http://{host}:{port}/ with {service.workers} {backend} worker(s)")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        service.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
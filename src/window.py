@@ -1,4 +1,8 @@
+import functools
+import os
 import threading
+import zipfile
+from collections import OrderedDict
 
 import gi
 
@@ -10,8 +14,64 @@ from gi.repository import Gtk, Gio, Gdk, GObject, GLib, Adw, GdkPixbuf
 from gettext import gettext as _
 from PIL import Image
 import numpy as np
-from .lib.mask_creation import generate_shades, segment_to_shades
-from .lib.mesh_generator import create_layered_polygons_parallel, render_polygons_to_pixbuf, polygons_to_meshes_parallel
+from .lib import kernels
+from .lib.artifact_cache import ArtifactCache, image_digest
+from .lib.contours import default_contour_source
+from .lib.disk_cache import DiskCache
+from .lib.mask_creation import generate_shades, image_to_labels, segment_to_shades
+from .lib.mesh_generator import (
+    STAGES,
+    create_layered_polygons_parallel,
+    default_backend,
+    outline_options,
+    render_polygons_to_pixbuf,
+)
+from .lib.geometry import LayeredGeometry
+from .lib.ingest import PREVIEW_MAX_SIDE, SourceImage, decode_image, working_max_side
+from .lib.palette import PaletteSample, score_candidates, suggest_palettes
+from .lib.planner import plan_memory
+from .lib.project import PROJECT_EXTENSION, Project, load_project, save_project
+from .lib.streaming import stream_export
+from .lib.tracing import Trace, maybe_recording
+
+# Live redraw: wait this long after the last edit before recomputing
+LIVE_REDRAW_DELAY_MS = 400
+# Number of recent results kept per pipeline stage
+STAGE_CACHE_SIZE = 8
+
+def _settings_error():
+    """
+    The first malformed DRUCKEN3D_* environment setting as a message, or None.
+    They are read in the worker threads, where an error would leave a redraw
+    or export hanging, so the window checks them once up front.
+    """
+    try:
+        for stage in STAGES:
+            default_backend(stage)
+        default_contour_source()
+        kernels.enabled()
+    except ValueError as e:
+        return str(e)
+    return None
+
+
+def _pixbuf_to_array(pixbuf):
+    """H×W×C uint8 copy of a Pixbuf's pixels, without the row padding."""
+    w, h, n = pixbuf.get_width(), pixbuf.get_height(), pixbuf.get_n_channels()
+    data = np.frombuffer(pixbuf.read_pixel_bytes().get_data(), dtype=np.uint8)
+    rows = np.lib.stride_tricks.as_strided(data, (h, w * n), (pixbuf.get_rowstride(), 1))
+    return rows.reshape(h, w, n).copy()
+
+
+def _array_to_pixbuf(array):
+    h, w, n = array.shape
+    return GdkPixbuf.Pixbuf.new_from_bytes(GLib.Bytes.new(np.ascontiguousarray(array).tobytes()),
+                                           GdkPixbuf.Colorspace.RGB, n == 4, 8, w, h, w * n)
+
+
+def _rgba_to_hex(rgba):
+    return "#{:02x}{:02x}{:02x}".format(*(int(round(c * 255)) for c in (rgba.red, rgba.green, rgba.blue)))
+
 
 class ColorObject(GObject.Object):
     rgba = GObject.Property(type=Gdk.RGBA)
@@ -30,6 +90,7 @@ class Drucken3dWindow(Adw.ApplicationWindow):
     filament_list: Gtk.ListView = Gtk.Template.Child("filament_list")
     add_filament_button: Gtk.Button = Gtk.Template.Child("add_filament_button")
     remove_filament_button: Gtk.Button = Gtk.Template.Child("remove_filament_button")
+    suggest_palette_button: Gtk.Button = Gtk.Template.Child("suggest_palette_button")
     redraw_button: Gtk.Button = Gtk.Template.Child("redraw_button")
     export_button: Gtk.Button = Gtk.Template.Child("export_button")
     load_image_button: Gtk.Button = Gtk.Template.Child("load_image_button")
@@ -40,8 +101,13 @@ class Drucken3dWindow(Adw.ApplicationWindow):
     layer_height_spin: Gtk.SpinButton = Gtk.Template.Child("layer_height_spin")
     base_layers_spin: Gtk.SpinButton = Gtk.Template.Child("base_layers_spin")
     max_size_spin: Gtk.SpinButton = Gtk.Template.Child("max_size_spin")
+    nozzle_width_spin: Gtk.SpinButton = Gtk.Template.Child("nozzle_width_spin")
     redraw_banner = Gtk.Template.Child("redraw_banner")
     progress = Gtk.Template.Child("progress")
+    live_redraw_switch = Gtk.Template.Child("live_redraw_switch")
+    stage_timings_switch = Gtk.Template.Child("stage_timings_switch")
+    timings_label = Gtk.Template.Child("timings_label")
+    workers_spin = Gtk.Template.Child("workers_spin")
 
 
     def __init__(self, **kwargs):
@@ -57,7 +123,9 @@ class Drucken3dWindow(Adw.ApplicationWindow):
         self.filament_list.set_factory(factory)
 
         self._edit_index = -1
-        self._image: Image.Image = None
+        self._image: SourceImage = None
+        # what self._image is decoded from: a file path or the opened Project
+        self._image_source = None
 
         # refresh the list
         self._refresh_list()
@@ -66,16 +134,93 @@ class Drucken3dWindow(Adw.ApplicationWindow):
         self.segmented_image = None
         self.shades = None
         self.polygons = []
+        self._plan = None
+        self._preview_pixbuf = None
+        # an opened .stratum project; its label map and polygons are only read when needed
+        self._project = None
+        # (print size, nozzle width) the current polygons were simplified for; None without any
+        self._result_scale = None
+        self._print_scale_handlers = [spin.connect("notify::value", self._on_print_scale_changed)
+                                      for spin in (self.max_size_spin, self.nozzle_width_spin)]
+
+        for name, callback in (("open-project", self.on_open_project), ("save-project", self.on_save_project)):
+            action = Gio.SimpleAction.new(name, None)
+            action.connect("activate", callback)
+            self.add_action(action)
+
+        # live redraw state: pending debounce source and the id of the newest run
+        self._live_redraw_source = 0
+        self._redraw_generation = 0
+        self._stage_cache = OrderedDict()
+        self._stage_cache_lock = threading.Lock()
+        # label maps, per-mask polygons and meshes persist on disk across sessions
+        try:
+            self._disk_cache = DiskCache()
+        except OSError as e:
+            print(f"Disk cache unavailable: {e}")
+            self._disk_cache = None
+        self._label_cache = ArtifactCache(max_entries=4, backing=self._disk_cache)
+        self._polygon_cache = ArtifactCache(backing=self._disk_cache)
+        self._mesh_cache = ArtifactCache(max_entries=256, backing=self._disk_cache)
+
+        self._settings_error = _settings_error()
+        if self._settings_error is not None:
+            GLib.idle_add(self._show_error, f"Redraw and export are disabled: {self._settings_error}")
 
     def _on_filament_change(self, reason=None):
         if self._image is None:
             self.redraw_banner.set_revealed(False)
             return
+        if (self.live_redraw_switch.get_active() and self._store.get_n_items() >= 2
+                and self._settings_error is None):
+            self._schedule_live_redraw()
+            return
         self.redraw_banner.set_revealed(True)
         if reason is not None:
             self.redraw_banner.set_title(reason)
         else: self.redraw_banner.set_title("Filament list changed. Redraw required.")
 
+    def _print_scale(self):
+        return self.max_size_spin.get_value(), self.nozzle_width_spin.get_value()
+
+    def _on_print_scale_changed(self, *_):
+        if self._result_scale is not None and self._result_scale != self._print_scale():
+            # outlines were simplified for the old size and nozzle; an export needs new ones
+            self.segmented_image = None
+            self.polygons = []
+            self._result_scale = None
+            self.export_button.set_sensitive(False)
+        self._on_filament_change("Print size changed. Redraw required.")
+
+    def _schedule_live_redraw(self):
+        # restart the timer on every edit so a burst collapses into one redraw
+        if self._live_redraw_source:
+            GLib.source_remove(self._live_redraw_source)
+        self._live_redraw_source = GLib.timeout_add(LIVE_REDRAW_DELAY_MS, self._on_live_redraw_timeout)
+
+    def _on_live_redraw_timeout(self):
+        self._live_redraw_source = 0
+        self.on_redraw_clicked()
+        return False
+
+    def _cached_stage(self, stage, key, compute, is_stale=None):
+        """
+        Return the cached result of `stage` for `key`, computing it on a miss.
+        A result is not kept when `is_stale()` says its run was superseded.
+        """
+        with self._stage_cache_lock:
+            if (stage, key) in self._stage_cache:
+                self._stage_cache.move_to_end((stage, key))
+                print(f"Reusing cached {stage}")
+                return self._stage_cache[(stage, key)]
+        result = compute()
+        if result is not None and not (is_stale and is_stale()):
+            with self._stage_cache_lock:
+                self._stage_cache[(stage, key)] = result
+                while len(self._stage_cache) > STAGE_CACHE_SIZE * 3:
+                    self._stage_cache.popitem(last=False)
+        return result
+
     def _on_setup_item(self, _factory, list_item):
         row = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
 
@@ -208,6 +353,82 @@ class Drucken3dWindow(Adw.ApplicationWindow):
             self._refresh_list()
             self._on_filament_change()
 
+    @Gtk.Template.Callback()
+    def on_suggest_palette_clicked(self, *_):
+        if not self._image or self._store.get_n_items() < 2:
+            print("Need at least 2 filaments and a loaded image to suggest a palette.")
+            return
+        # base first, as generate_shades() and the suggestions order them
+        items = [self._store.get_item(i) for i in range(self._store.get_n_items() - 1, -1, -1)]
+        self.suggest_palette_button.set_sensitive(False)
+        thread = threading.Thread(
+            target=self._background_suggest_palette,
+            args=(self._image, items, self._filament_colors()),
+            daemon=True
+        )
+        thread.start()
+
+    def _background_suggest_palette(self, image, items, filaments):
+        colors, cover_factors = filaments
+        try:
+            # keyed by content: a sweep that outlives its image must not leave its sample to the next one
+            sample = self._cached_stage("palette-sample", image_digest(image), lambda: PaletteSample(image))
+            suggestions = suggest_palettes(sample, colors)
+            current = score_candidates(sample, colors, np.arange(len(colors))[None],
+                                       np.array([[1.0] + cover_factors[1:]]))
+        except Exception as e:
+            GLib.idle_add(self.suggest_palette_button.set_sensitive, True)
+            GLib.idle_add(self._show_error, f"Could not suggest a palette: {e}")
+            return
+        GLib.idle_add(self._show_palette_suggestions, items, suggestions, current["score"][0].item())
+
+    def _show_palette_suggestions(self, items, suggestions, current_score):
+        self.suggest_palette_button.set_sensitive(True)
+        dlg = Gtk.Dialog(transient_for=self, modal=True, use_header_bar=True)
+        dlg.set_title("Palette Suggestions")
+        box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=12)
+        for side in ("top", "bottom", "start", "end"):
+            getattr(box, f"set_margin_{side}")(18)
+        box.append(Gtk.Label(label=f"Current palette scores {current_score:.1f} (lower is better)", xalign=0))
+
+        listbox = Gtk.ListBox(selection_mode=Gtk.SelectionMode.NONE)
+        listbox.add_css_class("boxed-list")
+        for suggestion in suggestions:
+            row = Gtk.Box(spacing=12)
+            for side in ("top", "bottom", "start", "end"):
+                getattr(row, f"set_margin_{side}")(6)
+            # swatches top to bottom, like the filament list
+            swatches = " ".join(
+                f'<span foreground="{_rgba_to_hex(items[i].rgba)}">\u25a0</span>'
+                + (f" {cf:g}" if position else "")
+                for position, (i, cf) in reversed(list(enumerate(zip(suggestion["order"],
+                                                                     suggestion["cover_factors"])))))
+            label = Gtk.Label(xalign=0, hexpand=True)
+            label.set_markup(f"{swatches}\n<small>score {suggestion['score']:.1f} · "
+                             f"ΔE {suggestion['delta_e']:.1f} · {suggestion['layers']} blend layers · "
+                             f"outlines on {suggestion['edges']:.1%} of pixel edges</small>")
+            row.append(label)
+            apply = Gtk.Button(label="Apply", valign=Gtk.Align.CENTER)
+            apply.connect("clicked", lambda _b, s=suggestion: (self._apply_palette(items, s), dlg.destroy()))
+            row.append(apply)
+            listbox.append(row)
+        box.append(listbox)
+        dlg.get_content_area().append(box)
+        dlg.show()
+        return False
+
+    def _apply_palette(self, items, suggestion):
+        """Reorder the filament list (and set cover factors) as a suggest_palettes() entry says."""
+        new = []
+        for position, (i, cover_factor) in enumerate(zip(suggestion["order"], suggestion["cover_factors"])):
+            # the base keeps its own cover factor, generate_shades() does not use it
+            new.append(ColorObject(items[i].rgba, cover_factor if position else items[i].cover_factor))
+        self._store.remove_all()
+        for item in reversed(new):
+            self._store.append(item)
+        self._refresh_list()
+        self._on_filament_change("Palette suggestion applied. Redraw required.")
+
     @Gtk.Template.Callback()
     def on_filament_row_activate(self, _view, position):
         self._edit_index = position
@@ -255,36 +476,117 @@ class Drucken3dWindow(Adw.ApplicationWindow):
             if response == Gtk.ResponseType.ACCEPT:
                 file = dialog.get_file()
                 if file:
-                    filename = file.get_path()
-                    self._image = Image.open(filename)
-                    print(f"Loaded image: {filename}, size: {self._image.size}")
-                    self.mesh_view_container.set_from_file(filename)
-                    # switch back to image page
-                    self.main_content_stack.set_visible_child_name("image")
-                    self._on_filament_change("Input image loaded. Redraw required.")
+                    self._start_load_image(file.get_path())
             dialog.destroy()
 
         dialog.connect("response", response_handler)
         dialog.show()
 
+    def _start_load_image(self, filename):
+        self.main_content_stack.set_visible_child_name("loader")
+        self.loader_spinner.start()
+        # decoded once, at no more pixels than the print size can use
+        max_side = working_max_side(self.max_size_spin.get_value())
+        thread = threading.Thread(
+            target=self._background_load_image,
+            args=(filename, max_side, filename, self._finish_load_image),
+            daemon=True
+        )
+        thread.start()
+
+    def _background_load_image(self, source, max_side, name, finish):
+        # decodes off GTK’s thread, then hands (name, image) to `finish` in it
+        try:
+            image = decode_image(source, max_side)
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            GLib.idle_add(self._show_load_error, f"Could not load {name}: {e}")
+            return
+        GLib.idle_add(finish, name, image)
+
+    def _show_load_error(self, text):
+        self.loader_spinner.stop()
+        self.main_content_stack.set_visible_child_name("image")
+        return self._show_error(text)
+
+    def _finish_load_image(self, filename, image):
+        # runs in GTK’s thread; anything still running belongs to the previous image
+        self._redraw_generation += 1
+        self.redraw_button.set_sensitive(True)
+        self.progress.set_visible(False)
+        if self._project is not None:
+            self._project.close()
+            self._project = None
+        self._image = image
+        self._image_source = filename
+        self._clear_image_caches()
+        reduced = f", working size {image.size}" if image.reduced else ""
+        print(f"Loaded image: {filename}, size: {image.original_size}{reduced}")
+        self.mesh_view_container.set_from_pixbuf(_array_to_pixbuf(image.preview()))
+        self.loader_spinner.stop()
+        # switch back to image page
+        self.main_content_stack.set_visible_child_name("image")
+        self._on_filament_change("Input image loaded. Redraw required.")
+        return False
+
+    def _clear_image_caches(self):
+        with self._stage_cache_lock:
+            self._stage_cache.clear()
+        self._polygon_cache.clear()
+
+    def _decode_source(self, max_side):
+        """Decode the current image file or the opened project's source for `max_side`."""
+        source = self._image_source
+        return decode_image(source.open_source() if isinstance(source, Project) else source, max_side)
+
 
     @Gtk.Template.Callback()
     def on_redraw_clicked(self, *_):
         if not self._image or self._store.get_n_items() < 2:
             print("Need at least 2 filaments and a loaded image to redraw.")
             return
+        if self._settings_error is not None:
+            self._show_error(f"Cannot redraw: {self._settings_error}")
+            return
+
+        if self._live_redraw_source:
+            GLib.source_remove(self._live_redraw_source)
+            self._live_redraw_source = 0
+
+        # any run still in flight is now stale and will drop its result
+        self._redraw_generation += 1
+        generation = self._redraw_generation
 
         self.redraw_banner.set_revealed(False)
         self.progress.set_fraction(0.05)
         self.progress.set_visible(True)
 
-        # ➊ switch to loader page & start spinner
-        self.main_content_stack.set_visible_child_name("loader")
-        self.loader_spinner.start()
+        # ➊ switch to loader page & start spinner, unless live mode keeps the old preview up
+        if not (self.live_redraw_switch.get_active() and self.polygons):
+            self.main_content_stack.set_visible_child_name("loader")
+            self.loader_spinner.start()
         self.export_button.set_sensitive(False)
+        # live edits still supersede the run; a second click would only repeat it
         self.redraw_button.set_sensitive(False)
 
-        # gather colors (unchanged)…
+        colors, cover_factors = self._filament_colors()
+        print (f"Colors: {colors}")
+
+        # spans are only recorded when the breakdown is shown
+        trace = Trace() if self.stage_timings_switch.get_active() else None
+        max_workers = int(self.workers_spin.get_value()) or None
+        max_side = working_max_side(self.max_size_spin.get_value())
+        print_scale = self._print_scale()
+
+        # kick off background thread
+        thread = threading.Thread(
+            target=self._background_redraw,
+            args=(colors, cover_factors, generation, max_side, print_scale, trace, max_workers),
+            daemon=True
+        )
+        thread.start()
+
+    def _filament_colors(self):
+        """Filament colours and cover factors from base to top, as generate_shades() takes them."""
         colors = []
         cover_factors = []
         for i in range(self._store.get_n_items() - 1, -1, -1):
@@ -296,30 +598,96 @@ class Drucken3dWindow(Adw.ApplicationWindow):
             ))
             cover_factors.append(self._store.get_item(i).cover_factor)
             print (f"Color {i}: {colors[-1]}, cover factor: {cover_factors[-1]}")
+        return colors, cover_factors
+
+    def _background_redraw(self, colors, cover_factors, generation, max_side, print_scale, trace=None,
+                           max_workers=None):
+        try:
+            with maybe_recording(trace):
+                result = self._run_redraw(colors, cover_factors, generation, max_side, print_scale, max_workers)
+        except Exception as e:
+            print(f"Redraw failed: {e}")
+            GLib.idle_add(self._fail_redraw, generation, f"Redraw failed: {e}")
+            return
+        if result is not None:
+            # schedule back on main loop
+            GLib.idle_add(self._finish_redraw, generation, print_scale, *result, trace)
 
-        print (f"Colors: {colors}")
-
-        # kick off background thread
-        thread = threading.Thread(
-            target=self._background_redraw,
-            args=(colors,cover_factors),
-            daemon=True
-        )
-        thread.start()
-
-    def _background_redraw(self, colors, cover_factors):
+    def _run_redraw(self, colors, cover_factors, generation, max_side, print_scale, max_workers=None):
         print (f"Cover factors: {cover_factors}")
-        # heavy work off the UI thread
-        self.shades = generate_shades(colors, cover_factors)
-        self.segmented_image = segment_to_shades(self._image, self.shades)
-        self.polygons = create_layered_polygons_parallel(self.segmented_image, self.shades, progress_cb=self.progress.set_fraction)
-        pixbuf = render_polygons_to_pixbuf(self.polygons, self.shades, self.segmented_image.size, progress_cb=self.progress.set_fraction)
-
-        # schedule back on main loop
-        GLib.idle_add(self._finish_redraw, pixbuf)
+        image = self._image
+
+        def is_stale():
+            return generation != self._redraw_generation
+
+        def report(fraction):
+            if not is_stale():
+                GLib.idle_add(self.progress.set_fraction, fraction)
+
+        if not (isinstance(image, SourceImage) and image.matches(max_side)):
+            # the print size changed, or an opened project's source was never decoded
+            decoded = self._decode_source(max_side)
+            if self._image is image:
+                self._image = decoded
+                self._clear_image_caches()
+            image = decoded
+            if is_stale():
+                return
+
+        # heavy work off the UI thread; every stage is keyed by its own inputs so
+        # an edit that leaves e.g. the shades unchanged skips everything below it.
+        # Stages of the picture are keyed by its content, so a run that outlives
+        # its image cannot hand its results to the next one.
+        image_key = image_digest(image)
+        shades = self._cached_stage(
+            "shades", (tuple(colors), tuple(cover_factors)),
+            lambda: generate_shades(colors, cover_factors),
+        )
+        shades_key = tuple(tuple(s) for s in shades)
+        if is_stale():
+            return
+        # size segmentation chunks and workers to the memory budget before anything big is allocated
+        all_threads = all(default_backend(stage) == "thread" for stage in STAGES)
+        plan = plan_memory(image.size, sum(len(s) for s in shades), max_processes=max_workers,
+                           backend="thread" if all_threads else "process")
+        print(plan.describe())
+        segmented_image = self._cached_stage(
+            "segmentation", (image_key, shades_key),
+            lambda: segment_to_shades(image, shades, cache=self._label_cache, chunk_rows=plan.chunk_rows),
+            is_stale,
+        )
+        if is_stale():
+            return
+        # simplified for the print, so the export can use these polygons as they are
+        outline = outline_options(segmented_image.size, *print_scale)
+
+        def polygonize():
+            layered = create_layered_polygons_parallel(segmented_image, shades, progress_cb=report,
+                                                       is_cancelled=is_stale, cache=self._polygon_cache,
+                                                       plan=plan, outline=outline)
+            # kept for the session in columns; layers become Shapely objects only while exported
+            return LayeredGeometry.from_polygons(layered) if layered is not None else None
+
+        polygons = self._cached_stage("polygons", (image_key, shades_key, tuple(outline.items())), polygonize,
+                                      is_stale)
+        if polygons is None or is_stale():
+            return
+        pixbuf = render_polygons_to_pixbuf(polygons, shades, segmented_image.size, progress_cb=report,
+                                           is_cancelled=is_stale)
+        if pixbuf is None:
+            return
+        return shades, segmented_image, polygons, pixbuf, plan
 
-    def _finish_redraw(self, pixbuf):
+    def _finish_redraw(self, generation, print_scale, shades, segmented_image, polygons, pixbuf, plan, trace=None):
         # runs in GTK’s thread
+        if generation != self._redraw_generation:
+            return False  # a newer redraw superseded this one
+        self.shades = shades
+        self.segmented_image = segmented_image
+        self.polygons = polygons
+        self._result_scale = print_scale
+        self._plan = plan
+        self._preview_pixbuf = pixbuf
         self.mesh_view_container.set_from_pixbuf(pixbuf)
         self.loader_spinner.stop()
         # switch back to image page
@@ -327,11 +695,31 @@ class Drucken3dWindow(Adw.ApplicationWindow):
         self.export_button.set_sensitive(True)
         self.redraw_button.set_sensitive(True)
         self.progress.set_visible(False)
+        # the memory plan is shown with the stage timings, and always when it is tight
+        report = [plan.describe()] if trace is not None or not plan.fits else []
+        if trace is not None:
+            report.append(trace.format_summary())
+        self.timings_label.set_label("\n\n".join(report))
+        self.timings_label.set_visible(bool(report))
         return False  # remove this idle callback
 
+    def _fail_redraw(self, generation, text):
+        # runs in GTK’s thread; the previous result, if any, stays up
+        if generation != self._redraw_generation:
+            return False
+        self.loader_spinner.stop()
+        self.main_content_stack.set_visible_child_name("image")
+        self.export_button.set_sensitive(self._result_scale is not None)
+        self.redraw_button.set_sensitive(True)
+        self.progress.set_visible(False)
+        return self._show_error(text)
+
     @Gtk.Template.Callback()
     def on_export_clicked(self, *_):
-        if not self.polygons:
+        if self._result_scale is None:
+            return  # no polygons, or none for the current print size and nozzle
+        if self._settings_error is not None:
+            self._show_error(f"Cannot export: {self._settings_error}")
             return
 
         # 1️⃣ Create a FileChooserNative for SAVE, with a .zip filter
@@ -372,26 +760,39 @@ class Drucken3dWindow(Adw.ApplicationWindow):
             progress_bar.set_text(f"{int(frac * 100)}%")
             return False  # one-shot callback
 
-        # 2️⃣ Create ZIP in write mode with DEFLATE compression :contentReference[oaicite:11]{index=11}
-        with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
-            # Generate meshes; report progress via GLib.idle_add :contentReference[oaicite:12]{index=12}
-            meshes = polygons_to_meshes_parallel(
-                self.segmented_image,
-                self.polygons[1:],
-                layer_height=self.layer_height_spin.get_value(),
-                target_max_cm=self.max_size_spin.get_value(),
-                base_layers=self.base_layers_spin.get_value(),
-                progress_cb=lambda f: GLib.idle_add(_report, f)
-            )
-            # 3️⃣ Write each mesh into the zip using an in-memory buffer :contentReference[oaicite:13]{index=13}
-            for idx, mesh in enumerate(meshes):
-                buf = BytesIO()
-                mesh.export(file_obj=buf, file_type='stl')
-                archive.writestr(f"mesh_{idx}.stl",
-                                 buf.getvalue())  # grab bytes via getvalue() :contentReference[oaicite:14]{index=14}
+        try:
+            # 2️⃣ Create ZIP in write mode with DEFLATE compression :contentReference[oaicite:11]{index=11}
+            with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+                # 3️⃣ Write each mesh into the zip as soon as its layer is complete
+                def _write_mesh(idx, mesh):
+                    buf = BytesIO()
+                    mesh.export(file_obj=buf, file_type='stl')
+                    archive.writestr(f"mesh_{idx}.stl",
+                                     buf.getvalue())  # grab bytes via getvalue() :contentReference[oaicite:14]{index=14}
+
+                # Extrude and write in one stream; report progress via GLib.idle_add :contentReference[oaicite:12]{index=12}
+                segmented_image, polygons = self._current_result()
+                mesh_count = stream_export(
+                    segmented_image,
+                    self.shades,
+                    _write_mesh,
+                    polys_list=polygons[1:],
+                    layer_height=self.layer_height_spin.get_value(),
+                    target_max_cm=self.max_size_spin.get_value(),
+                    nozzle_mm=self.nozzle_width_spin.get_value(),
+                    base_layers=self.base_layers_spin.get_value(),
+                    progress_cb=lambda f: GLib.idle_add(_report, f),
+                    cache=self._mesh_cache,
+                    plan=self._plan,
+                )
+        except Exception as e:
+            # a failed worker or writer must not leave the progress dialog up for good
+            print(f"Export failed: {e}")
+            GLib.idle_add(self._fail_export, zip_path, f"Could not export {zip_path}: {e}", dialog)
+            return
 
         # When done, schedule the finish callback on the GTK thread
-        GLib.idle_add(self._finish_export, len(meshes), dialog)  # :contentReference[oaicite:15]{index=15}
+        GLib.idle_add(self._finish_export, mesh_count, dialog)  # :contentReference[oaicite:15]{index=15}
 
     def _start_export_thread(self, zip_path):
         # Build a modal dialog with NO close button
@@ -417,6 +818,14 @@ class Drucken3dWindow(Adw.ApplicationWindow):
         )
         thread.start()
 
+    def _fail_export(self, zip_path, text, dialog):
+        dialog.destroy()
+        try:
+            os.remove(zip_path)  # the archive was left incomplete
+        except OSError:
+            pass
+        return self._show_error(text)
+
     def _finish_export(self, mesh_count, dialog):
         dialog.destroy()
         msg = Gtk.MessageDialog(
@@ -430,3 +839,218 @@ class Drucken3dWindow(Adw.ApplicationWindow):
         return False
 
 
+
+    def _show_error(self, text):
+        msg = Gtk.MessageDialog(
+            transient_for=self, modal=True,
+            message_type=Gtk.MessageType.ERROR,
+            buttons=Gtk.ButtonsType.OK,
+            text=text
+        )
+        msg.connect("response", lambda d, r: d.destroy())
+        msg.show()
+        return False
+
+    def _uses_project_result(self):
+        """Whether the current result is the opened project's stored one: no redraw since it was opened."""
+        return (not self.polygons and self._result_scale is not None
+                and self._project is not None and self._project.has_polygons)
+
+    def _current_result(self):
+        """Segmented image and polygons of the last redraw, read from the opened project if there was none since."""
+        if self._uses_project_result():
+            self.segmented_image = self._project.segmented_image()
+            self.polygons = self._project.polygons()
+        return self.segmented_image, self.polygons
+
+    def on_open_project(self, *_):
+        chooser = Gtk.FileChooserNative(
+            title="Open Project",
+            transient_for=self,
+            action=Gtk.FileChooserAction.OPEN,
+            accept_label="_Open",
+            cancel_label="_Cancel",
+        )
+        project_filter = Gtk.FileFilter()
+        project_filter.set_name("Stratum projects")
+        project_filter.add_pattern("*" + PROJECT_EXTENSION)
+        chooser.add_filter(project_filter)
+
+        def _on_choice(dialog, response):
+            if response == Gtk.ResponseType.ACCEPT:
+                gfile = dialog.get_file()
+                if gfile:
+                    self._open_project(gfile.get_path())
+            dialog.destroy()
+
+        chooser.connect("response", _on_choice)
+        chooser.show()
+
+    def _open_project(self, path):
+        try:
+            project = load_project(path)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            self._show_error(f"Could not open {path}: {e}")
+            return
+        if self._project is not None:
+            self._project.close()
+        self._project = project
+
+        # anything still running belongs to the previous image
+        self._redraw_generation += 1
+        self.redraw_button.set_sensitive(True)
+        if self._live_redraw_source:
+            GLib.source_remove(self._live_redraw_source)
+            self._live_redraw_source = 0
+        # only the header is read here; the first redraw decodes the source
+        self._image = project.source_image()
+        self._image_source = project
+        self._clear_image_caches()
+
+        self._store.remove_all()
+        for filament in project.filaments:
+            rgba = Gdk.RGBA()
+            rgba.red, rgba.green, rgba.blue, rgba.alpha = filament["rgba"]
+            self._store.append(ColorObject(rgba, filament["cover_factor"]))
+        self._refresh_list()
+        for spin, handler in zip((self.max_size_spin, self.nozzle_width_spin), self._print_scale_handlers):
+            spin.handler_block(handler)
+        for spin, key in ((self.layer_height_spin, "layer_height"),
+                          (self.base_layers_spin, "base_layers"),
+                          (self.max_size_spin, "max_size_cm"),
+                          (self.nozzle_width_spin, "nozzle_mm")):
+            if key in project.settings:
+                spin.set_value(project.settings[key])
+        for spin, handler in zip((self.max_size_spin, self.nozzle_width_spin), self._print_scale_handlers):
+            spin.handler_unblock(handler)
+
+        # the result itself stays in the file until an export needs it
+        self.shades = project.shades
+        self.segmented_image = None
+        self.polygons = []
+        self._plan = None
+        # the stored polygons were simplified for the stored print size and nozzle
+        self._result_scale = self._print_scale() if project.has_polygons else None
+        preview = project.preview
+        self._preview_pixbuf = _array_to_pixbuf(preview) if preview is not None else None
+        if self._preview_pixbuf is not None:
+            self.mesh_view_container.set_from_pixbuf(self._preview_pixbuf)
+            self.loader_spinner.stop()
+            self.main_content_stack.set_visible_child_name("image")
+        else:
+            # no stored preview: show the source, decoded like an opened image
+            self.main_content_stack.set_visible_child_name("loader")
+            self.loader_spinner.start()
+            thread = threading.Thread(
+                target=self._background_load_image,
+                args=(project.open_source(), PREVIEW_MAX_SIDE, path,
+                      functools.partial(self._finish_project_source, self._redraw_generation)),
+                daemon=True
+            )
+            thread.start()
+        self.progress.set_visible(False)
+        self.timings_label.set_visible(False)
+
+        colors, cover_factors = self._filament_colors()
+        current = project.has_polygons and project.shades == generate_shades(colors, cover_factors)
+        self.export_button.set_sensitive(project.has_polygons)
+        if current:
+            self.redraw_banner.set_revealed(False)
+        else:
+            self._on_filament_change("Project opened. Redraw required.")
+        print(f"Opened project {path}")
+
+    def _finish_project_source(self, generation, path, image):
+        # runs in GTK’s thread; a redraw or another image since then has its own picture
+        try:
+            if generation != self._redraw_generation:
+                return False
+            self.mesh_view_container.set_from_pixbuf(_array_to_pixbuf(image.pixels))
+            self.loader_spinner.stop()
+            self.main_content_stack.set_visible_child_name("image")
+        finally:
+            image.close()
+        return False
+
+    def on_save_project(self, *_):
+        if self._image is None:
+            print("Load an image before saving a project.")
+            return
+
+        chooser = Gtk.FileChooserNative(
+            title="Save Project",
+            transient_for=self,
+            action=Gtk.FileChooserAction.SAVE,
+            accept_label="_Save",
+            cancel_label="_Cancel",
+        )
+        chooser.set_current_name("project" + PROJECT_EXTENSION)
+        project_filter = Gtk.FileFilter()
+        project_filter.set_name("Stratum projects")
+        project_filter.add_pattern("*" + PROJECT_EXTENSION)
+        chooser.add_filter(project_filter)
+
+        def _on_choice(dialog, response):
+            if response == Gtk.ResponseType.ACCEPT:
+                gfile = dialog.get_file()
+                if gfile:
+                    path = gfile.get_path()
+                    if not path.endswith(PROJECT_EXTENSION):
+                        path += PROJECT_EXTENSION
+                    self._start_save_project(path)
+            dialog.destroy()
+
+        chooser.connect("response", _on_choice)
+        chooser.show()
+
+    def _start_save_project(self, path):
+        filaments = []
+        for i in range(self._store.get_n_items()):
+            item = self._store.get_item(i)
+            rgba = item.rgba
+            filaments.append({"rgba": [rgba.red, rgba.green, rgba.blue, rgba.alpha],
+                              "cover_factor": item.cover_factor})
+        settings = {
+            "layer_height": self.layer_height_spin.get_value(),
+            "base_layers": self.base_layers_spin.get_value(),
+            "max_size_cm": self.max_size_spin.get_value(),
+            "nozzle_mm": self.nozzle_width_spin.get_value(),
+        }
+        preview = _pixbuf_to_array(self._preview_pixbuf) if self._preview_pixbuf is not None else None
+        # opening an image or project replaces all of these while the save runs, and closes
+        # the opened project, so the save gets them as they are now
+        if self._uses_project_result():
+            # no redraw since the project was opened: its stored result is carried over.
+            # The arrays are memory-mapped on their own and stay readable after close().
+            labels, polygons = self._project.labels, self._project.polygons()
+        else:
+            labels, polygons = None, self.polygons
+        result = (self.shades, self.segmented_image, labels, polygons)
+        # the stored source is read through an archive of the save's own
+        source_path = self._image_source.path if isinstance(self._image_source, Project) else None
+        thread = threading.Thread(
+            target=self._background_save_project,
+            args=(path, filaments, settings, preview, self._image, source_path, result),
+            daemon=True
+        )
+        thread.start()
+
+    def _background_save_project(self, path, filaments, settings, preview, image, source_path, result):
+        shades, segmented_image, labels, polygons = result
+        if labels is None and segmented_image is not None:
+            labels = image_to_labels(segmented_image, shades)
+        try:
+            # a project's source is carried over as stored, not re-encoded from the working copy
+            source = None
+            if source_path is not None:
+                stored = load_project(source_path)
+                try:
+                    source = stored.source_bytes()
+                finally:
+                    stored.close()
+            save_project(path, image, filaments, settings, shades=shades, labels=labels,
+                         polygons=polygons or None, preview=preview if polygons else None, source=source)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            GLib.idle_add(self._show_error, f"Could not save {path}: {e}")
+            return
+        print(f"Saved project {path}")
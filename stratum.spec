@@ -42,9 +42,7 @@ a = Analysis(
         "shapely",
         "shapely.geometry",
         "shapely.affinity",
-        "descartes",
         "trimesh",
-        "trimesh.path.packing",
         "geopandas",
         "threading",
         "gettext",